@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import time
+import random
+import difflib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.matching import MatchQuery, RAPIDFUZZ_AVAILABLE  # noqa: E402
+
+# 标题/作者匹配的微基准 + 回归对比
+# - 旧实现: 原 openalex.py 的 get_similarity_score / check_author_match 与 semantic_scholar.py 的内联逻辑
+# - 新实现: services/matching.py 的 MatchQuery (一次归一化 + 批量打分)
+# 用法: python benchmarks/bench_matching.py [查询数量]
+
+
+# ---------- 旧实现 (原样保留用于对比) ----------
+
+def legacy_check_author_match(query_author, paper_authors):
+    if not query_author:
+        return True
+
+    q_parts = set(query_author.lower().replace(",", "").replace(".", "").split())
+    q_parts.discard("et")
+    q_parts.discard("al")
+
+    for db_author in paper_authors:
+        db_parts = set(db_author.lower().replace(",", "").replace(".", "").split())
+        if q_parts.intersection(db_parts):
+            return True
+    return False
+
+
+def legacy_get_similarity_score(str1, str2):
+    s1 = re.sub(r'[^\w\s]', '', str1.lower())
+    s2 = re.sub(r'[^\w\s]', '', str2.lower())
+    return difflib.SequenceMatcher(None, s1, s2).ratio()
+
+
+def legacy_s2_pick(title, author, papers):
+    clean_title = title.lower().replace('"', '').replace("'", "").strip()
+    for idx, (paper_title, paper_authors, _, _) in enumerate(papers):
+        author_match = False
+        if author:
+            q_parts = set(author.lower().replace(",", "").split())
+            for db_author in paper_authors:
+                db_parts = set(db_author.lower().replace(",", "").split())
+                if q_parts.intersection(db_parts):
+                    author_match = True
+                    break
+        else:
+            author_match = True
+        title_sim = difflib.SequenceMatcher(None, clean_title, paper_title.lower()).ratio()
+        if (author_match and title_sim > 0.6) or (title_sim > 0.9):
+            return idx
+    return None
+
+
+# ---------- OpenAlex 判定 (打分规则与 openalex.py 相同，只替换相似度/作者函数) ----------
+
+def openalex_pick(year, author, scored, papers):
+    target_year = int(year) if (year and year.isdigit()) else None
+    best_idx, best_score, best_auth = None, -1.0, False
+    for idx, ((title_sim, auth_match), (_, _, paper_year, cited)) in enumerate(zip(scored, papers)):
+        score = title_sim
+        if author and not auth_match:
+            score *= 0.6
+        if target_year and paper_year and abs(target_year - paper_year) <= 1:
+            score += 0.15
+        if cited > 100:
+            score += 0.05
+        if score > best_score:
+            best_idx, best_score, best_auth = idx, score, auth_match
+
+    threshold = 0.6
+    if author and target_year and best_auth and abs(target_year - papers[best_idx][2]) <= 1:
+        threshold = 0.4
+    return best_idx if best_score >= threshold else None
+
+
+def legacy_openalex_pick(title, author, year, papers):
+    scored = [(legacy_get_similarity_score(title, t), legacy_check_author_match(author, a)) for t, a, _, _ in papers]
+    return openalex_pick(year, author, scored, papers)
+
+
+def new_openalex_pick(title, author, year, papers):
+    scored = MatchQuery(title, author).score_candidates([(t, a) for t, a, _, _ in papers])
+    return openalex_pick(year, author, scored, papers)
+
+
+def new_s2_pick(title, author, papers):
+    scored = MatchQuery(title, author).score_candidates([(t, a) for t, a, _, _ in papers])
+    for idx, (title_sim, author_match) in enumerate(scored):
+        if (author_match and title_sim > 0.6) or (title_sim > 0.9):
+            return idx
+    return None
+
+
+# ---------- 回归语料 (固定随机种子生成) ----------
+
+TITLES = [
+    "Attention Is All You Need",
+    "Deep Residual Learning for Image Recognition",
+    "BERT: Pre-training of Deep Bidirectional Transformers for Language Understanding",
+    "Generative Adversarial Nets",
+    "ImageNet Classification with Deep Convolutional Neural Networks",
+    "Long Short-Term Memory",
+    "Adam: A Method for Stochastic Optimization",
+    "Dropout: A Simple Way to Prevent Neural Networks from Overfitting",
+    "Language Models are Few-Shot Learners",
+    "Mastering the game of Go with deep neural networks and tree search",
+    "Basic Emotions",
+    "An Argument for Basic Emotions",
+    "The Structure of Scientific Revolutions",
+    "A Mathematical Theory of Communication",
+    "Human-level control through deep reinforcement learning",
+    "Effective Approaches to Attention-based Neural Machine Translation",
+    "Neural Machine Translation by Jointly Learning to Align and Translate",
+    "U-Net: Convolutional Networks for Biomedical Image Segmentation",
+    "Sequence to Sequence Learning with Neural Networks",
+    "Highly accurate protein structure prediction with AlphaFold",
+    "深度学习在医学影像中的应用综述",
+    "基于注意力机制的中文命名实体识别",
+    "大規模言語モデルの評価手法に関する研究",
+    "Thinking, Fast and Slow",
+    "Prospect Theory: An Analysis of Decision under Risk",
+]
+
+AUTHORS = [
+    ["Ashish Vaswani", "Noam Shazeer"], ["Kaiming He", "Xiangyu Zhang"], ["Jacob Devlin", "Ming-Wei Chang"],
+    ["Ian Goodfellow"], ["Alex Krizhevsky", "Geoffrey E. Hinton"], ["Sepp Hochreiter", "Jürgen Schmidhuber"],
+    ["Diederik P. Kingma", "Jimmy Ba"], ["Nitish Srivastava"], ["Tom B. Brown"], ["David Silver"],
+    ["Paul Ekman"], ["Paul Ekman"], ["Thomas S. Kuhn"], ["Claude E. Shannon"], ["Volodymyr Mnih"],
+    ["Minh-Thang Luong"], ["Dzmitry Bahdanau"], ["Olaf Ronneberger"], ["Ilya Sutskever"], ["John Jumper"],
+    ["张伟", "李娜"], ["王芳"], ["山田 太郎"], ["Daniel Kahneman"], ["Daniel Kahneman", "Amos Tversky"],
+]
+
+
+def perturb_title(rng, title):
+    choice = rng.random()
+    if choice < 0.2:
+        return title
+    if choice < 0.35:
+        return title.lower()
+    if choice < 0.5 and ":" in title:
+        return title.split(":")[0]
+    if choice < 0.65 and len(title) > 6:
+        i = rng.randrange(1, len(title) - 2)
+        return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+    if choice < 0.8:
+        return f"“{title}”"
+    words = title.split()
+    return " ".join(words[:max(2, len(words) - 2)])
+
+
+def query_author(rng, authors):
+    name = authors[0]
+    choice = rng.random()
+    if choice < 0.2:
+        return None
+    if choice < 0.5:
+        return name.split()[-1] + " et al."
+    if choice < 0.7:
+        return name + "等" if any("一" <= ch <= "鿿" for ch in name) else name.upper()
+    return name
+
+
+def build_corpus(size, seed=42):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        idx = rng.randrange(len(TITLES))
+        papers = []
+        for j in rng.sample(range(len(TITLES)), 19) + [idx]:
+            papers.append((TITLES[j], AUTHORS[j], rng.randint(1948, 2024), rng.choice([0, 50, 5000])))
+        rng.shuffle(papers)
+        year = str(rng.randint(1948, 2024)) if rng.random() < 0.5 else None
+        corpus.append((perturb_title(rng, TITLES[idx]), query_author(rng, AUTHORS[idx]), year, papers))
+    return corpus
+
+
+def bench(label, fn, corpus):
+    start = time.perf_counter()
+    decisions = [fn(*case) for case in corpus]
+    elapsed = time.perf_counter() - start
+    per_query = elapsed / len(corpus) * 1e6
+    print(f"{label:<28} {elapsed * 1000:>9.1f} ms   {per_query:>8.1f} µs/query")
+    return decisions
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    corpus = build_corpus(size)
+    s2_corpus = [(t, a, p) for t, a, _, p in corpus]
+
+    print(f"Queries: {size} × 20 candidates   (rapidfuzz: {RAPIDFUZZ_AVAILABLE})\n")
+    old_oa = bench("legacy OpenAlex scoring", legacy_openalex_pick, corpus)
+    new_oa = bench("MatchQuery OpenAlex scoring", new_openalex_pick, corpus)
+    old_s2 = bench("legacy S2 scoring", legacy_s2_pick, s2_corpus)
+    new_s2 = bench("MatchQuery S2 scoring", new_s2_pick, s2_corpus)
+
+    print()
+    for label, old, new in (("OpenAlex", old_oa, new_oa), ("Semantic Scholar", old_s2, new_s2)):
+        same = sum(o == n for o, n in zip(old, new))
+        print(f"{label:<18} decision agreement: {same}/{len(old)} ({same / len(old):.2%})")
+        diffs = [(case[0], case[1], o, n) for case, o, n in zip(corpus, old, new) if o != n][:5]
+        for title, author, o, n in diffs:
+            print(f"    differs: {title!r} / {author!r}: legacy={o} new={n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+from services.openalex import (  # noqa: E402
+    reconstruct_abstract, OPENALEX_SEARCH_FIELDS, OPENALEX_DETAIL_FIELDS
+)
+
+# OpenAlex 载荷与摘要还原基准
+# - 离线 (默认): 合成倒排索引，比较旧/新还原算法耗时，以及每次检索因去掉摘要字段省下的字节数
+# - 在线 (--live): 对真实 api.openalex.org 比较 全字段 vs select= 的传输字节数
+# 用法: python benchmarks/bench_openalex_payload.py [--live]
+
+LIVE_TITLES = [
+    "Attention Is All You Need",
+    "Deep Residual Learning for Image Recognition",
+    "An Argument for Basic Emotions",
+    "Long Short-Term Memory",
+    "A Mathematical Theory of Communication",
+]
+
+
+def legacy_reconstruct_abstract(inverted_index):
+    if not inverted_index:
+        return ""
+    word_list = []
+    for word, positions in inverted_index.items():
+        for pos in positions:
+            word_list.append((pos, word))
+    word_list.sort(key=lambda x: x[0])
+    return " ".join([w[1] for w in word_list])
+
+
+def synthetic_inverted_index(rng, length):
+    vocab = [f"word{i}" for i in range(length // 2)] + ["the", "of", "and", "a", "to", "in"] * 8
+    index = {}
+    for pos in range(length):
+        index.setdefault(rng.choice(vocab), []).append(pos)
+    return index
+
+
+def time_decode(fn, indexes, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for idx in indexes:
+            fn(idx)
+    return (time.perf_counter() - start) / (rounds * len(indexes)) * 1e6
+
+
+def offline():
+    rng = random.Random(7)
+    indexes = [synthetic_inverted_index(rng, rng.randint(120, 400)) for _ in range(200)]
+
+    assert all(legacy_reconstruct_abstract(i) == reconstruct_abstract(i) for i in indexes)
+    old = time_decode(legacy_reconstruct_abstract, indexes, 20)
+    new = time_decode(reconstruct_abstract, indexes, 20)
+    print("Abstract decode (synthetic, 120-400 words)")
+    print(f"  legacy sort-based   {old:>8.1f} µs/abstract")
+    print(f"  direct placement    {new:>8.1f} µs/abstract   ({old / new:.1f}x)\n")
+
+    # 旧实现每次检索下载 20 条候选的摘要倒排索引，新实现只下载选中论文的一条
+    per_result = sum(len(json.dumps(i)) for i in indexes) / len(indexes)
+    print("abstract_inverted_index payload per title lookup (20 candidates)")
+    print(f"  legacy (all candidates)   {per_result * 20 / 1024:>7.1f} KiB")
+    print(f"  lazy (winner only)        {per_result / 1024:>7.1f} KiB")
+
+
+async def live():
+    async with httpx.AsyncClient(base_url="https://api.openalex.org", timeout=30) as client:
+        print(f"{'title':<45} {'full':>10} {'select':>10} {'+abstract':>10}")
+        totals = [0, 0]
+        for title in LIVE_TITLES:
+            base = {"search": title, "per_page": 20}
+            full = await client.get("/works", params=base)
+            slim = await client.get("/works", params={**base, "select": OPENALEX_SEARCH_FIELDS})
+            results = slim.json().get("results", [])
+            extra = 0
+            if results:
+                short_id = results[0]["id"].rsplit("/", 1)[-1]
+                abstract = await client.get(f"/works/{short_id}", params={"select": "abstract_inverted_index"})
+                extra = len(abstract.content)
+
+            totals[0] += len(full.content)
+            totals[1] += len(slim.content) + extra
+            print(f"{title[:44]:<45} {len(full.content):>10} {len(slim.content):>10} {extra:>10}")
+
+            indexes = [r["abstract_inverted_index"] for r in full.json().get("results", [])
+                       if r.get("abstract_inverted_index")]
+            if indexes:
+                old = time_decode(legacy_reconstruct_abstract, indexes, 50)
+                new = time_decode(reconstruct_abstract, indexes, 50)
+                print(f"{'':<45} decode: legacy {old:.1f} µs, new {new:.1f} µs")
+
+        print(f"\nTotal bytes: full {totals[0]}, select + lazy abstract {totals[1]} "
+              f"({1 - totals[1] / totals[0]:.0%} less)")
+        print(f"DOI lookups use: select={OPENALEX_DETAIL_FIELDS}")
+
+
+if __name__ == "__main__":
+    if "--live" in sys.argv:
+        asyncio.run(live())
+    else:
+        offline()
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.prescreen import prescreen_consistency, prescreen_stats  # noqa: E402
+
+# 评估本地预筛：短路比例，以及短路判定与标注 (或实时 LLM 判定) 的一致率
+# 标注文件为 JSONL: {"claim": ..., "abstract": ..., "label": "REAL|MISMATCH|SUSPICIOUS|UNVERIFIED"}
+# 用法: python benchmarks/eval_prescreen.py [labeled.jsonl] [--llm]
+#   --llm  忽略文件中的 label，改用 Gemini 实时判定作为参照 (需要 GEMINI_API_KEY)
+
+DEFAULT_SET = os.path.join(os.path.dirname(__file__), "prescreen_labeled.jsonl")
+
+
+async def llm_labels(cases):
+    from services.auditor import _ask_model
+    verdicts = await asyncio.gather(*[_ask_model(c["claim"], c["abstract"]) for c in cases])
+    return [v.get("status") for v in verdicts]
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    path = args[0] if args else DEFAULT_SET
+    with open(path, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    labels = asyncio.run(llm_labels(cases)) if "--llm" in sys.argv else [c["label"] for c in cases]
+
+    agree = 0
+    confusion = {}
+    for case, label in zip(cases, labels):
+        verdict = prescreen_consistency(case["claim"], case["abstract"])
+        if verdict is None:
+            continue
+        confusion[(label, verdict["status"])] = confusion.get((label, verdict["status"]), 0) + 1
+        if verdict["status"] == label:
+            agree += 1
+        else:
+            print(f"  disagree: label={label} prescreen={verdict['status']}  claim={case['claim'][:60]!r}")
+
+    decided = prescreen_stats["short_circuited"]
+    print(f"\nCases: {len(cases)}")
+    print(f"Short-circuited: {decided} ({decided / len(cases):.0%}) → LLM calls saved")
+    if decided:
+        print(f"Agreement on short-circuited cases: {agree}/{decided} ({agree / decided:.0%})")
+    print("By verdict:", {k: v for k, v in prescreen_stats.items() if k not in ("checked", "short_circuited")})
+    print("Confusion (label, prescreen):", confusion)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+from benchmarks.mock_upstreams import synthetic_title, synthetic_doi, synthetic_paper  # noqa: E402
+
+# /api/audit 端到端压测：吞吐、总延迟与首条 NDJSON 记录延迟的 p50 / p95 / p99
+# - 默认 (--spawn) 在本地启动 mock_upstreams.py 与后端，完全离线，可用于回归对比
+# - --url 则压测已在运行的后端 (后端需关闭限流 RATE_LIMIT=0，否则会被 10/minute 拦截)
+# 用法:
+#   python benchmarks/load_audit.py --spawn --requests 200 --concurrency 16
+#   python benchmarks/load_audit.py --spawn --mock-args "--gemini-latency 800,0.5 --s2-rps 5" --app-env RESOLVE_MODE=hedged
+#   python benchmarks/load_audit.py --url http://127.0.0.1:8000 --doc-kind bibliography --json
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+
+# ---------- 测试文档 ----------
+
+def _claim(title: str, paraphrase: bool) -> str:
+    words = [w for w in title.lower().split() if w.isalpha() and w != "for"]
+    if paraphrase:
+        # 与摘要只有部分重合，本地预筛无法判定，会走 Gemini 一致性审计
+        return f"a {words[0]} framework that generalizes to noisy deployments in industry"
+    return f"a method for {words[-1]} that improves {words[0]} {words[1]}"
+
+
+def build_document(rng: random.Random, kind: str, citations: int, corpus: int, doi_rate: float,
+                   llm_claim_rate: float) -> str:
+    """
+    prose: 正文里的引用 (交给 Gemini 抽取，带可核对的 claim；llm_claim_rate 控制需要 LLM 判定的比例)
+    bibliography: APA 参考文献列表 (本地解析，按 doi_rate 附带 DOI 以走批量查询)
+    """
+    lines = []
+    for _ in range(citations):
+        index = rng.randrange(corpus)
+        title = synthetic_title(index)
+        paper = synthetic_paper(title)
+        surname = paper["authors"][0].split()[-1]
+        if kind == "prose":
+            lines.append(f'As {surname} et al. reported in their {paper["year"]} study "{title}", '
+                         f'the authors proposed {_claim(title, rng.random() < llm_claim_rate)}.')
+        else:
+            authors = ", & ".join(f"{a.split()[-1]}, {a.split()[0]}" for a in paper["authors"])
+            doi = f" https://doi.org/{synthetic_doi(index)}" if rng.random() < doi_rate else ""
+            lines.append(f"{authors} ({paper['year']}). {title}. Journal of Mock Studies, 12(3), 45-67.{doi}")
+    return "\n".join(lines)
+
+
+# ---------- 压测 ----------
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # nearest-rank
+    return ordered[min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered)))) - 1]
+
+
+async def run_one(client: httpx.AsyncClient, url: str, text: str, timing: bool) -> dict:
+    started = time.perf_counter()
+    outcome = {"status_code": None, "ttfr": None, "latency": None, "records": 0, "statuses": {}, "timing": None,
+               "error": None}
+    try:
+        async with client.stream("POST", url, json={"text": text}, params={"timing": 1} if timing else None) as resp:
+            outcome["status_code"] = resp.status_code
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                if outcome["ttfr"] is None:
+                    outcome["ttfr"] = time.perf_counter() - started
+                record = json.loads(line)
+                if record.get("type") == "timing":
+                    outcome["timing"] = record
+                    continue
+                outcome["records"] += 1
+                status = record.get("status", "?")
+                outcome["statuses"][status] = outcome["statuses"].get(status, 0) + 1
+    except Exception as e:
+        outcome["error"] = f"{type(e).__name__}: {e}"
+    outcome["latency"] = time.perf_counter() - started
+    return outcome
+
+
+async def run_load(base_url: str, args) -> dict:
+    rng = random.Random(args.seed)
+    documents = [build_document(rng, args.doc_kind, args.citations, args.corpus, args.doi_rate,
+                                args.llm_claim_rate)
+                 for _ in range(args.requests)]
+    url = base_url.rstrip("/") + "/api/audit"
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def bounded(text):
+            async with semaphore:
+                return await run_one(client, url, text, args.timing)
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(bounded(text) for text in documents))
+        wall = time.perf_counter() - started
+
+        extra = {}
+        for name, path in (("backend", "/api/upstreams"), ("mock", None)):
+            target = (args.mock_url + "/_mock/stats") if path is None else base_url.rstrip("/") + path
+            if path is None and not args.mock_url:
+                continue
+            try:
+                extra[name] = (await client.get(target)).json()
+            except Exception as e:
+                extra[name] = {"error": str(e)}
+
+    return summarize(outcomes, wall, args, extra)
+
+
+def summarize(outcomes: List[dict], wall: float, args, extra: dict) -> dict:
+    ok = [o for o in outcomes if o["status_code"] == 200 and not o["error"]]
+    http_statuses, record_statuses, stage_totals = {}, {}, {}
+    for o in outcomes:
+        key = str(o["status_code"]) if o["status_code"] else "exception"
+        http_statuses[key] = http_statuses.get(key, 0) + 1
+        for status, count in o["statuses"].items():
+            record_statuses[status] = record_statuses.get(status, 0) + count
+        for stage, s in ((o["timing"] or {}).get("stages") or {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + s["total_ms"]
+
+    def ms(values, pct):
+        value = percentile(values, pct)
+        return round(value * 1000, 1) if value is not None else None
+
+    latencies = [o["latency"] for o in ok]
+    ttfrs = [o["ttfr"] for o in ok if o["ttfr"] is not None]
+    records = sum(o["records"] for o in outcomes)
+    return {
+        "config": {k: getattr(args, k) for k in ("requests", "concurrency", "citations", "doc_kind", "corpus",
+                                                  "doi_rate", "llm_claim_rate", "seed")},
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else None,
+        "citations_per_s": round(records / wall, 2) if wall else None,
+        "error_rate": round(1 - len(ok) / len(outcomes), 4) if outcomes else None,
+        "record_error_rate": round(record_statuses.get("ERROR", 0) / records, 4) if records else None,
+        "latency_ms": {f"p{p}": ms(latencies, p) for p in (50, 95, 99)},
+        "ttfr_ms": {f"p{p}": ms(ttfrs, p) for p in (50, 95, 99)},
+        "http_statuses": http_statuses,
+        "record_statuses": record_statuses,
+        "errors": sorted({o["error"] for o in outcomes if o["error"]})[:5],
+        "avg_stage_ms": {k: round(v / max(len(ok), 1), 1) for k, v in sorted(stage_totals.items())},
+        **extra,
+    }
+
+
+def print_report(report: dict):
+    cfg = report["config"]
+    print(f"\n/api/audit  {cfg['requests']} requests × {cfg['citations']} citations ({cfg['doc_kind']}), "
+          f"concurrency {cfg['concurrency']}")
+    print(f"  wall time          {report['wall_s']:>8} s")
+    print(f"  throughput         {report['throughput_rps']:>8} req/s   {report['citations_per_s']} citations/s")
+    print(f"  request errors     {report['error_rate']:>8.2%}     ERROR records {report['record_error_rate'] or 0:.2%}")
+    print(f"  {'':18} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for label, key in (("latency", "latency_ms"), ("first record", "ttfr_ms")):
+        row = report[key]
+        print(f"  {label:<18} {row['p50'] or '-':>8} {row['p95'] or '-':>8} {row['p99'] or '-':>8}")
+    print(f"  HTTP statuses      {report['http_statuses']}")
+    print(f"  record statuses    {report['record_statuses']}")
+    for error in report["errors"]:
+        print(f"  error: {error}")
+    if report["avg_stage_ms"]:
+        print("  avg stage time per request (ms):")
+        for stage, value in report["avg_stage_ms"].items():
+            print(f"    {stage:<28} {value:>8}")
+    mock = report.get("mock", {}).get("upstreams")
+    if mock:
+        print("  mock upstreams:")
+        for name, s in mock.items():
+            print(f"    {name:<18} requests {s['requests']:>6}  throttled {s['throttled']:>5}  "
+                  f"errors {s['errors']:>5}  max in-flight {s['max_inflight']}")
+
+
+# ---------- 本地启动 mock + 后端 ----------
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, log_path: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited early, see {log_path}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}, see {log_path}")
+
+
+def spawn_stack(args, workdir: str) -> tuple:
+    http_port, grpc_port, app_port = _free_port(), _free_port(), _free_port()
+    mock_log = open(os.path.join(workdir, "mock.log"), "w")
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_upstreams.py"), "--http-port", str(http_port),
+         "--grpc-port", str(grpc_port), *args.mock_args.split()],
+        stdout=mock_log, stderr=subprocess.STDOUT,
+    )
+    mock_url = f"http://127.0.0.1:{http_port}"
+
+    env = dict(os.environ)
+    env.update({
+        "OPENALEX_BASE_URL": mock_url,
+        "S2_BASE_URL": mock_url,
+        "GEMINI_BASE_URL": mock_url,
+        "GEMINI_GRPC_TARGET": f"127.0.0.1:{grpc_port}",
+        # SDK 不允许 transport 与 API key 同时存在；空字符串也能阻止 load_dotenv 读入 .env 里的真实 key
+        "GEMINI_API_KEY": "",
+        "GOOGLE_API_KEY": "",
+        "RATE_LIMIT": "0",
+        "OPENALEX_LOCAL_INDEX": "",
+        # 所有持久化状态都放在临时目录：不写入开发者的真实缓存 / 会话库，每次压测都从冷缓存开始
+        # (空字符串同样能阻止 load_dotenv 读入 .env 里的配置；需要预热或共享时用 --app-env 覆盖)
+        "PAPER_CACHE_DB": os.path.join(workdir, "paper_cache.db"),
+        "VERDICT_CACHE_DB": os.path.join(workdir, "verdict_cache.db"),
+        "EXTRACTION_CACHE_DB": os.path.join(workdir, "extraction_cache.db"),
+        "AUDIT_SESSION_DB": os.path.join(workdir, "audit_sessions.db"),
+        "REDIS_URL": "",
+        "PYTHONUNBUFFERED": "1",
+    })
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    app_log = open(os.path.join(workdir, "app.log"), "w")
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env, stdout=app_log, stderr=subprocess.STDOUT,
+    )
+    processes = [mock, app]
+    try:
+        _wait_ready(mock_url + "/_mock/stats", mock, mock_log.name)
+        _wait_ready(f"http://127.0.0.1:{app_port}/", app, app_log.name)
+    except Exception:
+        stop_stack(processes)
+        raise
+    return f"http://127.0.0.1:{app_port}", mock_url, processes
+
+
+def stop_stack(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="End-to-end load test for /api/audit")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="已在运行的后端地址")
+    target.add_argument("--spawn", action="store_true", help="本地启动 mock 上游与后端")
+    parser.add_argument("--mock-url", default="", help="配合 --url：mock 服务地址，用于汇总上游统计")
+    parser.add_argument("--mock-args", default="", help="传给 mock_upstreams.py 的参数 (--spawn)")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="后端额外环境变量 (--spawn)，可重复")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--citations", type=int, default=5, help="每篇文档的引用数 (/api/audit 上限 10)")
+    parser.add_argument("--doc-kind", choices=("prose", "bibliography"), default="prose")
+    parser.add_argument("--corpus", type=int, default=100000, help="标题抽样范围，越小缓存命中越多")
+    parser.add_argument("--doi-rate", type=float, default=0.3, help="bibliography 文档中带 DOI 的比例")
+    parser.add_argument("--llm-claim-rate", type=float, default=0.5, help="prose 文档中需要 LLM 判定的 claim 比例")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--timing", action="store_true", help="请求 ?timing=1 并汇总各阶段耗时")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 报告")
+    parser.add_argument("--keep-logs", action="store_true", help="保留 mock / 后端日志目录 (--spawn)")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="veru-bench-") if args.spawn else None
+    try:
+        if args.spawn:
+            base_url, args.mock_url, processes = spawn_stack(args, workdir)
+        else:
+            base_url = args.url
+        report = asyncio.run(run_load(base_url, args))
+    finally:
+        stop_stack(processes)
+        if workdir and not args.keep_logs:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if workdir and args.keep_logs:
+            print(f"  logs: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
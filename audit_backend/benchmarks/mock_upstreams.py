@@ -0,0 +1,464 @@
+import re
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from typing import List, Optional
+
+import grpc
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from google.ai import generativelanguage_v1beta as glm
+
+# 本地模拟上游：OpenAlex / Semantic Scholar (HTTP) + Gemini (SDK 用的 gRPC 与 Google Search 用的 REST)
+# - 每个上游独立配置延迟分布 (对数正态)、错误率、随机限流率与令牌桶限速 (超出返回 429 / RESOURCE_EXHAUSTED)
+# - 论文库是确定性合成的：由标题哈希决定是否收录以及作者 / 年份 / 摘要，压测脚本用同一套函数生成文档
+# 用法: python benchmarks/mock_upstreams.py --http-port 9100 --grpc-port 9101 --gemini-latency 400,0.4
+# 统计: GET http://127.0.0.1:9100/_mock/stats
+#
+# 为什么 Gemini 走 gRPC：google-generativeai 的 REST 传输层没有真正的异步实现 (generate_content_async 会报错)，
+# 后端默认通过 gRPC 调用 Gemini，所以模拟服务同时提供 gRPC 接口，后端用 GEMINI_GRPC_TARGET 指向它
+
+UPSTREAM_NAMES = ("openalex", "semantic_scholar", "gemini")
+
+_VOCAB = (
+    "adaptive attention bayesian causal contrastive deep diffusion efficient federated graph hierarchical "
+    "implicit kernel latent multimodal neural optimal probabilistic robust sparse temporal unsupervised "
+    "variational learning inference networks representations transformers models estimation retrieval "
+    "segmentation reasoning alignment generalization compression detection planning"
+).split()
+_SURNAMES = (
+    "Smith Chen Garcia Müller Tanaka Kowalski Okafor Rossi Dubois Novak Silva Kim Ivanova Haddad Larsen "
+    "Wang Patel Nguyen Cohen Andersson"
+).split()
+
+
+def _digest(text: str, salt: str = "") -> int:
+    normalized = " ".join(re.sub(r"[^\w\s]", " ", (text or "").casefold()).split())
+    return int.from_bytes(hashlib.blake2b((salt + normalized).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# ---------- 确定性合成论文库 ----------
+
+def synthetic_title(index: int) -> str:
+    rng = random.Random(index)
+    words = rng.sample(_VOCAB, 5)
+    return f"{words[0].capitalize()} {words[1]} {words[2]} for {words[3]} {words[4]} ({index})"
+
+
+def synthetic_doi(index: int) -> str:
+    return f"10.5555/mock.{index}"
+
+
+def synthetic_paper(title: str) -> dict:
+    """标题 → 作者 / 年份 / 摘要，模拟服务与压测脚本共用"""
+    rng = random.Random(_digest(title))
+    authors = rng.sample(_SURNAMES, rng.randint(1, 4))
+    words = [w for w in re.findall(r"[a-z]+", title.lower()) if w != "for"]
+    abstract = (
+        f"This paper studies {' '.join(words)}. We propose a method for {words[-1]} that improves "
+        f"{words[0]} {words[1]} on standard benchmarks. Experiments show consistent gains over prior work "
+        f"and an analysis of {rng.choice(_VOCAB)} {rng.choice(_VOCAB)}."
+    )
+    return {
+        "title": title,
+        "authors": [f"{rng.choice('ABCDEJKLMRST')}. {name}" for name in authors],
+        "year": rng.randint(1995, 2024),
+        "abstract": abstract,
+        "cited_by_count": int(rng.paretovariate(1.2) * 10),
+    }
+
+
+def _title_from_doi(doi: str) -> Optional[str]:
+    match = re.search(r"10\.5555/mock\.(\d+)", doi or "")
+    return synthetic_title(int(match.group(1))) if match else None
+
+
+# ---------- 延迟 / 错误 / 限流配置 ----------
+
+class UpstreamProfile:
+    """单个上游的行为：对数正态延迟 + 错误率 + 随机限流率 + 令牌桶限速 (rps<=0 不限速)"""
+
+    def __init__(self, name: str, median_ms: float, sigma: float, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, rps: float = 0.0, retry_after: float = 1.0):
+        self.name = name
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rps = rps
+        self.retry_after = retry_after
+        self.tokens = rps
+        self.refilled_at = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "inflight": 0, "max_inflight": 0}
+
+    def sample_latency(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms / 1000 * math.exp(rng.gauss(0.0, self.sigma))
+
+    def admit(self, rng: random.Random) -> str:
+        """返回本次请求的结局: ok / throttled / error"""
+        self.stats["requests"] += 1
+        if self.rps > 0:
+            now = time.monotonic()
+            self.tokens = min(self.rps, self.tokens + (now - self.refilled_at) * self.rps)
+            self.refilled_at = now
+            if self.tokens < 1:
+                self.stats["throttled"] += 1
+                return "throttled"
+            self.tokens -= 1
+        if rng.random() < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return "throttled"
+        if rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return "error"
+        self.stats["ok"] += 1
+        return "ok"
+
+    def enter(self):
+        self.stats["inflight"] += 1
+        self.stats["max_inflight"] = max(self.stats["max_inflight"], self.stats["inflight"])
+
+    def leave(self):
+        self.stats["inflight"] -= 1
+
+
+def parse_latency(value: str) -> tuple:
+    """"中位数毫秒[,sigma]"，例如 "120,0.5" """
+    median, _, sigma = value.partition(",")
+    return float(median), float(sigma or 0.4)
+
+
+class MockUpstreams:
+    def __init__(self, args):
+        self.rng = random.Random(args.seed)
+        self.hit_rate = args.hit_rate
+        self.s2_hit_rate = args.s2_hit_rate
+        self.verdict_mismatch_rate = args.mismatch_rate
+        self.stream_chunks = args.stream_chunks
+        self.profiles = {}
+        for name, prefix in (("openalex", "openalex"), ("semantic_scholar", "s2"), ("gemini", "gemini")):
+            median, sigma = parse_latency(getattr(args, f"{prefix}_latency"))
+            self.profiles[name] = UpstreamProfile(
+                name, median, sigma,
+                error_rate=getattr(args, f"{prefix}_error_rate"),
+                throttle_rate=getattr(args, f"{prefix}_throttle_rate"),
+                rps=getattr(args, f"{prefix}_rps"),
+                retry_after=args.retry_after,
+            )
+        self.calls = {}
+        # OpenAlex 的 /works/{id} 需要把 ID 映射回标题
+        self.works_by_id = {}
+        self.started = time.monotonic()
+
+    def count(self, endpoint: str):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def in_openalex(self, title: str) -> bool:
+        return (_digest(title, "openalex") % 10000) < self.hit_rate * 10000
+
+    def in_s2(self, title: str) -> bool:
+        return (_digest(title, "s2") % 10000) < self.s2_hit_rate * 10000
+
+    # ---------- 载荷 ----------
+
+    def openalex_work(self, title: str, with_abstract: bool, index: Optional[int] = None) -> dict:
+        paper = synthetic_paper(title)
+        work_id = f"https://openalex.org/W{_digest(title) % 10 ** 10}"
+        self.works_by_id[work_id.rsplit("/", 1)[-1]] = title
+        match = re.search(r"\((\d+)\)$", title)
+        doi_index = index if index is not None else (int(match.group(1)) if match else None)
+        work = {
+            "id": work_id,
+            "doi": f"https://doi.org/{synthetic_doi(doi_index)}" if doi_index is not None else None,
+            "title": title,
+            "publication_year": paper["year"],
+            "authorships": [{"author": {"display_name": name}} for name in paper["authors"]],
+            "cited_by_count": paper["cited_by_count"],
+            "open_access": {"is_oa": True, "oa_url": f"https://example.org/{work_id[-10:]}.pdf"},
+        }
+        if with_abstract:
+            work["abstract_inverted_index"] = _inverted_index(paper["abstract"])
+        return work
+
+    def s2_paper(self, title: str) -> dict:
+        paper = synthetic_paper(title)
+        return {
+            "title": title,
+            "authors": [{"name": name} for name in paper["authors"]],
+            "year": paper["year"],
+            "abstract": paper["abstract"],
+            "openAccessPdf": None,
+            "citationCount": paper["cited_by_count"],
+            "url": f"https://www.semanticscholar.org/paper/{_digest(title):x}",
+            "externalIds": {},
+        }
+
+    def verdict(self, text: str) -> dict:
+        mismatch = (_digest(text, "verdict") % 10000) < self.verdict_mismatch_rate * 10000
+        return {
+            "status": "MISMATCH" if mismatch else "REAL",
+            "confidence": 0.9,
+            "reason": "Mock verdict.",
+        }
+
+
+def _inverted_index(text: str) -> dict:
+    index = {}
+    for pos, word in enumerate(text.split()):
+        index.setdefault(word, []).append(pos)
+    return index
+
+
+# ---------- Gemini 提示词解析 ----------
+
+_QUOTED_TITLE_RE = re.compile(r"[\"“]([^\"“”]{8,}?)[.,]?[\"”]")
+
+
+def mock_extraction(prompt: str) -> List[dict]:
+    """抽取提示词：按行找带引号的标题，作者 / 年份取自合成论文库 (与压测文档一致)"""
+    text = prompt.split("Input Text:", 1)[-1]
+    citations = []
+    for line in text.splitlines():
+        match = _QUOTED_TITLE_RE.search(line)
+        if not match:
+            continue
+        title = match.group(1).strip()
+        paper = synthetic_paper(title)
+        claim = line[match.end():].strip(" ,.") or "discusses this topic"
+        citations.append({
+            "id": len(citations) + 1,
+            "raw_text": line.strip(),
+            "title": title,
+            "author": paper["authors"][0].split()[-1] + " et al.",
+            "year": str(paper["year"]),
+            "doi": None,
+            "summary_intent": claim,
+            "specific_claims": [],
+        })
+    return citations
+
+
+def _gemini_response(text: str) -> glm.GenerateContentResponse:
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(
+        content=glm.Content(parts=[glm.Part(text=text)], role="model"),
+        finish_reason=glm.Candidate.FinishReason.STOP,
+    )])
+
+
+def _gemini_answer(mock: MockUpstreams, prompt: str) -> str:
+    if "forensic text auditor" in prompt:
+        return json.dumps(mock_extraction(prompt), ensure_ascii=False)
+    cases = re.split(r"--- CASE (\d+) ---", prompt)
+    if len(cases) > 1:
+        return json.dumps([
+            {"id": int(cases[i]), **mock.verdict(cases[i + 1])} for i in range(1, len(cases) - 1, 2)
+        ])
+    return json.dumps(mock.verdict(prompt))
+
+
+def build_grpc_handler(mock: MockUpstreams):
+    profile = mock.profiles["gemini"]
+
+    async def admit(request, context):
+        prompt = "".join(part.text for content in request.contents for part in content.parts)
+        outcome = profile.admit(mock.rng)
+        if outcome == "throttled":
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Mock quota exceeded")
+        if outcome == "error":
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "Mock upstream error")
+        return prompt
+
+    async def generate_content(request, context):
+        mock.count("gemini.generate")
+        profile.enter()
+        try:
+            await asyncio.sleep(profile.sample_latency(mock.rng))
+            prompt = await admit(request, context)
+            return _gemini_response(_gemini_answer(mock, prompt))
+        finally:
+            profile.leave()
+
+    async def stream_generate_content(request, context):
+        # 首包延迟取采样值，其余输出按 stream_chunks 份均匀吐出 (每份约为首包延迟的 1/4)
+        mock.count("gemini.stream")
+        profile.enter()
+        try:
+            first = profile.sample_latency(mock.rng)
+            await asyncio.sleep(first)
+            prompt = await admit(request, context)
+            answer = _gemini_answer(mock, prompt)
+            pieces = max(1, mock.stream_chunks)
+            size = max(1, math.ceil(len(answer) / pieces))
+            for start in range(0, len(answer), size):
+                yield _gemini_response(answer[start:start + size])
+                await asyncio.sleep(first / 4 / pieces)
+        finally:
+            profile.leave()
+
+    return grpc.method_handlers_generic_handler("google.ai.generativelanguage.v1beta.GenerativeService", {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        ),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            stream_generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        ),
+    })
+
+
+# ---------- HTTP 接口 ----------
+
+def build_http_app(mock: MockUpstreams) -> FastAPI:
+    app = FastAPI()
+
+    async def simulate(name: str, endpoint: str):
+        """统一的延迟 / 错误 / 限流处理；返回 None 表示正常，否则返回错误响应"""
+        profile = mock.profiles[name]
+        mock.count(endpoint)
+        profile.enter()
+        try:
+            await asyncio.sleep(profile.sample_latency(mock.rng))
+        finally:
+            profile.leave()
+        outcome = profile.admit(mock.rng)
+        if outcome == "throttled":
+            return JSONResponse({"error": "Too Many Requests"}, status_code=429,
+                                headers={"Retry-After": str(profile.retry_after)})
+        if outcome == "error":
+            return JSONResponse({"error": "Mock upstream error"}, status_code=500)
+        return None
+
+    @app.get("/works")
+    async def openalex_works(request: Request):
+        params = request.query_params
+        select = params.get("select", "")
+        with_abstract = "abstract_inverted_index" in select
+        query_filter = params.get("filter", "")
+
+        if query_filter.startswith("doi:"):
+            error = await simulate("openalex", "openalex.doi")
+            if error:
+                return error
+            results = []
+            for doi in query_filter[4:].split("|"):
+                title = _title_from_doi(doi)
+                if title and mock.in_openalex(title):
+                    results.append(mock.openalex_work(title, with_abstract))
+            return {"results": results}
+
+        error = await simulate("openalex", "openalex.search")
+        if error:
+            return error
+        title = params.get("search") or query_filter.split("title.search:", 1)[-1]
+        if not mock.in_openalex(title):
+            return {"results": []}
+        return {"results": [mock.openalex_work(title, with_abstract)]}
+
+    @app.get("/works/{work_id}")
+    async def openalex_work(work_id: str):
+        error = await simulate("openalex", "openalex.work")
+        if error:
+            return error
+        title = mock.works_by_id.get(work_id)
+        if title is None:
+            return JSONResponse({"error": "Not Found"}, status_code=404)
+        return {"abstract_inverted_index": _inverted_index(synthetic_paper(title)["abstract"])}
+
+    @app.get("/graph/v1/paper/search")
+    async def s2_search(query: str = ""):
+        error = await simulate("semantic_scholar", "s2.search")
+        if error:
+            return error
+        return {"data": [mock.s2_paper(query)] if mock.in_s2(query) else []}
+
+    @app.post("/graph/v1/paper/batch")
+    async def s2_batch(request: Request):
+        error = await simulate("semantic_scholar", "s2.batch")
+        if error:
+            return error
+        papers = []
+        for paper_id in (await request.json()).get("ids", []):
+            title = _title_from_doi(paper_id)
+            papers.append(mock.s2_paper(title) if title and mock.in_s2(title) else None)
+        return papers
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def gemini_rest(model: str, request: Request):
+        # Google Search 兜底走 REST：两个库都没收录的论文，按哈希给出 FAKE / REAL
+        error = await simulate("gemini", "gemini.google_search")
+        if error:
+            return error
+        prompt = "".join(part.get("text", "") for c in (await request.json()).get("contents", [])
+                         for part in c.get("parts", []))
+        fake = _digest(prompt, "google") % 2 == 0
+        answer = {
+            "verdict": "FAKE" if fake else "REAL",
+            "confidence": 0.8,
+            "reason": "Mock search result.",
+            "actual_paper_info": None,
+        }
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(answer)}]}, "finishReason": "STOP"}]}
+
+    @app.get("/_mock/stats")
+    async def stats():
+        return {
+            "uptime_s": round(time.monotonic() - mock.started, 1),
+            "upstreams": {name: profile.stats for name, profile in mock.profiles.items()},
+            "endpoints": mock.calls,
+        }
+
+    return app
+
+
+async def serve(args):
+    mock = MockUpstreams(args)
+
+    grpc_server = grpc.aio.server()
+    grpc_server.add_generic_rpc_handlers((build_grpc_handler(mock),))
+    grpc_port = grpc_server.add_insecure_port(f"{args.host}:{args.grpc_port}")
+    await grpc_server.start()
+
+    config = uvicorn.Config(build_http_app(mock), host=args.host, port=args.http_port,
+                            log_level="warning", access_log=False)
+    print(f"[Mock] HTTP http://{args.host}:{args.http_port}  gRPC {args.host}:{grpc_port}", flush=True)
+    try:
+        await uvicorn.Server(config).serve()
+    finally:
+        await grpc_server.stop(grace=1)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Local mock OpenAlex / Semantic Scholar / Gemini servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=9100)
+    parser.add_argument("--grpc-port", type=int, default=9101)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--hit-rate", type=float, default=0.8, help="OpenAlex 收录比例")
+    parser.add_argument("--s2-hit-rate", type=float, default=0.5, help="Semantic Scholar 收录比例")
+    parser.add_argument("--mismatch-rate", type=float, default=0.1, help="一致性判定为 MISMATCH 的比例")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="流式抽取的响应分片数")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After 秒数")
+    for prefix, latency in (("openalex", "120,0.5"), ("s2", "150,0.6"), ("gemini", "600,0.4")):
+        parser.add_argument(f"--{prefix}-latency", default=latency, help="中位数毫秒,sigma (对数正态)")
+        parser.add_argument(f"--{prefix}-error-rate", type=float, default=0.0)
+        parser.add_argument(f"--{prefix}-throttle-rate", type=float, default=0.0)
+        parser.add_argument(f"--{prefix}-rps", type=float, default=0.0, help="令牌桶限速，0 为不限")
+    return parser
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(build_parser().parse_args(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
@@ -1,12 +1,14 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, validator
 from typing import List, Optional
 import uvicorn
+import os
 import re
 import asyncio
 import json
-from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, aclosing
+from fastapi.responses import StreamingResponse, PlainTextResponse
 
 # 引入限流库
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -14,16 +16,52 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 # Import Services
-from services.llm_extractor import extract_citations_from_text
-from services.openalex import search_paper_on_openalex
+from services.llm_extractor import extract_citations_from_text, stream_citations_from_text, CitationData, \
+    extraction_cache
 from services.google_search import verify_with_google_search
-from services.auditor import verify_content_consistency
-from services.semantic_scholar import search_paper_on_semantic_scholar
+from services.auditor import verify_content_consistency, start_audit_batching
+from services.resolver import resolve_paper, get_clean_year
+from services.cache import paper_cache_key
+from services.singleflight import SingleFlight, get_singleflight_stats
+from services.jobs import JobManager, JOB_MAX_CHARS
+from services.batch_resolver import prefetch_citations, StreamingPrefetcher
+from services.http_client import init_http_clients, close_http_clients
+from services.scheduler import get_scheduler_stats
+from services.resilience import (
+    start_retry_budget, get_resilience_stats, start_deadline, remaining_budget, deadline_expired, with_deadline,
+    DeadlineExceededError
+)
+from services.shared_state import limiter_storage_uri, close_shared_state, get_shared_state_stats
+from services.sessions import session_store, get_session_stats
+from services.prescreen import prescreen_stats
+from services.cache import paper_cache
+from services.auditor import verdict_cache
+from services.metrics import (
+    span, CITATIONS, REQUESTS, CLIENT_DISCONNECTS, render_prometheus, register_collector,
+    start_request_timing, get_request_timing, format_server_timing
+)
+
+# 初始化限流器 (基于请求者的 IP 地址)；压测时可用 RATE_LIMIT=0 关闭
+# 配置 REDIS_URL 后计数存入 Redis，多 worker / 多副本共用同一配额；Redis 不可用时临时退回进程内计数
+limiter = Limiter(
+    key_func=get_remote_address,
+    enabled=os.getenv("RATE_LIMIT", "1") == "1",
+    storage_uri=limiter_storage_uri(),
+    in_memory_fallback_enabled=True,
+)
 
-# 初始化限流器 (基于请求者的 IP 地址)
-limiter = Limiter(key_func=get_remote_address)
 
-app = FastAPI(title="Veru Audit Engine")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时为每个上游建立共享连接池 (keep-alive / HTTP/2)，关闭时统一释放
+    await init_http_clients()
+    yield
+    await job_manager.close()
+    await close_http_clients()
+    await close_shared_state()
+
+
+app = FastAPI(title="Veru Audit Engine", lifespan=lifespan)
 
 # 将限流器挂载到 App
 app.state.limiter = limiter
@@ -33,6 +71,46 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 async def health_check():
     return {"status": "ok", "message": "Veru Audit Engine is running"}
 
+
+@app.get("/api/upstreams")
+async def upstream_status():
+    # 各上游调度器的排队深度、等待时间、并发窗口与限流次数，熔断状态与重试次数，以及请求合并节省的重复工作
+    return {
+        "schedulers": get_scheduler_stats(),
+        "resilience": get_resilience_stats(),
+        "singleflight": get_singleflight_stats(),
+        "jobs": job_manager.get_stats(),
+        "shared_state": get_shared_state_stats(),
+        "sessions": get_session_stats(),
+        "prescreen": prescreen_stats,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus 抓取端点：阶段耗时 / 上游状态码 / 缓存命中直方图，以及调度器、熔断等瞬时值
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def collect_runtime_gauges():
+    for name, stats in get_scheduler_stats().items():
+        yield "veru_upstream_queue_depth", "Requests waiting in the upstream scheduler", {"upstream": name}, stats["queue_depth"]
+        yield "veru_upstream_inflight", "Requests in flight per upstream", {"upstream": name}, stats["inflight"]
+        yield "veru_upstream_window", "AIMD concurrency window per upstream", {"upstream": name}, stats["window"]
+    for name, stats in get_resilience_stats()["breakers"].items():
+        yield "veru_circuit_open", "1 when the upstream circuit breaker is not closed", {"upstream": name}, \
+            stats["state"] != "closed"
+    for cache in (paper_cache, verdict_cache, extraction_cache):
+        yield "veru_cache_entries", "Entries in the in-memory cache tier", {"cache": cache.name}, cache.get_stats()["size"]
+    for name, stats in get_singleflight_stats().items():
+        yield "veru_singleflight_shared", "Calls served by an identical in-flight execution", {"flight": name}, stats["shared"]
+    for state, count in job_manager.get_stats()["jobs"].items():
+        yield "veru_jobs", "Bulk audit jobs by state", {"state": state}, count
+    for outcome, count in prescreen_stats.items():
+        yield "veru_prescreen_checks", "Local pre-screen checks by outcome (cumulative)", {"outcome": outcome}, count
+
+
+register_collector(collect_runtime_gauges)
+
 # CORS 配置
 origins = [
     "http://localhost:3000",
@@ -46,8 +124,10 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    # 前端需要读取会话 ID 才能断线续传
+    expose_headers=["X-Audit-Session"],
 )
 
 class AuditRequest(BaseModel):
@@ -61,6 +141,17 @@ class AuditRequest(BaseModel):
         return v
 
 
+class JobRequest(BaseModel):
+    # 批量任务不受 /api/audit 的 5,000 字符与 10 条引用限制
+    text: str = Field(..., max_length=JOB_MAX_CHARS, description="Document or reference list to audit")
+
+    @validator('text')
+    def prevent_empty(cls, v):
+        if not v.strip():
+            raise ValueError('Text cannot be empty')
+        return v
+
+
 class AuditResult(BaseModel):
     citation_text: str
     status: str
@@ -70,54 +161,97 @@ class AuditResult(BaseModel):
     confidence: float
 
 
-def get_clean_year(year_val):
-    """Helper to extract 4-digit year string"""
-    return "".join(filter(str.isdigit, str(year_val or "")))
+# 相同引用 (同一论文 + 同一 claim) 的并发审计只执行一次完整流水线
+# 被其他请求的截止时间截断的共享结果不复用：本请求仍有时间时重新执行
+citation_flight = SingleFlight("citation", expired=deadline_expired)
 
 
-# 将单条引用的处理逻辑提取为一个独立的异步函数
-async def process_single_citation(cit) -> AuditResult:
-    print(f"--- Auditing: {cit.title} ---")
+def citation_flight_key(cit) -> Optional[tuple]:
+    if not cit.title and not cit.doi:
+        return None
+    claim = " ".join(f"{cit.summary_intent} {' '.join(cit.specific_claims)}".casefold().split())
+    return paper_cache_key(cit.title, cit.author, cit.year, cit.doi), claim
 
-    # 1. OpenAlex 查询 (await)
-    oa_result = await search_paper_on_openalex(
-        title=cit.title,
-        author=cit.author,
-        year=cit.year,
-        doi=cit.doi
+
+# 截止时间到达后单条引用最多再等待的宽限期：留给各阶段返回带已查到信息的部分结果
+DEADLINE_GRACE = 0.5
+
+
+def deadline_result(cit, stage: str, source: str = "Deadline", metadata: Optional[dict] = None) -> AuditResult:
+    """截止时间已到：返回结构完整的部分结果 (UNVERIFIED)，metadata 保留已经查到的论文信息"""
+    return AuditResult(
+        citation_text=cit.raw_text,
+        status="UNVERIFIED",
+        source=source,
+        confidence=0.0,
+        metadata={**(metadata or {}), "reason": "deadline", "stage": stage},
+        message=f"Audit incomplete: request deadline reached during {stage}."
     )
 
-    best_result = oa_result
-    source_name = "OpenAlex"
 
-    # 检查年份
-    cit_year = get_clean_year(cit.year)
-    oa_year = get_clean_year(oa_result.get("year"))
-    is_oa_year_match = (cit_year == oa_year) if (cit_year and oa_year) else True
+async def process_single_citation(cit) -> AuditResult:
+    # 硬上限：截止时间 + 宽限期后仍未完成的引用直接返回部分结果
+    remaining = remaining_budget()
+    if remaining is None:
+        return await _process_single_citation(cit)
+    try:
+        return await asyncio.wait_for(_process_single_citation(cit), max(remaining, 0) + DEADLINE_GRACE)
+    except asyncio.TimeoutError:
+        CITATIONS.inc(source="Deadline", status="UNVERIFIED")
+        return deadline_result(cit, "citation")
+
+
+async def _process_single_citation(cit) -> AuditResult:
+    key = citation_flight_key(cit)
+    if key is None:
+        return await audit_single_citation(cit)
+    result = await citation_flight.do(key, lambda: audit_single_citation(cit))
+    # 共享的审计结果换成本条引用自己的原文
+    return result.copy(update={"citation_text": cit.raw_text})
+
+
+async def audit_single_citation(cit) -> AuditResult:
+    with span("citation"):
+        result = await _audit_single_citation(cit)
+    # 按来源统计：Google Search 的占比即数据库未命中的兜底率
+    CITATIONS.inc(source=result.source, status=result.status)
+    return result
+
 
-    # 2. 竞优逻辑
-    if not oa_result["found"] or (oa_result["found"] and not is_oa_year_match):
-        # Semantic Scholar 查询 (await)
-        s2_result = await search_paper_on_semantic_scholar(cit.title, cit.author)
+# 将单条引用的处理逻辑提取为一个独立的异步函数
+async def _audit_single_citation(cit) -> AuditResult:
+    print(f"--- Auditing: {cit.title} ---")
 
-        if s2_result["found"]:
-            s2_year = get_clean_year(s2_result.get("year"))
-            is_s2_year_match = (cit_year == s2_year) if (cit_year and s2_year) else True
+    # 1 & 2. OpenAlex / Semantic Scholar 查询与竞优 (顺序、并发或对冲，见 RESOLVE_MODE)
+    with span("resolve"):
+        best_result, source_name = await resolve_paper(cit)
+    cit_year = get_clean_year(cit.year)
 
-            if not oa_result["found"]:
-                best_result = s2_result
-                source_name = "Semantic Scholar"
-            elif not is_oa_year_match and is_s2_year_match:
-                best_result = s2_result
-                source_name = "Semantic Scholar"
+    # 时间用完导致的未命中不能据此走兜底或判为 FAKE
+    if not best_result["found"] and deadline_expired():
+        return deadline_result(cit, "resolve")
 
     # 3. 执行审计
     if best_result["found"]:
+        if deadline_expired():
+            return deadline_result(cit, "consistency", source_name, best_result)
+
         # Content Check (await)
-        consistency_check = await verify_content_consistency(
-            user_claim=cit.summary_intent + " " + " ".join(cit.specific_claims),
-            real_abstract=best_result.get("abstract", "")
-        )
+        if cit.reference_entry:
+            # 纯参考文献条目没有可核对的 claim：论文已找到即可，不调用 LLM
+            consistency_check = {
+                "status": "REAL",
+                "confidence": 1.0,
+                "reason": "Reference exists; the text makes no claim about its content."
+            }
+        else:
+            with span("consistency"):
+                consistency_check = await verify_content_consistency(
+                    user_claim=cit.summary_intent + " " + " ".join(cit.specific_claims),
+                    real_abstract=best_result.get("abstract", "")
+                )
+        if consistency_check.get("status") == "ERROR" and deadline_expired():
+            return deadline_result(cit, "consistency", source_name, best_result)
 
         final_status = consistency_check.get("status", "REAL")
         explanation = consistency_check.get("reason", "Verification passed.")
@@ -142,7 +276,12 @@ async def process_single_citation(cit) -> AuditResult:
 
     else:
         # 4. Google Search 兜底 (await)
-        gs_result = await verify_with_google_search(cit.title, cit.author, cit.summary_intent)
+        if deadline_expired():
+            return deadline_result(cit, "google_fallback")
+        with span("google_fallback"):
+            gs_result = await verify_with_google_search(cit.title, cit.author, cit.summary_intent)
+        if gs_result.get("verdict") == "UNVERIFIED" and deadline_expired():
+            return deadline_result(cit, "google_fallback")
 
         status_map = {"REAL": "REAL", "FAKE": "FAKE", "MISMATCH": "MISMATCH", "UNVERIFIED": "UNVERIFIED"}
         g_status = status_map.get(gs_result.get("verdict"), "UNVERIFIED")
@@ -157,34 +296,248 @@ async def process_single_citation(cit) -> AuditResult:
         )
 
 
+# 安全熔断：单次请求最多审计的引用数
+MAX_CITATIONS = 10
+
+# 流水线模式：边流式提取边审计 (设为 0 则先完整提取再审计)
+STREAM_EXTRACTION = os.getenv("STREAM_EXTRACTION", "1") == "1"
+
+
+async def run_audit_pipeline(text: str, results: asyncio.Queue, session=None):
+    """
+    流水线：Gemini 每吐出一条完整的引用，就立刻派发给 process_single_citation，
+    审计结果完成一条放入队列一条。全部结束后放入 None 作为结束标记。
+    续传的会话 (session) 跳过已完成的引用；提取已完成时直接使用保存的引用列表；
+    内容与会话中先前审计过的引用完全一致时直接复用其结果。
+    """
+    tasks = []
+
+    async def audit_into_queue(cit):
+        result = await process_single_citation(cit)
+        # 先落盘再输出：客户端收到的每条结果在断线后都能重放
+        if session is not None:
+            session.save_result(cit.dict(), result.dict())
+        await results.put(result)
+
+    def needs_audit(cit) -> bool:
+        """已完成的跳过；内容未变的直接输出上一轮的结果"""
+        if session is None:
+            return True
+        if session.is_done(cit.raw_text):
+            return False
+        reused = session.reusable_result(cit.dict())
+        if reused is None:
+            return True
+        session.save_result(cit.dict(), reused)
+        results.put_nowait(AuditResult(**reused))
+        return False
+
+    def dispatch(cit):
+        tasks.append(asyncio.create_task(audit_into_queue(cit)))
+
+    # 流式提取同样做文档级 DOI 批量解析：带 DOI 的引用攒成一批预取后再派发
+    prefetcher = StreamingPrefetcher(dispatch)
+
+    async def extract_and_dispatch():
+        extracted = []
+        # aclosing: 被取消时立即关闭提取流，停止各分块的 Gemini 流式调用
+        async with aclosing(stream_citations_from_text(text)) as stream:
+            async for cit in stream:
+                if len(extracted) >= MAX_CITATIONS:
+                    print(f"⚠️ Truncated citations to {MAX_CITATIONS} for safety.")
+                    break
+                extracted.append(cit)
+                if not needs_audit(cit):
+                    continue
+                if cit.doi:
+                    prefetcher.add(cit)
+                else:
+                    dispatch(cit)
+        if session is not None:
+            session.save_citations([cit.dict() for cit in extracted])
+
+    try:
+        # 提取阶段同样受截止时间约束：超时后只审计已经提取到的引用
+        if session is not None and session.citations is not None:
+            citations = [CitationData(**item) for item in session.citations]
+            pending = [cit for cit in citations if needs_audit(cit)]
+            await prefetch_citations(pending)
+            for cit in pending:
+                dispatch(cit)
+        elif STREAM_EXTRACTION:
+            with span("extract"):
+                try:
+                    await with_deadline(extract_and_dispatch())
+                except DeadlineExceededError:
+                    print(f"[Deadline] Extraction stopped after {len(tasks)} citations")
+            # 截止时间已到时预取会立即失败，缓冲的引用照常派发并返回部分结果
+            await prefetcher.drain()
+        else:
+            with span("extract"):
+                try:
+                    citations = await with_deadline(extract_citations_from_text(text))
+                except DeadlineExceededError:
+                    print("[Deadline] Extraction did not finish in time")
+                    citations = []
+            if len(citations) > MAX_CITATIONS:
+                citations = citations[:MAX_CITATIONS]
+                print(f"⚠️ Truncated citations to {MAX_CITATIONS} for safety.")
+            if session is not None and citations:
+                session.save_citations([cit.dict() for cit in citations])
+                citations = [cit for cit in citations if needs_audit(cit)]
+            # 整篇文档的 DOI 合并成一两次批量请求，结果预热到缓存
+            await prefetch_citations(citations)
+            for cit in citations:
+                dispatch(cit)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        # 正常结束时任务均已完成；被取消 (客户端断开) 时取消未完成的审计并等待其清理
+        # (释放调度器并发位、singleflight 等待计数，不再发起新的上游调用)
+        await prefetcher.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        cancelled = sum(task.cancelled() for task in tasks)
+        if cancelled:
+            print(f"[Disconnect] Cancelled {cancelled} outstanding citation audits")
+        await results.put(None)
+
+
+async def cancel_on_disconnect(request: Request, on_disconnect):
+    """
+    监听 http.disconnect：客户端断开后立即回调，不必等到下一次写出结果失败才发现
+    (提取或审计可能还要数秒才产出下一条结果)
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            on_disconnect()
+            return
+
+
 # 主接口
 @app.post("/api/audit")
 @limiter.limit("10/minute")
-async def audit_citations(request: Request, body: AuditRequest):
-    citations = extract_citations_from_text(body.text)
-
-    # 安全熔断
-    MAX_CITATIONS = 10
-    if len(citations) > MAX_CITATIONS:
-        citations = citations[:MAX_CITATIONS]
-        print(f"⚠️ Truncated citations to {MAX_CITATIONS} for safety.")
+async def audit_citations(request: Request, body: AuditRequest, timing: bool = False, session: Optional[str] = None,
+                          incremental: bool = False):
+    # timing=1 (或请求头 X-Audit-Timing: 1) 时在结果流末尾追加一条 {"type": "timing"} 记录；
+    # 前端默认把每行都当作 AuditResult 解析，因此必须显式开启
+    include_timing = timing or request.headers.get("X-Audit-Timing") == "1"
+
+    # 断线续传：响应头 X-Audit-Session 返回会话 ID；断线后带上它 (?session= 或同名请求头) 重新提交同一段文本，
+    # 已完成的结果立即重放，只计算剩余的引用。
+    # incremental=1 (或 X-Audit-Incremental: 1)：同一会话提交修改后的文本时沿用会话，
+    # 内容未变的引用直接复用上次的结果，只审计新增或改动的引用
+    incremental = incremental or request.headers.get("X-Audit-Incremental") == "1"
+    audit_session = None
+    if session_store is not None:
+        audit_session = session_store.open(session or request.headers.get("X-Audit-Session"), body.text, incremental)
 
     # 定义一个异步生成器
     async def result_generator():
-        # 创建任务列表
-        tasks = [process_single_citation(cit) for cit in citations]
+        results: asyncio.Queue = asyncio.Queue()
+        # 本次请求所有上游调用共享一份重试预算与耗时汇总 (任务创建时复制 context，子任务均可见)
+        start_retry_budget()
+        start_request_timing()
+        # 端到端截止时间 (AUDIT_DEADLINE)：各阶段只能使用剩余时间，超时的引用返回 UNVERIFIED (reason: deadline)
+        start_deadline()
+        # 一致性审计只在本请求的引用之间合批
+        start_audit_batching()
+        pipeline = asyncio.create_task(run_audit_pipeline(body.text, results, audit_session))
+        disconnected = asyncio.Event()
+
+        def abandon():
+            # 结果已无人读取：取消提取与所有未完成的审计，把上游配额留给在线用户
+            # (singleflight 合并的工作若仍有其他请求在等待则继续执行)
+            if not pipeline.done() and not disconnected.is_set():
+                disconnected.set()
+                CLIENT_DISCONNECTS.inc(endpoint="audit")
+                print("[Disconnect] Client went away, cancelling audit pipeline")
+                pipeline.cancel()
+
+        watcher = asyncio.create_task(cancel_on_disconnect(request, abandon))
+        try:
+            # 续传：先重放上次连接中已经完成的结果
+            for stored in (audit_session.results if audit_session else []):
+                yield json.dumps(stored) + "\n"
+
+            # 任一引用审计完成即 yield，不必等提取或其他引用结束
+            while (result := await results.get()) is not None:
+                # 将 Pydantic 对象转为 dict 再转为 JSON 字符串
+                # 加上换行符 \n NDJSON 的标准分隔符
+                yield json.dumps(result.dict()) + "\n"
+
+            if disconnected.is_set():
+                return
+
+            # 传播流水线中的异常 (与原先 await task 的行为一致)
+            await pipeline
+
+            summary = get_request_timing()
+            REQUESTS.observe(summary["elapsed_ms"] / 1000, endpoint="audit")
+            print(f"[Timing] {format_server_timing(summary)}")
+            if include_timing:
+                yield json.dumps({"type": "timing", **summary}) + "\n"
+        finally:
+            watcher.cancel()
+            # 服务器发现断开后会直接关闭本生成器，同样需要取消流水线
+            abandon()
+
+    # 返回流式响应，媒体类型设为 x-ndjson
+    headers = {"X-Audit-Session": audit_session.id} if audit_session else None
+    return StreamingResponse(result_generator(), media_type="application/x-ndjson", headers=headers)
 
-        # 使用 asyncio.as_completed 迭代，在任一任务完成时立即 yield
-        for task in asyncio.as_completed(tasks):
-            result = await task
 
-            # 将 Pydantic 对象转为 dict 再转为 JSON 字符串
-            # 加上换行符 \n NDJSON 的标准分隔符
-            yield json.dumps(result.dict()) + "\n"
 
-    # 返回流式响应，媒体类型设为 x-ndjson
+# 批量审计任务：大型参考文献列表在后台审计，不占用 HTTP 连接
+job_manager = JobManager(process_single_citation)
+
+
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/api/jobs", status_code=202)
+@limiter.limit("5/minute")
+async def create_job(request: Request, body: JobRequest):
+    job = job_manager.submit(body.text)
+    return job.summary()
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, response: Response, offset: int = 0, limit: int = 100):
+    # 轮询进度；results 按完成顺序分页返回；任务的阶段耗时同时以 Server-Timing 头返回
+    job = get_job_or_404(job_id)
+    summary = job.summary()
+    if summary["timing"]:
+        response.headers["Server-Timing"] = format_server_timing(summary["timing"])
+    offset = max(offset, 0)
+    return {**summary, "offset": offset, "results": job.results[offset:offset + max(0, min(limit, 1000))]}
+
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, offset: int = 0):
+    # NDJSON：先补发 offset 之后已完成的结果，再随完成随推送，任务结束时关闭；断线后可按 offset 续传
+    job = get_job_or_404(job_id)
+
+    async def result_generator():
+        async for result in job_manager.stream(job, max(offset, 0)):
+            yield json.dumps(result) + "\n"
+
     return StreamingResponse(result_generator(), media_type="application/x-ndjson")
 
 
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = get_job_or_404(job_id)
+    await job_manager.cancel(job)
+    return job.summary()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
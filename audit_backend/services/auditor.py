@@ -1,11 +1,56 @@
 import os
 import json
+import asyncio
+import hashlib
+import contextvars
+import unicodedata
 import google.generativeai as genai
+from typing import List, Tuple, Optional, Dict
 from dotenv import load_dotenv
 
+from services.cache import TieredCache
+from services.batching import MicroBatcher
+from services.prescreen import prescreen_consistency
+from services.resilience import call_upstream
+from services.metrics import span
+
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+MODEL_NAME = "gemini-2.0-flash"
+
+# 单条 / 批量 Prompt 各自的版本：修改对应 Prompt / Schema 时必须同步递增，旧版本的缓存判定会自动失效。
+# 判定按产生它的 Prompt 分别缓存，批量 Prompt 的判定不会用于单条 Prompt
+PROMPT_VERSION = "consistency-v2"
+BATCH_PROMPT_VERSION = "consistency-batch-v1"
+
+# 合批审计：同一请求 (文档) 内 AUDIT_BATCH_WINDOW_MS 内到达的审计最多 AUDIT_BATCH_SIZE 条合并为一次调用 (设为 1 关闭)。
+# 不同请求的 claim 不会出现在同一个 Prompt 中
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "8"))
+AUDIT_BATCH_WINDOW_MS = float(os.getenv("AUDIT_BATCH_WINDOW_MS", "50"))
+
+# 判定缓存：默认仅内存；设置 VERDICT_CACHE_DB 后持久化到 SQLite，设置 REDIS_URL 后各进程共享
+verdict_cache = TieredCache(
+    "verdicts",
+    max_entries=int(os.getenv("VERDICT_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("VERDICT_CACHE_TTL", str(7 * 86400))),
+    db_path=os.getenv("VERDICT_CACHE_DB") or None,
+    shared=True,
+)
+
+
+def _normalize_for_key(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+def verdict_cache_key(user_claim: str, real_abstract: str, prompt_version: str = PROMPT_VERSION) -> str:
+    """内容寻址：claim + abstract + prompt 版本 + 模型名 的哈希，任一变化都不会命中旧判定"""
+    payload = json.dumps(
+        [_normalize_for_key(user_claim), _normalize_for_key(real_abstract), prompt_version, MODEL_NAME],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
 async def verify_content_consistency(user_claim: str, real_abstract: str) -> dict:
     """
@@ -13,6 +58,8 @@ async def verify_content_consistency(user_claim: str, real_abstract: str) -> dic
     - 异步调用 (Async)
     - 强制 JSON Schema 输出 (Stability)
     - 增强针对“数据捏造”的检测逻辑 (Anti-Hallucination)
+    - 相同 claim/abstract 的判定结果会被缓存复用
+    - 明确的情况由本地规则预筛直接判定 (services/prescreen.py)
     """
 
     # 基础防守：如果没有摘要，无法验证
@@ -23,16 +70,36 @@ async def verify_content_consistency(user_claim: str, real_abstract: str) -> dic
             "reason": "Paper exists, but abstract is missing in database."
         }
 
-    model = genai.GenerativeModel('gemini-2.0-flash')
+    # 本地规则能确定的情况不调用 LLM
+    with span("consistency.prescreen"):
+        quick_verdict = prescreen_consistency(user_claim, real_abstract)
+    if quick_verdict is not None:
+        return quick_verdict
 
-    # Prompt 逻辑增强
-    prompt = f"""
-    You are a forensic academic auditor. 
-    Your Task: Verify if the "User's Claim" is supported by the "Actual Abstract".
+    batcher = _request_batcher.get()
+    cache_key = verdict_cache_key(user_claim, real_abstract)
+    cached = await verdict_cache.get(cache_key)
+    # 合批模式下单条 / 批量 Prompt 都可能被使用；未合批时只认单条 Prompt 的判定
+    if cached is None and batcher is not None:
+        cached = await verdict_cache.get(verdict_cache_key(user_claim, real_abstract, BATCH_PROMPT_VERSION))
+    if cached is not None:
+        return dict(cached)
 
-    User's Claim: "{user_claim}"
-    Actual Abstract: "{real_abstract}"
+    with span("consistency.llm"):
+        if batcher is not None:
+            # 合批：本请求时间窗口内的多条审计合并为一次 Gemini 调用
+            verdict, prompt_version = await batcher.submit((cache_key, user_claim, real_abstract))
+        else:
+            verdict, prompt_version = await _ask_model(user_claim, real_abstract), PROMPT_VERSION
+
+    # 出错的结果不缓存，下次重新判定；按实际使用的 Prompt 缓存
+    if verdict.get("status") != "ERROR":
+        await verdict_cache.set(verdict_cache_key(user_claim, real_abstract, prompt_version), verdict)
+    return verdict
 
+
+# 单条与批量审计共用的规则 (修改时递增 PROMPT_VERSION 与 BATCH_PROMPT_VERSION)
+AUDIT_RULES = """
     AUDIT RULES:
     1. **Topic Match**: Does the paper discuss the same core topic? If no -> "MISMATCH".
     2. **Data Integrity (CRITICAL)**: 
@@ -46,7 +113,33 @@ async def verify_content_consistency(user_claim: str, real_abstract: str) -> dic
     - "MISMATCH": The paper is about a completely different topic (e.g., Biology paper cited for AI).
     - "SUSPICIOUS": The topic matches, but the user invented specific details/findings not present in the text (Hallucination of details).
     - "UNVERIFIED": Abstract is too short or ambiguous to judge.
+"""
+
+VERDICT_PROPERTIES = {
+    "status": {
+        "type": "STRING",
+        "enum": ["REAL", "MISMATCH", "SUSPICIOUS", "UNVERIFIED"]
+    },
+    "confidence": {
+        "type": "NUMBER"
+    },
+    "reason": {
+        "type": "STRING"
+    }
+}
+
+
+async def _ask_model(user_claim: str, real_abstract: str) -> dict:
+    model = genai.GenerativeModel(MODEL_NAME)
+
+    # Prompt 逻辑增强
+    prompt = f"""
+    You are a forensic academic auditor. 
+    Your Task: Verify if the "User's Claim" is supported by the "Actual Abstract".
 
+    User's Claim: "{user_claim}"
+    Actual Abstract: "{real_abstract}"
+    {AUDIT_RULES}
     Provide a confidence score (0.0 - 1.0) and a brief reason.
     """
 
@@ -55,28 +148,17 @@ async def verify_content_consistency(user_claim: str, real_abstract: str) -> dic
         "response_mime_type": "application/json",
         "response_schema": {
             "type": "OBJECT",
-            "properties": {
-                "status": {
-                    "type": "STRING",
-                    "enum": ["REAL", "MISMATCH", "SUSPICIOUS", "UNVERIFIED"]
-                },
-                "confidence": {
-                    "type": "NUMBER"
-                },
-                "reason": {
-                    "type": "STRING"
-                }
-            },
+            "properties": VERDICT_PROPERTIES,
             "required": ["status", "confidence", "reason"]
         }
     }
 
     try:
         # 使用异步方法
-        response = await model.generate_content_async(
+        response = await call_upstream("gemini", lambda: model.generate_content_async(
             prompt,
             generation_config=generation_config
-        )
+        ))
 
         # 直接解析 JSON
         return json.loads(response.text)
@@ -87,4 +169,117 @@ async def verify_content_consistency(user_claim: str, real_abstract: str) -> dic
             "status": "ERROR",
             "confidence": 0.0,
             "reason": f"Audit Error: {str(e)}"
-        }
\ No newline at end of file
+        }
+
+
+async def _ask_model_batch(items: List[Tuple[str, str]]) -> List[Optional[dict]]:
+    """
+    一次 Gemini 调用审计多条 (claim, abstract)，按 id 映射回各自的判定。
+    返回与 items 等长的列表；响应缺失或格式错误的位置为 None，整体调用失败时抛出异常。
+    """
+    model = genai.GenerativeModel(MODEL_NAME)
+
+    cases = "\n".join(
+        f"""
+    --- CASE {idx} ---
+    User's Claim: "{claim}"
+    Actual Abstract: "{abstract}"
+"""
+        for idx, (claim, abstract) in enumerate(items, start=1)
+    )
+
+    prompt = f"""
+    You are a forensic academic auditor. 
+    Your Task: For EACH case below, verify if the "User's Claim" is supported by the "Actual Abstract".
+    Judge every case independently; never mix information between cases.
+    {cases}
+    {AUDIT_RULES}
+    Return one verdict per case, using the case number as "id".
+    Provide a confidence score (0.0 - 1.0) and a brief reason for each.
+    """
+
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"id": {"type": "INTEGER"}, **VERDICT_PROPERTIES},
+                "required": ["id", "status", "confidence", "reason"]
+            }
+        }
+    }
+
+    response = await call_upstream(
+        "gemini", lambda: model.generate_content_async(prompt, generation_config=generation_config)
+    )
+
+    verdicts: List[Optional[dict]] = [None] * len(items)
+    try:
+        data = json.loads(response.text)
+    except (ValueError, AttributeError) as e:
+        print(f"[Auditor Batch] Malformed response for {len(items)} cases: {e}")
+        return verdicts
+
+    for entry in data if isinstance(data, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            idx = int(entry.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= idx < len(items) and entry.get("status") in VERDICT_PROPERTIES["status"]["enum"]:
+            verdicts[idx] = {
+                "status": entry["status"],
+                "confidence": entry.get("confidence", 0.5),
+                "reason": entry.get("reason", "")
+            }
+    return verdicts
+
+
+batch_stats = {"batches": 0, "cases": 0, "split_retries": 0}
+
+
+async def _audit_batch(keys: List[tuple]) -> Dict[tuple, tuple]:
+    """
+    合批审计的 flush 函数。key = (cache_key, claim, abstract)，结果为 (判定, 产生判定的 Prompt 版本)。
+    响应不完整或格式错误时把缺失部分对半拆分、两半并发重试，拆到单条时走单条审计。
+    """
+    if len(keys) == 1:
+        _, claim, abstract = keys[0]
+        return {keys[0]: (await _ask_model(claim, abstract), PROMPT_VERSION)}
+
+    try:
+        verdicts = await _ask_model_batch([(claim, abstract) for _, claim, abstract in keys])
+    except Exception as e:
+        # 整体调用失败 (如 429) 不拆分重试，避免放大请求量
+        print(f"[Auditor Batch Error] {e}")
+        error = {"status": "ERROR", "confidence": 0.0, "reason": f"Audit Error: {str(e)}"}
+        return {key: (dict(error), BATCH_PROMPT_VERSION) for key in keys}
+
+    results = {key: (verdict, BATCH_PROMPT_VERSION) for key, verdict in zip(keys, verdicts) if verdict is not None}
+    missing = [key for key in keys if key not in results]
+    batch_stats["batches"] += 1
+    batch_stats["cases"] += len(keys)
+
+    if missing:
+        batch_stats["split_retries"] += 1
+        print(f"[Auditor Batch] {len(missing)}/{len(keys)} verdicts missing, splitting and retrying")
+        half = max(1, len(missing) // 2)
+        # 两半并发重试：一个坏批次只多等一轮调用，而不是逐段串行等待
+        parts = [part for part in (missing[:half], missing[half:]) if part]
+        for part_results in await asyncio.gather(*(_audit_batch(part) for part in parts)):
+            results.update(part_results)
+    return results
+
+
+_request_batcher: contextvars.ContextVar[Optional[MicroBatcher]] = contextvars.ContextVar(
+    "consistency_batcher", default=None
+)
+
+
+def start_audit_batching():
+    """在每个请求 / 任务开始时调用：合批只发生在同一文档的引用之间，其他用户的 claim 无法影响本请求的判定"""
+    if AUDIT_BATCH_SIZE > 1:
+        _request_batcher.set(MicroBatcher("consistency", _audit_batch,
+                                          max_batch=AUDIT_BATCH_SIZE, window_ms=AUDIT_BATCH_WINDOW_MS))
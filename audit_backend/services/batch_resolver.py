@@ -0,0 +1,126 @@
+import os
+import asyncio
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+
+from services.cache import paper_cache, normalize_doi, doi_miss_key
+from services.metrics import span
+from services.openalex import fetch_works_by_dois, OPENALEX_DOI_BATCH_SIZE, _format_result as format_openalex_result
+from services.semantic_scholar import fetch_papers_by_ids, _format_result as format_s2_result
+
+load_dotenv()
+
+# 流式提取时带 DOI 的引用最多缓冲这么久再整批预取 (提取结束或攒满一批时立即预取)
+PREFETCH_WINDOW_MS = float(os.getenv("PREFETCH_WINDOW_MS", "100"))
+
+_MISSING = {"found": False, "reason": "DOI not found in batch lookup"}
+
+
+async def prefetch_citations(citations: List) -> dict:
+    """
+    文档级批量解析：把一篇文档里所有带 DOI 的引用合并成尽量少的上游请求
+    (OpenAlex OR-filter + Semantic Scholar /paper/batch)，结果写入论文缓存。
+    随后各条 process_single_citation 直接命中缓存，不再单独发请求。
+    """
+    dois = []
+    for cit in citations:
+        clean_doi = normalize_doi(getattr(cit, "doi", None))
+        if clean_doi and clean_doi not in dois:
+            if await paper_cache.get(f"openalex:doi:{clean_doi}") is None and \
+                    await paper_cache.get(doi_miss_key("openalex", clean_doi)) is None:
+                dois.append(clean_doi)
+
+    stats = {"dois": len(dois), "openalex_found": 0, "s2_found": 0}
+    if not dois:
+        return stats
+
+    # 1. OpenAlex: doi:a|b|c
+    try:
+        with span("prefetch.openalex"):
+            works = await fetch_works_by_dois(dois)
+    except Exception as e:
+        print(f"[Batch Resolver] OpenAlex prefetch failed: {e}")
+        return stats
+
+    missing = []
+    for clean_doi in dois:
+        paper = works.get(clean_doi)
+        if paper:
+            await paper_cache.set(f"openalex:doi:{clean_doi}", format_openalex_result(paper, found=True))
+            stats["openalex_found"] += 1
+        else:
+            # 负缓存：之后单条查询不再为这个 DOI 单独请求 OpenAlex
+            await paper_cache.set(doi_miss_key("openalex", clean_doi), _MISSING, negative=True)
+            missing.append(clean_doi)
+
+    # 2. OpenAlex 未收录的 DOI 交给 Semantic Scholar 批量接口
+    if missing:
+        try:
+            with span("prefetch.s2"):
+                papers = await fetch_papers_by_ids([f"DOI:{d}" for d in missing])
+        except Exception as e:
+            print(f"[Batch Resolver] S2 prefetch failed: {e}")
+            return stats
+
+        for clean_doi in missing:
+            paper = papers.get(f"DOI:{clean_doi}")
+            if paper:
+                await paper_cache.set(f"s2:doi:{clean_doi}", format_s2_result(paper))
+                stats["s2_found"] += 1
+            else:
+                await paper_cache.set(doi_miss_key("s2", clean_doi), _MISSING, negative=True)
+
+    print(f"[Batch Resolver] Prefetched {stats}")
+    return stats
+
+
+class StreamingPrefetcher:
+    """
+    流式提取时的文档级批量解析：带 DOI 的引用先缓冲，攒满一批、窗口到期或提取结束时
+    整批 prefetch_citations 后再派发审计；不带 DOI 的引用由调用方直接派发，不受影响
+    """
+
+    def __init__(self, dispatch: Callable, window_ms: float = PREFETCH_WINDOW_MS,
+                 max_batch: int = OPENALEX_DOI_BATCH_SIZE):
+        self.dispatch = dispatch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._buffer: List = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, cit):
+        self._buffer.append(cit)
+        if len(self._buffer) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            self._tasks.append(asyncio.create_task(self._prefetch_then_dispatch(batch)))
+
+    async def _prefetch_then_dispatch(self, batch: List):
+        # prefetch_citations 自行处理上游错误；失败时各条引用照常单独查询
+        await prefetch_citations(batch)
+        for cit in batch:
+            self.dispatch(cit)
+
+    async def drain(self):
+        """提取结束：预取剩余的缓冲并等待所有批次派发完毕"""
+        self.flush()
+        await asyncio.gather(*self._tasks)
+
+    async def cancel(self):
+        """流水线被取消 (客户端断开)：丢弃缓冲，取消进行中的预取"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._buffer = []
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
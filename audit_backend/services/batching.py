@@ -0,0 +1,117 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from services.resilience import current_deadline, detached_context
+
+
+class MicroBatcher:
+    """
+    请求合批：把一个时间窗口内 (或攒满 max_batch 个) 的单条查询合成一次上游调用。
+    - flush_fn 接收 key 列表，返回 {key: result}；缺失的 key 得到 None
+    - 同一窗口内重复的 key 共享同一个结果
+    - flush_fn 抛出异常时，该批次所有等待者都会收到这个异常
+    - 某个 key 的等待者全部取消 (例如客户端断开)：尚未发出的 key 从窗口中移除；
+      已发出的批次只有在所有 key 都无人等待时才取消上游调用
+    - 批次混合了多个请求的 key，不能沿用触发 flush 的那个请求的截止时间和重试预算：
+      上游调用在独立的 context 中执行，截止时间取批内等待者中最晚的一个 (有不限时的等待者则不限)
+    """
+
+    def __init__(self, name: str, flush_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+                 max_batch: int = 50, window_ms: float = 25):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.window_ms = window_ms
+
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        # 当前窗口内各等待者的截止时间 (None 为不限)
+        self._pending_deadlines: List[Optional[float]] = []
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._running: Dict[asyncio.Task, Dict[Hashable, asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"submitted": 0, "batches": 0, "upstream_calls_saved": 0, "abandoned_keys": 0,
+                      "cancelled_batches": 0}
+
+    async def submit(self, key: Hashable) -> Any:
+        self.stats["submitted"] += 1
+        # 批次要等到窗口内最晚的等待者的截止时间 (包括加入同一 key 的等待者)
+        self._pending_deadlines.append(current_deadline())
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+
+            if len(self._pending) >= self.max_batch:
+                self._flush_now()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window_ms / 1000, self._flush_now)
+
+        # shield: 单个等待者被取消不影响同批次的其他请求
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if self._waiters[future] == 0:
+                del self._waiters[future]
+                if not future.done():
+                    self._abandon(key, future)
+
+    def _abandon(self, key: Hashable, future: asyncio.Future):
+        """最后一个等待者已取消：不再为这个 key 消耗上游配额"""
+        self.stats["abandoned_keys"] += 1
+        if self._pending.get(key) is future:
+            del self._pending[key]
+            future.cancel()
+            if not self._pending:
+                self._pending_deadlines = []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            return
+        for task, batch in self._running.items():
+            if batch.get(key) is future:
+                if not any(f in self._waiters for f in batch.values()):
+                    self.stats["cancelled_batches"] += 1
+                    task.cancel()
+                return
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        deadlines, self._pending_deadlines = self._pending_deadlines, []
+        deadline = None if None in deadlines else max(deadlines, default=None)
+        self.stats["batches"] += 1
+        self.stats["upstream_calls_saved"] += len(batch) - 1
+        # 不在触发 flush 的请求的 context 中执行 (定时器回调同样会带上设置定时器的请求的 context)
+        task = asyncio.get_running_loop().create_task(self._run(batch), context=detached_context(deadline))
+        self._running[task] = batch
+        task.add_done_callback(lambda t: self._running.pop(t, None))
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self.flush_fn(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except BaseException as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # 没有等待者时避免 "exception was never retrieved" 警告
+                    future.exception()
+            return
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+
+def chunked(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Any, Dict
+from dotenv import load_dotenv
+
+from services.metrics import CACHE_LOOKUPS
+from services.shared_state import SHARED_ENABLED, shared_key, shared_get, shared_set
+
+load_dotenv()
+
+
+class TieredCache:
+    """
+    分级缓存：进程内 LRU (微秒级) → Redis 共享层 (可选，跨 worker / 副本) → SQLite 持久化 (跨重启)。
+    - 命中结果与 "未找到" 结果分别使用不同的 TTL (负缓存更短)
+    - 记录各层的命中/未命中次数
+    - db_path 为空时不使用 SQLite；shared=True 且配置了 REDIS_URL 时启用共享层
+    """
+
+    def __init__(self, name: str, max_entries: int = 2048, ttl: float = 7 * 86400,
+                 negative_ttl: float = 6 * 3600, db_path: Optional[str] = None, shared: bool = False):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.db_path = db_path
+        self.shared = shared and SHARED_ENABLED
+
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.stats = {"memory_hits": 0, "shared_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0,
+                      "negative_hits": 0}
+
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @property
+    def _table(self) -> str:
+        return "cache_" + re.sub(r"\W", "_", self.name)
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._lru[key] = (value, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+
+        # 第一层：内存 LRU
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._lru.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    CACHE_LOOKUPS.inc(cache=self.name, result="memory")
+                    self._count_negative(entry[0])
+                    return entry[0]
+                del self._lru[key]
+
+        # 第二层：Redis 共享层 (其他 worker / 副本写入的结果)，存储为 [value, expires_at]
+        if self.shared:
+            entry = await shared_get(self._shared_key(key))
+            if entry is not None and entry[1] > now:
+                self._remember(key, entry[0], entry[1])
+                self.stats["shared_hits"] += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="shared")
+                self._count_negative(entry[0])
+                return entry[0]
+
+        # 第三层：SQLite
+        if self._db is not None:
+            with self._lock:
+                row = self._db.execute(
+                    f"SELECT value, expires_at FROM {self._table} WHERE key = ?", (key,)
+                ).fetchone()
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                if self.shared:
+                    await shared_set(self._shared_key(key), [value, row[1]], row[1] - now)
+                self.stats["disk_hits"] += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="disk")
+                self._count_negative(value)
+                return value
+
+        self.stats["misses"] += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+        return None
+
+    async def set(self, key: str, value: Any, negative: bool = False):
+        expires_at = time.time() + (self.negative_ttl if negative else self.ttl)
+        self._remember(key, value, expires_at)
+        self.stats["writes"] += 1
+
+        if self.shared:
+            await shared_set(self._shared_key(key), [value, expires_at], expires_at - time.time())
+
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+
+    def _shared_key(self, key: str) -> str:
+        return shared_key("cache", self.name, key)
+
+    def purge_expired(self):
+        """清理 SQLite 中已过期的条目"""
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(f"DELETE FROM {self._table} WHERE expires_at <= ?", (time.time(),))
+
+    def _count_negative(self, value: Any):
+        if isinstance(value, dict) and value.get("found") is False:
+            self.stats["negative_hits"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["shared_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._lru),
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def normalize_doi(doi: Optional[str]) -> str:
+    doi = (doi or "").strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "doi:"):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi.strip()
+
+
+def paper_cache_key(title: Optional[str], author: Optional[str] = None, year: Optional[str] = None,
+                    doi: Optional[str] = None) -> str:
+    """DOI 优先；否则使用 归一化标题 + 作者 + 年份"""
+    clean_doi = normalize_doi(doi)
+    if clean_doi:
+        return f"doi:{clean_doi}"
+    clean_year = "".join(filter(str.isdigit, str(year or "")))
+    return f"tay:{_normalize_text(title)}|{_normalize_text(author)}|{clean_year}"
+
+
+def doi_miss_key(source: str, clean_doi: str) -> str:
+    """
+    "该来源查无此 DOI" 的负缓存 key。只跳过 DOI 精确查找，标题检索照常进行，
+    因此不能写在整次查询的 key (source:doi:...) 下
+    """
+    return f"{source}:doi-miss:{clean_doi}"
+
+
+def is_cacheable_result(result: dict) -> bool:
+    """上游报错 (网络/429/5xx) 导致的 "未找到" 不能写入负缓存"""
+    return not result.get("upstream_error")
+
+
+# OpenAlex 与 Semantic Scholar 共用一个存储，key 按来源加前缀区分
+PAPER_CACHE_DB = os.getenv("PAPER_CACHE_DB", os.path.join(os.path.dirname(__file__), "..", "cache", "paper_cache.db"))
+
+paper_cache = TieredCache(
+    "papers",
+    max_entries=int(os.getenv("PAPER_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("PAPER_CACHE_TTL", str(30 * 86400))),
+    negative_ttl=float(os.getenv("PAPER_CACHE_NEGATIVE_TTL", str(6 * 3600))),
+    db_path=PAPER_CACHE_DB or None,
+    shared=True,
+)
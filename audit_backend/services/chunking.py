@@ -0,0 +1,127 @@
+import os
+import re
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+
+from services.cache import paper_cache_key
+from services.matching import MatchQuery, normalize_title
+
+load_dotenv()
+
+# 长文本分块提取：每块不超过 EXTRACT_CHUNK_CHARS，相邻块重叠不超过 EXTRACT_CHUNK_OVERLAP 字符
+EXTRACT_CHUNK_CHARS = int(os.getenv("EXTRACT_CHUNK_CHARS", "4000"))
+EXTRACT_CHUNK_OVERLAP = int(os.getenv("EXTRACT_CHUNK_OVERLAP", "400"))
+
+# 同一论文的两条引用，原文相似度达到该值视为重叠区域的重复提取
+DUPLICATE_SIMILARITY = 0.85
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？；;])\s*")
+
+
+def _split_oversized(unit: str, max_chars: int) -> List[str]:
+    """超长段落按句子切分；单句仍超长时硬切"""
+    pieces, current = [], ""
+    for sentence in filter(None, _SENTENCE_END_RE.split(unit)):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text: str, max_chars: int = EXTRACT_CHUNK_CHARS,
+                      overlap: int = EXTRACT_CHUNK_OVERLAP) -> List[str]:
+    """
+    按段落 / 参考文献条目 (行) 边界把长文本切成多块，不会把一条引用切断。
+    相邻块之间重复前一块末尾的若干完整段落 (合计不超过 overlap)，
+    让跨段落的 claim 与其引用出现在同一块中；由此产生的重复提取由 CitationMerger 去除。
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    units = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            units.extend(_split_oversized(line, max_chars) if len(line) > max_chars else [line])
+
+    chunks, current, size = [], [], 0
+    for unit in units:
+        if current and size + len(unit) > max_chars:
+            chunks.append("\n".join(current))
+            tail, tail_size = [], 0
+            for prev in reversed(current):
+                if tail_size + len(prev) + 1 > overlap or tail_size + len(prev) + len(unit) + 2 > max_chars:
+                    break
+                tail.insert(0, prev)
+                tail_size += len(prev) + 1
+            current, size = tail, tail_size
+        current.append(unit)
+        size += len(unit) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _identity(cit) -> str:
+    if cit.title or cit.doi:
+        return paper_cache_key(cit.title, cit.author, cit.year, cit.doi)
+    return "raw:" + normalize_title(cit.raw_text)
+
+
+def _same_mention(a, b) -> bool:
+    raw_a, raw_b = normalize_title(a.raw_text), normalize_title(b.raw_text)
+    if raw_a == raw_b or (raw_a and raw_b and (raw_a in raw_b or raw_b in raw_a)):
+        return True
+    return MatchQuery(raw_a).title_similarity(raw_b) >= DUPLICATE_SIMILARITY
+
+
+class CitationMerger:
+    """
+    合并各块的提取结果：同一论文 (DOI 或 标题 + 作者 + 年份) 且原文基本一致的引用只保留一条，
+    后出现的副本只用于补全缺失字段与 claim (流式模式下已派发审计的引用不再修改)。
+    同一论文在文中不同位置的不同引用各自保留。
+    """
+
+    def __init__(self, fill_missing: bool = True):
+        self.fill_missing = fill_missing
+        self._items = []
+        self._by_identity: Dict[str, List] = {}
+        self.duplicates = 0
+
+    def add(self, cit) -> Tuple[object, bool]:
+        """返回 (保留的引用, 是否为新引用)；新引用按加入顺序重新编号"""
+        bucket = self._by_identity.setdefault(_identity(cit), [])
+        for existing in bucket:
+            if _same_mention(existing, cit):
+                self.duplicates += 1
+                if self.fill_missing:
+                    _fill_missing(existing, cit)
+                return existing, False
+
+        cit.id = len(self._items) + 1
+        self._items.append(cit)
+        bucket.append(cit)
+        return cit, True
+
+    def citations(self) -> List:
+        return list(self._items)
+
+
+def _fill_missing(target, other):
+    for field in ("title", "author", "year", "doi"):
+        if not getattr(target, field) and getattr(other, field):
+            setattr(target, field, getattr(other, field))
+    if len(other.summary_intent or "") > len(target.summary_intent or ""):
+        target.summary_intent = other.summary_intent
+    for claim in other.specific_claims:
+        if claim not in target.specific_claims:
+            target.specific_claims.append(claim)
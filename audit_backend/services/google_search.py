@@ -1,20 +1,27 @@
 import os
 import json
 import httpx
+from typing import Optional
 from dotenv import load_dotenv
 
+from services.http_client import get_http_client
+from services.resilience import call_upstream
+from services.metrics import span
+
 load_dotenv()
 
 API_KEY = os.getenv("GEMINI_API_KEY")
 
 
-async def verify_with_google_search(title: str, author: str, claim_summary: str) -> dict:
+async def verify_with_google_search(title: str, author: str, claim_summary: str,
+                                    client: Optional[httpx.AsyncClient] = None) -> dict:
     """
     使用 Gemini 2.0 Flash + Google Search 进行全网核查。
     优化点：使用 JSON Schema 强制结构化输出。
     """
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
+    client = client or get_http_client("gemini")
+    url = f"/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
 
     # Prompt 可以更加专注于“思考逻辑”，而不用操心“格式”
     prompt = f"""
@@ -80,9 +87,9 @@ async def verify_with_google_search(title: str, author: str, claim_summary: str)
     headers = {"Content-Type": "application/json"}
 
     try:
-        # 使用异步请求
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(url, json=payload, headers=headers)
+        # 使用共享连接池发起异步请求
+        with span("google_search.request"):
+            response = await call_upstream("gemini", lambda: client.post(url, json=payload, headers=headers))
 
         if response.status_code != 200:
             print(f"[Google Search API Error] Status: {response.status_code} - {response.text}")
@@ -0,0 +1,93 @@
+import os
+import httpx
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# HTTP/2 需要额外安装 h2 (pip install "httpx[http2]")，没有时自动退回 HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# 每个上游一个长连接池：独立的超时与连接上限，互不抢占
+# base_url 可用环境变量覆盖 (例如指向 benchmarks/mock_upstreams.py 启动的本地模拟服务)
+UPSTREAMS: Dict[str, dict] = {
+    "openalex": {
+        "base_url": os.getenv("OPENALEX_BASE_URL", "https://api.openalex.org"),
+        "timeout": httpx.Timeout(20.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+    },
+    "semantic_scholar": {
+        "base_url": os.getenv("S2_BASE_URL", "https://api.semanticscholar.org"),
+        "timeout": httpx.Timeout(20.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+    },
+    "gemini": {
+        "base_url": os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com"),
+        "timeout": httpx.Timeout(30.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+    },
+}
+
+# Gemini SDK 走 gRPC，不经过上面的 httpx 连接池。设置后改用明文 gRPC 连接该地址 (仅用于本地模拟服务)；
+# SDK 不允许同时提供 transport 与 API key，此时 GEMINI_API_KEY 必须为空
+GEMINI_GRPC_TARGET = os.getenv("GEMINI_GRPC_TARGET", "")
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    config = UPSTREAMS[name]
+    return httpx.AsyncClient(
+        base_url=config["base_url"],
+        timeout=config["timeout"],
+        limits=config["limits"],
+        http2=HTTP2_AVAILABLE,
+    )
+
+
+async def init_http_clients() -> None:
+    """在 FastAPI lifespan 启动阶段调用：为每个上游建立一个共享的 AsyncClient"""
+    for name in UPSTREAMS:
+        if name not in _clients:
+            _clients[name] = _build_client(name)
+    print(f"[HTTP] Upstream clients ready: {', '.join(_clients)} (HTTP/2: {HTTP2_AVAILABLE})")
+    if GEMINI_GRPC_TARGET:
+        configure_gemini_grpc_target(GEMINI_GRPC_TARGET)
+
+
+def configure_gemini_grpc_target(target: str) -> None:
+    """让 Gemini SDK 的异步客户端连接指定的明文 gRPC 地址；必须在事件循环内调用 (gRPC aio 通道绑定当前循环)"""
+    import grpc
+    import google.generativeai as genai
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+        GenerativeServiceGrpcAsyncIOTransport
+    )
+
+    channel = grpc.aio.insecure_channel(target)
+    genai.configure(transport=GenerativeServiceGrpcAsyncIOTransport(channel=channel))
+    print(f"[HTTP] Gemini SDK → grpc://{target}")
+
+
+async def close_http_clients() -> None:
+    """在 lifespan 关闭阶段调用：释放所有连接"""
+    for name in list(_clients):
+        client = _clients.pop(name)
+        await client.aclose()
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """
+    获取某个上游的共享客户端。
+    没走 lifespan 的场景（脚本、单独调用 service）会按需创建，
+    之后同样复用同一个连接池。
+    """
+    client: Optional[httpx.AsyncClient] = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
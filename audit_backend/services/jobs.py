@@ -0,0 +1,208 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+from services.llm_extractor import stream_citations_from_text
+from services.resilience import start_retry_budget
+from services.auditor import start_audit_batching
+from services.metrics import start_request_timing, summarize_timing
+
+load_dotenv()
+
+# 批量审计任务 (大型参考文献列表)
+JOB_MAX_CHARS = int(os.getenv("JOB_MAX_CHARS", "500000"))
+JOB_MAX_CITATIONS = int(os.getenv("JOB_MAX_CITATIONS", "5000"))
+# 每个任务的并发 worker 数；所有任务合计同时审计的引用数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "32"))
+# 同时运行的任务数，超出的任务排队 (状态为 queued)
+JOB_MAX_ACTIVE = int(os.getenv("JOB_MAX_ACTIVE", "4"))
+# 提取与审计之间的缓冲队列长度：审计跟不上时提取暂停 (背压)
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "64"))
+# 每个任务共享的上游重试预算
+JOB_RETRY_BUDGET = int(os.getenv("JOB_RETRY_BUDGET", "200"))
+# 已结束任务的保留时间
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class AuditJob:
+    def __init__(self, text: str):
+        self.id = uuid.uuid4().hex
+        self.text = text
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.extracted = 0
+        self.extraction_done = False
+        self.results: List[dict] = []
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.timing: Optional[dict] = None
+        self.timing_finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    async def notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for_change(self, seen: int):
+        async with self._changed:
+            await self._changed.wait_for(lambda: len(self.results) > seen or self.finished)
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "extracted": self.extracted,
+            "extraction_done": self.extraction_done,
+            "completed": len(self.results),
+            "by_status": dict(Counter(r.get("status") for r in self.results)),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "timing": summarize_timing(self.timing, self.timing_finished) if self.timing else None,
+        }
+
+
+class JobManager:
+    """
+    批量审计任务：提交后立即返回 job_id，后台流式提取引用并由有界 worker 池审计。
+    - 提取 → 有界队列 → N 个 worker，审计跟不上时提取自动暂停
+    - 全局信号量限制所有任务合计的并发审计数，单个大任务不会挤占 /api/audit
+    - 结果按完成顺序追加，可轮询 (offset 分页) 或以 NDJSON 持续拉取
+    """
+
+    def __init__(self, process_fn: Callable[[Any], Awaitable[Any]]):
+        self.process_fn = process_fn
+        self.jobs: Dict[str, AuditJob] = {}
+        self._active: Optional[asyncio.Semaphore] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "citations_audited": 0}
+
+    @property
+    def active(self) -> asyncio.Semaphore:
+        if self._active is None:
+            self._active = asyncio.Semaphore(JOB_MAX_ACTIVE)
+        return self._active
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(JOB_MAX_CONCURRENCY)
+        return self._slots
+
+    def submit(self, text: str) -> AuditJob:
+        self.purge_finished()
+        job = AuditJob(text)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        self.stats["submitted"] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[AuditJob]:
+        return self.jobs.get(job_id)
+
+    async def cancel(self, job: AuditJob):
+        if job.task and not job.task.done():
+            job.task.cancel()
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                pass
+
+    def purge_finished(self):
+        now = time.time()
+        expired = [jid for jid, job in self.jobs.items()
+                   if job.finished and job.finished_at and now - job.finished_at > JOB_TTL]
+        for jid in expired:
+            del self.jobs[jid]
+
+    async def close(self):
+        for job in list(self.jobs.values()):
+            await self.cancel(job)
+
+    async def stream(self, job: AuditJob, offset: int = 0) -> AsyncIterator[dict]:
+        """从 offset 开始依次产出结果，直到任务结束"""
+        sent = offset
+        while True:
+            while sent < len(job.results):
+                yield job.results[sent]
+                sent += 1
+            if job.finished:
+                return
+            await job.wait_for_change(sent)
+
+    async def _run(self, job: AuditJob):
+        start_retry_budget(JOB_RETRY_BUDGET)
+        start_audit_batching()
+        job.timing = start_request_timing()
+        try:
+            async with self.active:
+                job.status = "running"
+                await job.notify()
+                await self._audit_all(job)
+            job.status = "done"
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            self.stats["cancelled"] += 1
+            raise
+        except Exception as e:
+            print(f"[Job Error] {job.id}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            self.stats["failed"] += 1
+        finally:
+            job.finished_at = time.time()
+            job.timing_finished = time.perf_counter()
+            job.text = ""
+            # notify 需要获取锁；取消路径中用 shield 保证等待方一定被唤醒
+            await asyncio.shield(job.notify())
+
+    async def _audit_all(self, job: AuditJob):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+
+        async def worker():
+            while (cit := await queue.get()) is not None:
+                async with self.slots:
+                    try:
+                        result = await self.process_fn(cit)
+                        result = result.dict() if hasattr(result, "dict") else result
+                    except Exception as e:
+                        # 单条失败不影响整个任务
+                        print(f"[Job Error] {job.id} citation #{cit.id}: {e}")
+                        result = {"citation_text": cit.raw_text, "status": "ERROR", "source": "System",
+                                  "metadata": {}, "message": f"Audit failed: {e}", "confidence": 0.0}
+                job.results.append(result)
+                self.stats["citations_audited"] += 1
+                await job.notify()
+
+        workers = [asyncio.create_task(worker()) for _ in range(JOB_WORKERS)]
+        try:
+            async for cit in stream_citations_from_text(job.text):
+                if job.extracted >= JOB_MAX_CITATIONS:
+                    print(f"⚠️ Job {job.id} truncated to {JOB_MAX_CITATIONS} citations.")
+                    break
+                job.extracted += 1
+                await queue.put(cit)
+            job.extraction_done = True
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+
+    def get_stats(self) -> dict:
+        states = Counter(job.status for job in self.jobs.values())
+        return {**self.stats, "jobs": dict(states)}
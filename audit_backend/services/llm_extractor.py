@@ -1,17 +1,42 @@
 import os
 import json
+import hashlib
 import re
+import time
+import asyncio
 import google.generativeai as genai
 from pydantic import BaseModel
-from typing import List, Optional, Union
+from typing import List, Optional, Union, AsyncIterator
 from dotenv import load_dotenv
-import time
-import google.api_core.exceptions
+
+from services.resilience import call_upstream, release_upstream_slot
+from services.chunking import split_into_chunks, CitationMerger
+from services.reference_parser import parse_references, match_reference
+from services.metrics import span, record_stage
+from services.cache import TieredCache
 
 load_dotenv()
 
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+EXTRACTION_MODEL = 'gemini-2.0-flash'
+# 提取结果应由输入文本唯一确定：同一段文本每次得到相同的字段，增量审计的指纹才稳定
+EXTRACTION_CONFIG = {"temperature": 0}
+
+# 长文本分块提取时同时进行的分块数上限。流式提取中，分块的名额在调用方取完它的全部引用后才归还，
+# 因此未被读取的引用最多来自这么多个分块；Gemini 流本身始终读到底，不会因调用方读得慢而占着并发位置
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "4"))
+
+# 分块提取缓存：反复修改后重新提交的草稿，未改动的段落不再调用 Gemini。
+# 默认仅内存；设置 EXTRACTION_CACHE_DB 后持久化到 SQLite，设置 REDIS_URL 后各进程共享
+extraction_cache = TieredCache(
+    "extractions",
+    max_entries=int(os.getenv("EXTRACTION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("EXTRACTION_CACHE_TTL", str(86400))),
+    db_path=os.getenv("EXTRACTION_CACHE_DB") or None,
+    shared=True,
+)
+
 
 class CitationData(BaseModel):
     id: int
@@ -22,32 +47,20 @@ class CitationData(BaseModel):
     doi: Optional[str] = None
     summary_intent: str
     specific_claims: List[str] = []
+    # 本地解析的纯参考文献条目：原文没有对论文内容的陈述，只核实存在性
+    reference_entry: bool = False
 
 
-def generate_with_retry(model, prompt):
-    max_attempts = 2  # 1 次失败 + 1 次重试
-    for attempt in range(max_attempts):
-        try:
-            return model.generate_content(prompt)
-
-        except google.api_core.exceptions.ResourceExhausted:
-            # 属于 Vertex AI 的 429 Resource Exhausted
-            if attempt == max_attempts - 1:
-                raise  # 最后一次失败 → 抛出
-
-            wait = 2 ** attempt  # 第一次失败等待 1s
-            print(f"[WARN] 429 Resource Exhausted. {wait}s 后重试第 {attempt + 2} 次调用...")
-            time.sleep(wait)
-
-        except Exception:
-            raise  # 其他错误不属于可重试范围，直接抛出
+async def generate_with_retry(model, prompt, stream: bool = False):
+    # 经统一弹性层调用：429 时暂停整个上游并重新排队，网络 / 5xx 错误指数退避重试，
+    # 熔断打开时直接失败。参数错误等不可重试的异常直接抛出
+    # 流式响应在读完之前一直占着调度器的并发位置 (调用方读完后 release_upstream_slot)
+    return await call_upstream("gemini", lambda: model.generate_content_async(prompt, stream=stream),
+                               hold_slot=stream)
 
 
-def extract_citations_from_text(text: str) -> List[CitationData]:
-    print(f"\n[Debug] 正在让 Gemini 提取文本: {text[:50]}...")
-    model = genai.GenerativeModel('gemini-2.0-flash')
-
-    prompt = f"""
+def build_extraction_prompt(text: str) -> str:
+    return f"""
         You are a forensic text auditor. 
         Analyze the text and extract ALL academic papers mentioned.
 
@@ -82,33 +95,274 @@ def extract_citations_from_text(text: str) -> List[CitationData]:
         {text}
     """
 
-    try:
-        response = generate_with_retry(model, prompt)
-        raw_content = response.text
 
-        # 清洗逻辑
-        clean_json = raw_content.replace("```json", "").replace("```", "").strip()
-        data = json.loads(clean_json)
+def extraction_cache_key(prompt: str) -> str:
+    """按完整 Prompt (含分块文本) + 模型名哈希，修改 Prompt 后旧缓存自动失效"""
+    return hashlib.sha256(f"{EXTRACTION_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def to_citation(item: dict, idx: int) -> CitationData:
+    item['id'] = idx
+
+    # 容错处理
+    if not item.get('raw_text'):
+        item['raw_text'] = item.get('title', 'Unknown Reference')
+    if 'specific_claims' not in item or item['specific_claims'] is None:
+        item['specific_claims'] = []
+    # 只有本地解析器能标记纯参考文献条目，模型输出里的同名字段一律忽略
+    item.pop('reference_entry', None)
+
+    # 类型强制转换 - 无论 Gemini 返回的是 int 1992 还是 str "1992"，都转成 str
+    if 'year' in item and item['year'] is not None:
+        item['year'] = str(item['year'])
+
+    return CitationData(**item)
+
+
+class JsonObjectStream:
+    """
+    增量 JSON 解析器：逐块喂入模型输出，每当数组中的一个对象闭合就把它解析出来。
+    忽略数组外的字符 (例如 ```json 代码块标记)。
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.buffer = []
+        self.capturing = False
+
+    def feed(self, chunk: str) -> List[dict]:
+        objects = []
+        for ch in chunk:
+            if self.capturing:
+                self.buffer.append(ch)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                # 顶层数组里的对象 (或模型只返回了单个对象)
+                if not self.capturing and self.depth <= 1:
+                    self.capturing = True
+                    self.buffer = [ch]
+                self.depth += 1
+            elif ch == "[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth = max(self.depth - 1, 0)
+                if ch == "}" and self.capturing and self.depth <= 1:
+                    self.capturing = False
+                    try:
+                        objects.append(json.loads("".join(self.buffer)))
+                    except json.JSONDecodeError as e:
+                        print(f"[WARN] 跳过无法解析的引用对象: {e}")
+                    self.buffer = []
+        return objects
+
+
+def parse_citation_list(raw_content: str) -> List[CitationData]:
+    # 清洗逻辑
+    clean_json = raw_content.replace("```json", "").replace("```", "").strip()
+    data = json.loads(clean_json)
+    return [to_citation(item, idx + 1) for idx, item in enumerate(data)]
+
+
+def _parse_locally(text: str) -> tuple:
+    """
+    本地解析结构化参考文献，返回 (引用列表, 仍需 LLM 提取的文本)。
+    文本非空时 (混合文档) 引用列表只是参考文献条目，用于补全 LLM 提取结果的字段
+    """
+    with span("extract.local_parse"):
+        parsed, remaining = parse_references(text)
+    citations = [to_citation(item, idx + 1) for idx, item in enumerate(parsed)]
+    for citation in citations:
+        citation.reference_entry = True
+    if citations and not remaining.strip():
+        print(f"[Debug] 本地解析 {len(citations)} 条引用，无需调用 Gemini")
+    elif citations:
+        print(f"[Debug] 正文 + 参考文献混合文档：整篇交给 Gemini，{len(citations)} 条参考文献条目用于补全字段")
+    return citations, remaining
 
-        results = []
-        for idx, item in enumerate(data):
-            item['id'] = idx + 1
 
-            # 容错处理
-            if not item.get('raw_text'):
-                item['raw_text'] = item.get('title', 'Unknown Reference')
-            if 'specific_claims' not in item or item['specific_claims'] is None:
-                item['specific_claims'] = []
+def _fill_from_references(citation: CitationData, references: List[dict]) -> CitationData:
+    """正文引用 ("Smith (2020) shows X") 缺失的标题 / DOI / 年份 / 作者从对应的参考文献条目补全"""
+    ref = match_reference(citation.title, citation.author, citation.year, citation.doi, references)
+    if ref is not None:
+        for field in ("title", "doi", "year", "author"):
+            if not getattr(citation, field) and ref[field]:
+                setattr(citation, field, ref[field])
+    return citation
 
-            # 类型强制转换 - 无论 Gemini 返回的是 int 1992 还是 str "1992"，都转成 str
-            if 'year' in item and item['year'] is not None:
-                item['year'] = str(item['year'])
 
-            results.append(CitationData(**item))
+async def extract_citations_from_text(text: str) -> List[CitationData]:
+    """纯参考文献列表 / BibTeX / RIS / CSL-JSON 本地解析；其余文本整篇交给 Gemini，参考文献条目用于补全字段"""
+    citations, remaining = _parse_locally(text)
+    if not remaining.strip():
+        return citations
+
+    llm_citations = await _extract_with_llm(remaining)
+    references = [citation.dict() for citation in citations]
+    return [_fill_from_references(citation, references) for citation in llm_citations]
+
+
+async def _extract_with_llm(text: str) -> List[CitationData]:
+    """长文本按段落边界分块并发提取，合并去重后按原文顺序返回；单块失败只丢失该块"""
+    chunks = split_into_chunks(text)
+    if len(chunks) == 1:
+        return await _extract_chunk(text)
+
+    print(f"[Debug] 长文本 ({len(text)} 字符) 拆分为 {len(chunks)} 块并发提取")
+    slots = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+
+    async def extract(chunk: str) -> List[CitationData]:
+        async with slots:
+            return await _extract_chunk(chunk)
+
+    merger = CitationMerger()
+    for citations in await asyncio.gather(*(extract(chunk) for chunk in chunks)):
+        for citation in citations:
+            merger.add(citation)
+    print(f"[Debug] 合并后 {len(merger.citations())} 条引用 (去除重复 {merger.duplicates} 条)")
+    return merger.citations()
+
+
+async def _extract_chunk(text: str) -> List[CitationData]:
+    prompt = build_extraction_prompt(text)
+    cache_key = extraction_cache_key(prompt)
+    cached = await extraction_cache.get(cache_key)
+    if cached is not None:
+        return [CitationData(**item) for item in cached]
+
+    print(f"\n[Debug] 正在让 Gemini 提取文本: {text[:50]}...")
+    model = genai.GenerativeModel(EXTRACTION_MODEL, generation_config=EXTRACTION_CONFIG)
+
+    try:
+        with span("extract.llm"):
+            response = await generate_with_retry(model, prompt)
+            results = parse_citation_list(response.text)
 
         print(f"[Debug] 成功提取到 {len(results)} 条引用")
+        await extraction_cache.set(cache_key, [citation.dict() for citation in results])
         return results
 
     except Exception as e:
         print(f"[ERROR] 提取失败: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+async def stream_citations_from_text(text: str) -> AsyncIterator[CitationData]:
+    """
+    流式提取：边接收 Gemini 的输出边解析，每个引用对象一闭合就立即 yield，
+    调用方无需等待整个 JSON 数组生成完毕即可开始审计。
+    纯参考文献列表本地解析后直接输出 (不消耗 token)；混合文档中的参考文献条目用于补全正文引用的字段；
+    长文本分块后各块并发流式提取 (最多 EXTRACT_CONCURRENCY 块同时进行)，按到达顺序去重输出，首条延迟只取决于单块大小。
+    """
+    citations, remaining = _parse_locally(text)
+    merger = CitationMerger(fill_missing=False)
+    if not remaining.strip():
+        for citation in citations:
+            citation, is_new = merger.add(citation)
+            if is_new:
+                yield citation
+        return
+    references = [citation.dict() for citation in citations]
+
+    chunks = split_into_chunks(remaining)
+    if len(chunks) > 1:
+        print(f"[Debug] 长文本 ({len(text)} 字符) 拆分为 {len(chunks)} 块并发流式提取")
+    # 单块也经过队列：写入不阻塞，Gemini 流不会因下游 (例如任务的审计队列) 变慢而停在半途占着并发位置。
+    # 队列中的引用最多来自 EXTRACT_CONCURRENCY 个分块：名额在取到该分块的结束标记时才归还
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+
+    async def pump(chunk: str):
+        await slots.acquire()
+        try:
+            async for citation in _stream_chunk(chunk):
+                queue.put_nowait(citation)
+        finally:
+            queue.put_nowait(None)
+
+    tasks = [asyncio.create_task(pump(chunk)) for chunk in chunks]
+    pending = len(tasks)
+    try:
+        while pending:
+            citation = await queue.get()
+            if citation is None:
+                pending -= 1
+                slots.release()
+                continue
+            citation, is_new = merger.add(_fill_from_references(citation, references))
+            if is_new:
+                yield citation
+        if len(chunks) > 1:
+            print(f"[Debug] 分块流式提取完成，共 {len(merger.citations())} 条 (去除重复 {merger.duplicates} 条)")
+    finally:
+        # 调用方提前停止 (截断 / 取消) 时不再继续消耗 Gemini 配额，并等待各分块退出
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _stream_chunk(text: str) -> AsyncIterator[CitationData]:
+    prompt = build_extraction_prompt(text)
+    cache_key = extraction_cache_key(prompt)
+    cached = await extraction_cache.get(cache_key)
+    if cached is not None:
+        for item in cached:
+            yield CitationData(**item)
+        return
+
+    print(f"\n[Debug] 正在让 Gemini 流式提取文本: {text[:50]}...")
+    model = genai.GenerativeModel(EXTRACTION_MODEL, generation_config=EXTRACTION_CONFIG)
+
+    parser = JsonObjectStream()
+    raw_chunks = []
+    extracted = []
+    count = 0
+    started = time.perf_counter()
+
+    try:
+        with span("extract.llm_stream"):
+            response = await generate_with_retry(model, prompt, stream=True)
+            try:
+                async for chunk in response:
+                    piece = chunk.text
+                    raw_chunks.append(piece)
+                    for item in parser.feed(piece):
+                        try:
+                            citation = to_citation(item, count + 1)
+                        except Exception as e:
+                            print(f"[WARN] 跳过字段不完整的引用: {e}")
+                            continue
+                        if count == 0:
+                            # 流水线的关键指标：首条引用出现的延迟
+                            record_stage("extract.first_citation", time.perf_counter() - started)
+                        count += 1
+                        extracted.append(citation)
+                        yield citation
+            finally:
+                await release_upstream_slot("gemini")
+
+            # 兜底：增量解析一个都没拿到 (输出格式异常)，退回整体解析
+            if count == 0:
+                for citation in parse_citation_list("".join(raw_chunks)):
+                    count += 1
+                    extracted.append(citation)
+                    yield citation
+
+        print(f"[Debug] 流式提取完成，共 {count} 条引用")
+        # 只缓存完整读完的输出 (中途被取消或出错时不会执行到这里)
+        await extraction_cache.set(cache_key, [citation.dict() for citation in extracted])
+
+    except Exception as e:
+        print(f"[ERROR] 流式提取失败 (已输出 {count} 条): {e}")
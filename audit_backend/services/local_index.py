@@ -0,0 +1,183 @@
+import os
+import re
+import sys
+import gzip
+import json
+import asyncio
+import sqlite3
+import threading
+from typing import Optional, List, Iterable
+from dotenv import load_dotenv
+
+from services.cache import normalize_doi
+
+load_dotenv()
+
+# 本地离线索引 (由 OpenAlex works 快照构建的 SQLite FTS5 库)
+# 构建: python -m services.local_index build <index.db> <works_part_000.gz> [更多文件...]
+LOCAL_INDEX_PATH = os.getenv("OPENALEX_LOCAL_INDEX", "")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE,
+    doi TEXT,
+    title TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS works_doi ON works (doi);
+CREATE VIRTUAL TABLE IF NOT EXISTS works_fts USING fts5 (
+    title, content='works', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def is_available() -> bool:
+    return bool(LOCAL_INDEX_PATH) and os.path.exists(LOCAL_INDEX_PATH)
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        # 只读打开，多个 worker 可共享同一个文件
+        _conn = sqlite3.connect(f"file:{LOCAL_INDEX_PATH}?mode=ro", uri=True, check_same_thread=False)
+        _conn.execute("PRAGMA mmap_size=1073741824")
+    return _conn
+
+
+def _fts_query(title: str, operator: str = " ") -> str:
+    # 每个词加引号，避免标题里的 FTS 语法字符 (- : * 等) 被当作运算符
+    words = re.findall(r"\w+", title.lower())
+    return operator.join(f'"{w}"' for w in words[:12])
+
+
+def _lookup_doi_sync(doi: str) -> Optional[dict]:
+    with _lock:
+        row = _connect().execute("SELECT record FROM works WHERE doi = ? LIMIT 1", (normalize_doi(doi),)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _search_title_sync(title: str, limit: int) -> List[dict]:
+    rows = []
+    # 先要求所有词都出现；查不到 (例如标题有错字) 再放宽为任一词出现，交给评分逻辑筛选
+    for operator in (" ", " OR "):
+        query = _fts_query(title, operator)
+        if not query:
+            return []
+        with _lock:
+            rows = _connect().execute(
+                "SELECT w.record FROM works_fts JOIN works w ON w.rowid = works_fts.rowid "
+                "WHERE works_fts MATCH ? ORDER BY bm25(works_fts) LIMIT ?",
+                (query, limit)
+            ).fetchall()
+        if rows:
+            break
+    return [json.loads(r[0]) for r in rows]
+
+
+async def lookup_doi(doi: str) -> Optional[dict]:
+    """按 DOI 查询，返回 OpenAlex work 结构 (可直接交给 _format_result)"""
+    try:
+        return await asyncio.to_thread(_lookup_doi_sync, doi)
+    except sqlite3.Error as e:
+        print(f"[Local Index Error] {e}")
+        return None
+
+
+async def search_title(title: str, limit: int = 20) -> List[dict]:
+    """全文检索标题，按 bm25 排序返回候选 work 列表"""
+    try:
+        return await asyncio.to_thread(_search_title_sync, title, limit)
+    except sqlite3.Error as e:
+        print(f"[Local Index Error] {e}")
+        return []
+
+
+# ---------- 构建索引 ----------
+
+def compact_work(work: dict) -> dict:
+    """只保留评分与 _format_result 需要的字段，摘要预先还原为纯文本"""
+    from services.openalex import reconstruct_abstract
+
+    open_access = work.get("open_access") or {}
+    return {
+        "id": work.get("id"),
+        "doi": work.get("doi"),
+        "title": work.get("title") or work.get("display_name"),
+        "publication_year": work.get("publication_year"),
+        "authorships": [
+            {"author": {"display_name": (a.get("author") or {}).get("display_name")}}
+            for a in work.get("authorships", [])[:20]
+        ],
+        "open_access": {"is_oa": open_access.get("is_oa", False), "oa_url": open_access.get("oa_url")},
+        "cited_by_count": work.get("cited_by_count", 0),
+        "abstract": reconstruct_abstract(work.get("abstract_inverted_index")),
+    }
+
+
+def _iter_works(paths: Iterable[str]):
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def build_index(db_path: str, paths: List[str], min_citations: int = 0, batch_size: int = 5000) -> int:
+    """把 OpenAlex works JSONL (可 gzip) 导入本地索引，可重复执行以追加更多分片"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(_SCHEMA)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+    total = 0
+    batch = []
+
+    def flush():
+        conn.executemany("INSERT OR REPLACE INTO works (id, doi, title, record) VALUES (?, ?, ?, ?)", batch)
+        conn.commit()
+        batch.clear()
+
+    for work in _iter_works(paths):
+        if not work.get("title") or work.get("cited_by_count", 0) < min_citations:
+            continue
+        record = compact_work(work)
+        batch.append((
+            record["id"], normalize_doi(record["doi"]) or None, record["title"],
+            json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        ))
+        total += 1
+        if len(batch) >= batch_size:
+            flush()
+            print(f"[Local Index] {total} works ingested...")
+    if batch:
+        flush()
+
+    # 外部内容表：统一重建全文索引，保证与 works 表一致
+    conn.execute("INSERT INTO works_fts(works_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO works_fts(works_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"[Local Index] Done: {total} works → {db_path}")
+    return total
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] != "build":
+        print("Usage: python -m services.local_index build <index.db> <works.jsonl[.gz]> [...] [--min-citations N]")
+        sys.exit(1)
+
+    args = sys.argv[2:]
+    min_cites = 0
+    if "--min-citations" in args:
+        i = args.index("--min-citations")
+        min_cites = int(args[i + 1])
+        del args[i:i + 2]
+
+    build_index(args[0], args[1:], min_citations=min_cites)
@@ -0,0 +1,117 @@
+import re
+import difflib
+import unicodedata
+from typing import List, Optional, Sequence, Tuple
+
+# rapidfuzz (C++ 实现) 可选；未安装时退回标准库 difflib，结果一致性见 benchmarks/bench_matching.py
+try:
+    from rapidfuzz import fuzz
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+# "et al." 及中日文的 "等 / 等人 / ほか" 不属于作者名
+_AUTHOR_STOPWORDS = {"et", "al", "and", "&"}
+_CJK_AUTHOR_SUFFIXES = ("等人", "等", "ほか", "他")
+
+
+def normalize_title(text: Optional[str]) -> str:
+    """NFKC (全角→半角) + casefold + 去标点 + 合并空白"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join(_PUNCT_RE.sub("", text).split())
+
+
+def _strip_accents(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def author_tokens(name: Optional[str]) -> Tuple[frozenset, frozenset]:
+    """
+    返回 (拉丁字母 token 集合, CJK 姓名集合)。
+    - 拉丁名: 去重音 (José → jose)，去掉 , . 后按空格切分
+    - CJK 名: 去掉空格整体比较 ("山田 太郎" == "山田太郎")，去掉 "等" 等后缀；
+      原文以空格分隔姓名时，姓与名也各自作为 token
+    """
+    name = unicodedata.normalize("NFKC", name or "").casefold()
+    latin, cjk = set(), set()
+
+    for part in re.split(r"[;,、]", name):
+        if _CJK_RE.search(part):
+            words = [w for w in part.replace(".", " ").split() if w not in _AUTHOR_STOPWORDS]
+            compact = "".join(words)
+            for suffix in _CJK_AUTHOR_SUFFIXES:
+                if compact.endswith(suffix) and len(compact) > len(suffix) + 1:
+                    compact = compact[:-len(suffix)]
+                    break
+            if compact:
+                cjk.add(compact)
+            # 原文带空格时 ("山田 太郎")，姓与名也可以单独匹配，与拉丁名按 token 匹配一致
+            if len(words) > 1:
+                cjk.update(w for w in words if _CJK_RE.search(w))
+        else:
+            latin.update(_strip_accents(part).replace(",", "").replace(".", "").split())
+
+    latin -= _AUTHOR_STOPWORDS
+    return frozenset(latin), frozenset(cjk)
+
+
+def _cjk_names_match(query_names: frozenset, db_names: frozenset) -> bool:
+    for q in query_names:
+        for d in db_names:
+            # 完全一致，或一方是另一方的前缀 (只写了姓 + 名的一部分)，至少两个字
+            if q == d or (min(len(q), len(d)) >= 2 and (q.startswith(d) or d.startswith(q))):
+                return True
+    return False
+
+
+class MatchQuery:
+    """
+    对一次检索只做一次归一化，然后批量为所有候选论文打分。
+    OpenAlex 与 Semantic Scholar 共用同一套规则。
+    """
+
+    def __init__(self, title: Optional[str], author: Optional[str] = None):
+        self.title = normalize_title(title)
+        self.author = author
+        self.latin_authors, self.cjk_authors = author_tokens(author)
+
+    def title_similarity(self, candidate_title: Optional[str]) -> float:
+        return self.title_similarities([candidate_title])[0]
+
+    def title_similarities(self, candidate_titles: Sequence[Optional[str]]) -> List[float]:
+        """0.0 - 1.0 的标题相似度，一次处理全部候选"""
+        normalized = [normalize_title(t) for t in candidate_titles]
+        if RAPIDFUZZ_AVAILABLE:
+            return [fuzz.ratio(self.title, candidate) / 100 for candidate in normalized]
+
+        # difflib 会缓存 seq2 的索引，因此把查询标题固定为 seq2，只切换候选
+        matcher = difflib.SequenceMatcher(None)
+        matcher.set_seq2(self.title)
+        results = []
+        for candidate in normalized:
+            matcher.set_seq1(candidate)
+            results.append(matcher.ratio())
+        return results
+
+    def author_match(self, candidate_authors: Sequence[str]) -> bool:
+        # 没提供作者就当匹配
+        if not self.author:
+            return True
+
+        for db_author in candidate_authors:
+            db_latin, db_cjk = author_tokens(db_author)
+            if self.latin_authors & db_latin:
+                return True
+            if self.cjk_authors and db_cjk and _cjk_names_match(self.cjk_authors, db_cjk):
+                return True
+        return False
+
+    def score_candidates(self, candidates: Sequence[Tuple[Optional[str], Sequence[str]]]) -> List[Tuple[float, bool]]:
+        """candidates: [(title, [author names])] → [(title_sim, author_match)]"""
+        sims = self.title_similarities([title for title, _ in candidates])
+        return [(sim, self.author_match(authors)) for sim, (_, authors) in zip(sims, candidates)]
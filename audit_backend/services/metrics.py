@@ -0,0 +1,189 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 轻量 Prometheus 指标 (文本格式 0.0.4)，不依赖 prometheus_client
+# - Counter / Histogram 按标签组合分别计数
+# - span() 记录各阶段耗时：写入全局直方图，同时累加到当前请求的耗时汇总
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key → [各桶计数..., +Inf 计数, sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[bisect.bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), entry[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {entry[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+def register_collector(fn: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]):
+    """注册瞬时值 (gauge) 采集函数，产出 (指标名, 说明, 标签, 数值)；每次抓取 /metrics 时调用"""
+    _collectors.append(fn)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+
+    gauges: Dict[str, Tuple[str, List[str]]] = {}
+    for collect in _collectors:
+        for name, help_text, labels, value in collect():
+            gauges.setdefault(name, (help_text, []))[1].append(f"{name}{_format_labels(labels)} {float(value)}")
+    for name, (help_text, samples) in gauges.items():
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", *samples])
+    return "\n".join(lines) + "\n"
+
+
+# ---------- 全局指标 ----------
+
+STAGE_SECONDS = Histogram("veru_stage_seconds", "Latency of each pipeline stage", ["stage"])
+UPSTREAM_REQUESTS = Counter("veru_upstream_requests_total", "Upstream calls by final outcome", ["upstream", "status"])
+UPSTREAM_SECONDS = Histogram("veru_upstream_seconds", "Upstream call latency including retries", ["upstream"])
+UPSTREAM_QUEUE_SECONDS = Histogram("veru_upstream_queue_seconds", "Time spent waiting in the upstream scheduler",
+                                   ["upstream"])
+CACHE_LOOKUPS = Counter("veru_cache_lookups_total", "Cache lookups by tier", ["cache", "result"])
+CITATIONS = Counter("veru_citations_total", "Audited citations by resolving source and status", ["source", "status"])
+REQUESTS = Histogram("veru_request_seconds", "End-to-end audit request latency", ["endpoint"])
+CLIENT_DISCONNECTS = Counter("veru_client_disconnects_total",
+                             "Streaming clients that went away before the audit finished", ["endpoint"])
+
+
+# ---------- 请求级耗时汇总 ----------
+
+_request_timing: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_timing", default=None)
+
+
+def start_request_timing() -> dict:
+    """在请求开始时调用；之后派生的任务共享同一份汇总 (context 复制的是同一个 dict)"""
+    timing = {"started": time.perf_counter(), "stages": {}}
+    _request_timing.set(timing)
+    return timing
+
+
+def record_stage(stage: str, seconds: float):
+    """直接记录一段已测得的耗时 (无法用 with 包裹的场景，例如首条结果延迟)"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timing = _request_timing.get()
+    if timing is not None:
+        entry = timing["stages"].setdefault(stage, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """记录一个阶段的耗时 (同步 / 异步代码均可用 with)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def get_request_timing() -> Optional[dict]:
+    """当前请求的耗时汇总"""
+    timing = _request_timing.get()
+    return summarize_timing(timing) if timing is not None else None
+
+
+def summarize_timing(timing: dict, finished_at: Optional[float] = None) -> dict:
+    """
+    各阶段并发执行，total_ms 之和可能超过 elapsed_ms。
+    被 singleflight 合并的工作只计入最先发起它的请求。
+    """
+    return {
+        "elapsed_ms": round(((finished_at or time.perf_counter()) - timing["started"]) * 1000, 1),
+        "stages": {
+            stage: {"count": count, "total_ms": round(total * 1000, 1), "max_ms": round(peak * 1000, 1)}
+            for stage, (count, total, peak) in sorted(timing["stages"].items())
+        },
+    }
+
+
+def format_server_timing(timing: dict) -> str:
+    """转换为 Server-Timing 头：stage;dur=毫秒"""
+    parts = [f"{stage.replace('.', '_')};dur={s['total_ms']}" for stage, s in timing["stages"].items()]
+    parts.append(f"total;dur={timing['elapsed_ms']}")
+    return ", ".join(parts)
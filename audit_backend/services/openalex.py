@@ -1,62 +1,137 @@
 import httpx
-import difflib
-import re
-from typing import Optional, Dict, Any
+import os
+from typing import Optional, Dict, Any, List
+
+from services.http_client import get_http_client
+from services.cache import paper_cache, paper_cache_key, is_cacheable_result, normalize_doi, doi_miss_key
+from services.batching import MicroBatcher, chunked
+from services.matching import MatchQuery
+from services import local_index
+from services.resilience import call_upstream
+from services.metrics import span
+
+# 标题检索只取打分需要的字段，不下载体积很大的 abstract_inverted_index；
+# 摘要只为最终选中的论文单独获取
+OPENALEX_SEARCH_FIELDS = "id,doi,title,publication_year,authorships,cited_by_count,open_access"
+# DOI 查询结果直接就是最终论文，连同摘要一起取回
+OPENALEX_DETAIL_FIELDS = OPENALEX_SEARCH_FIELDS + ",abstract_inverted_index"
+
+# DOI 合批：OpenAlex 的 OR-filter (doi:a|b|c) 单次最多 50 个
+OPENALEX_DOI_BATCH_SIZE = 50
+OPENALEX_BATCH_WINDOW_MS = float(os.getenv("OPENALEX_BATCH_WINDOW_MS", "25"))
 
 
 def reconstruct_abstract(inverted_index: Dict[str, list]) -> str:
+    """倒排索引 → 正文：按位置直接放入预分配的列表，无需排序"""
     if not inverted_index:
         return ""
-    word_list = []
+    size = 1 + max((max(positions) for positions in inverted_index.values() if positions), default=-1)
+    words = [None] * size
     for word, positions in inverted_index.items():
         for pos in positions:
-            word_list.append((pos, word))
-    word_list.sort(key=lambda x: x[0])
-    return " ".join([w[1] for w in word_list])
+            words[pos] = word
+    return " ".join([w for w in words if w is not None])
 
 
 def check_author_match(query_author: str, paper_authors: list) -> bool:
-    if not query_author:
-        return True
+    return MatchQuery(None, query_author).author_match(paper_authors)
 
-    q_parts = set(query_author.lower().replace(",", "").replace(".", "").split())
-    q_parts.discard("et")
-    q_parts.discard("al")
 
-    for db_author in paper_authors:
-        db_parts = set(db_author.lower().replace(",", "").replace(".", "").split())
-        if q_parts.intersection(db_parts):
-            return True
-    return False
+def get_similarity_score(str1: str, str2: str) -> float:
+    return MatchQuery(str1).title_similarity(str2)
 
 
-def get_similarity_score(str1: str, str2: str) -> float:
-    s1 = re.sub(r'[^\w\s]', '', str1.lower())
-    s2 = re.sub(r'[^\w\s]', '', str2.lower())
-    return difflib.SequenceMatcher(None, s1, s2).ratio()
+async def fetch_from_openalex(params: dict, client: Optional[httpx.AsyncClient] = None) -> Optional[list]:
+    """返回结果列表；上游出错时返回 None (与 "查无结果" 的空列表区分，避免被写入负缓存)"""
+    client = client or get_http_client("openalex")
+    try:
+        # 复用共享连接池 (keep-alive)，不再每次握手
+        # 统一弹性层：熔断检查 → 调度器排队 (令牌桶 + AIMD) → 失败时指数退避重试
+        response = await call_upstream("openalex", lambda: client.get("/works", params=params))
+        if response.status_code == 200:
+            return response.json().get("results", [])
+        print(f"[OpenAlex Error] Status: {response.status_code}")
+    except Exception as e:
+        print(f"[OpenAlex Error] {e}")
+    return None
 
 
-async def fetch_from_openalex(params: dict) -> list:
+async def fetch_works_by_dois(dois: List[str], client: Optional[httpx.AsyncClient] = None) -> Dict[str, dict]:
+    """用 OR-filter 一次查询多个 DOI，返回 {normalized_doi: work}"""
+    found = {}
+    for group in chunked(dois, OPENALEX_DOI_BATCH_SIZE):
+        results = await fetch_from_openalex({
+            "filter": "doi:" + "|".join(f"https://doi.org/{d}" for d in group),
+            "select": OPENALEX_DETAIL_FIELDS,
+            "per_page": len(group),
+            "mailto": "audit_test@realibuddy.com"
+        }, client=client)
+        if results is None:
+            raise RuntimeError(f"OpenAlex batch DOI lookup failed ({len(group)} DOIs)")
+        for paper in results:
+            found[normalize_doi(paper.get("doi"))] = paper
+    print(f"[OpenAlex] Batch DOI lookup: {len(found)}/{len(dois)} found")
+    return found
+
+
+openalex_doi_batcher = MicroBatcher("openalex_doi", fetch_works_by_dois,
+                                    max_batch=OPENALEX_DOI_BATCH_SIZE, window_ms=OPENALEX_BATCH_WINDOW_MS)
+
+
+async def lookup_work_by_doi(doi: str, client: Optional[httpx.AsyncClient] = None) -> Optional[list]:
+    """单个 DOI 查询：同一时间窗口内的 DOI 会被合并到一次 OR-filter 请求"""
+    clean_doi = normalize_doi(doi)
+    # 文档级批量解析已确认 OpenAlex 未收录
+    if await paper_cache.get(doi_miss_key("openalex", clean_doi)) is not None:
+        return []
+    # 含 "|" 或 "," 的 DOI 无法放进 OR-filter，单独查询
+    if client is not None or "|" in clean_doi or "," in clean_doi:
+        return await fetch_from_openalex({
+            "filter": f"doi:https://doi.org/{clean_doi}",
+            "select": OPENALEX_DETAIL_FIELDS
+        }, client=client)
     try:
-        # 使用异步上下文管理器
-        async with httpx.AsyncClient(timeout=20) as client:
-            response = await client.get("https://api.openalex.org/works", params=params)
-            if response.status_code == 200:
-                return response.json().get("results", [])
+        paper = await openalex_doi_batcher.submit(clean_doi)
     except Exception as e:
         print(f"[OpenAlex Error] {e}")
-        pass
-    return []
+        return None
+    return [paper] if paper else []
 
 
 async def search_paper_on_openalex(title: Optional[str], author: Optional[str] = None, year: Optional[str] = None,
-                                   doi: Optional[str] = None) -> Dict[str, Any]:
+                                   doi: Optional[str] = None,
+                                   client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    # 先查缓存 (内存 LRU → SQLite)，命中则完全不占用上游配额
+    cache_key = "openalex:" + paper_cache_key(title, author, year, doi)
+    cached = await paper_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
+    result = await _search_paper_on_openalex(title, author, year, doi, client)
+    if is_cacheable_result(result):
+        await paper_cache.set(cache_key, result, negative=not result["found"])
+    return result
+
+
+async def _search_paper_on_openalex(title: Optional[str], author: Optional[str], year: Optional[str],
+                                    doi: Optional[str], client: Optional[httpx.AsyncClient]) -> Dict[str, Any]:
+    upstream_error = False
+
+    # --- 第 0 层: 本地离线索引 (OpenAlex 快照)，命中则完全不走网络 ---
+    if local_index.is_available():
+        with span("openalex.local_index"):
+            local_result = await _search_local_index(title, author, year, doi)
+        if local_result is not None:
+            return local_result
+
     # --- 策略 0: DOI 精确查找 (最高优先级) ---
     if doi:
         # 清洗 DOI (去掉 https://doi.org/ 前缀)
         clean_doi = doi.replace("https://doi.org/", "").replace("doi:", "").strip()
         print(f"[OpenAlex] Searching by DOI: {clean_doi}")
-        results = await fetch_from_openalex({"filter": f"doi:https://doi.org/{clean_doi}"})
+        with span("openalex.doi"):
+            results = await lookup_work_by_doi(clean_doi, client=client)
+        upstream_error = results is None
         if results:
             best_paper = results[0]
             # 直接返回，无需评分
@@ -64,44 +139,102 @@ async def search_paper_on_openalex(title: Optional[str], author: Optional[str] =
 
     # --- 常规标题搜索 ---
     if not title:
-        return {"found": False, "reason": "No title extracted"}
+        return {"found": False, "reason": "No title extracted", "upstream_error": upstream_error}
 
     clean_title = title.replace('"', '').replace("'", "").replace("“", "").replace("”", "").strip()
     if len(clean_title) < 3:
-        return {"found": False, "reason": "Title is too short"}
+        return {"found": False, "reason": "Title is too short", "upstream_error": upstream_error}
 
     # 策略 1: 宽泛搜索
-    results = await fetch_from_openalex({
-        "search": clean_title,
-        "per_page": 20,
-        "mailto": "audit_test@realibuddy.com"
-    })
-
-    # 策略 2: 精准过滤 (如果宽泛搜索没结果)
-    if not results and len(clean_title.split()) > 2:
+    with span("openalex.strategy1"):
         results = await fetch_from_openalex({
-            "filter": f"title.search:{clean_title}",
+            "search": clean_title,
+            "select": OPENALEX_SEARCH_FIELDS,
             "per_page": 20,
             "mailto": "audit_test@realibuddy.com"
-        })
+        }, client=client)
+    upstream_error = upstream_error or results is None
+
+    # 策略 2: 精准过滤 (如果宽泛搜索没结果)
+    if not results and len(clean_title.split()) > 2:
+        with span("openalex.strategy2"):
+            results = await fetch_from_openalex({
+                "filter": f"title.search:{clean_title}",
+                "select": OPENALEX_SEARCH_FIELDS,
+                "per_page": 20,
+                "mailto": "audit_test@realibuddy.com"
+            }, client=client)
+        upstream_error = upstream_error or results is None
 
     if not results:
-        return {"found": False, "reason": "No matches found in OpenAlex"}
+        return {"found": False, "reason": "No matches found in OpenAlex", "upstream_error": upstream_error}
+
+    result = _pick_best_candidate(results, clean_title, author, year)
+
+    # 延迟获取摘要：只为选中的论文请求 abstract_inverted_index
+    if result["found"] and not result["abstract"]:
+        with span("openalex.abstract"):
+            abstract = await fetch_abstract(result["id"], client=client)
+        # 取摘要失败与 "论文没有摘要" 不同：不能缓存，否则该论文在 TTL 内都会被判为缺少摘要
+        result["abstract"] = abstract or ""
+        if abstract is None:
+            result["upstream_error"] = True
+    return result
 
+
+async def fetch_abstract(work_id: Optional[str], client: Optional[httpx.AsyncClient] = None) -> Optional[str]:
+    """按 OpenAlex ID 只取摘要字段并还原为正文；论文没有摘要时返回空字符串，请求失败时返回 None"""
+    if not work_id:
+        return ""
+    client = client or get_http_client("openalex")
+    short_id = work_id.rsplit("/", 1)[-1]
+    try:
+        response = await call_upstream("openalex", lambda: client.get(f"/works/{short_id}", params={
+            "select": "abstract_inverted_index",
+            "mailto": "audit_test@realibuddy.com"
+        }))
+        if response.status_code == 200:
+            return reconstruct_abstract(response.json().get("abstract_inverted_index"))
+        print(f"[OpenAlex Error] Abstract fetch status: {response.status_code}")
+    except Exception as e:
+        print(f"[OpenAlex Error] {e}")
+    return None
+
+
+async def _search_local_index(title: Optional[str], author: Optional[str], year: Optional[str],
+                              doi: Optional[str]) -> Optional[Dict[str, Any]]:
+    """本地索引命中时返回结果；未命中返回 None，继续走网络 (快照可能只包含部分数据)"""
+    if doi:
+        paper = await local_index.lookup_doi(doi)
+        if paper:
+            return _format_result(paper, found=True)
+
+    if title:
+        clean_title = title.replace('"', '').replace("'", "").replace("“", "").replace("”", "").strip()
+        if len(clean_title) >= 3:
+            results = await local_index.search_title(clean_title, limit=20)
+            if results:
+                result = _pick_best_candidate(results, clean_title, author, year)
+                if result["found"]:
+                    return result
+    return None
+
+
+def _pick_best_candidate(results: list, clean_title: str, author: Optional[str], year: Optional[str]) -> Dict[str, Any]:
+    """对候选论文综合打分并做阈值判断 (网络结果与本地索引结果共用)"""
     # --- 智能评分逻辑 ---
     candidates = []
     target_year = int(year) if (year and year.isdigit()) else None
 
-    for paper in results:
-        paper_authors = [a["author"]["display_name"] for a in paper.get("authorships", [])]
-        paper_title = paper.get("title", "") or ""
-        paper_year = paper.get("publication_year")
-
-        # 1. 基础分：标题相似度 (0.0 - 1.0)
-        title_sim = get_similarity_score(clean_title, paper_title)
+    # 查询只归一化一次，所有候选批量打分
+    query = MatchQuery(clean_title, author)
+    scores = query.score_candidates([
+        (paper.get("title", "") or "", [a["author"]["display_name"] for a in paper.get("authorships", [])])
+        for paper in results
+    ])
 
-        # 2. 作者验证 (权重调整)
-        is_auth_match = check_author_match(author, paper_authors)
+    for paper, (title_sim, is_auth_match) in zip(results, scores):
+        paper_year = paper.get("publication_year")
 
         # 3. 年份验证 (允许 ±1 年误差)
         is_year_match = False
@@ -110,9 +243,10 @@ async def search_paper_on_openalex(title: Optional[str], author: Optional[str] =
                 is_year_match = True
 
         # --- 综合打分 ---
+        # 1. 基础分：标题相似度 (0.0 - 1.0)
         final_score = title_sim
 
-        # 惩罚：作者不对，分数打 6 折
+        # 2. 惩罚：作者不对，分数打 6 折
         if author and not is_auth_match:
             final_score *= 0.6
 
@@ -128,7 +262,8 @@ async def search_paper_on_openalex(title: Optional[str], author: Optional[str] =
         candidates.append({
             "paper": paper,
             "score": final_score,
-            "raw_sim": title_sim
+            "raw_sim": title_sim,
+            "author_match": is_auth_match
         })
 
     # 按分数降序排序
@@ -140,9 +275,8 @@ async def search_paper_on_openalex(title: Optional[str], author: Optional[str] =
     threshold = 0.6
 
     # 宽松特例：如果作者对且年份对，标题相似度只要 > 0.4 即可（应对标题简写）
-    if author and year and check_author_match(author, [a["author"]["display_name"] for a in
-                                                       best_candidate['paper'].get("authorships", [])]):
-        if abs(int(year) - (best_candidate['paper'].get("publication_year") or 0)) <= 1:
+    if author and target_year and best_candidate['author_match']:
+        if abs(target_year - (best_candidate['paper'].get("publication_year") or 0)) <= 1:
             threshold = 0.4
 
     if best_candidate['score'] < threshold:
@@ -153,9 +287,10 @@ async def search_paper_on_openalex(title: Optional[str], author: Optional[str] =
 
 def _format_result(paper: dict, found: bool) -> dict:
     """辅助函数：格式化 OpenAlex 返回的数据"""
-    abstract_text = ""
+    # 本地索引里的记录已预先还原好摘要
+    abstract_text = paper.get("abstract") or ""
     inverted_idx = paper.get("abstract_inverted_index")
-    if inverted_idx:
+    if inverted_idx and not abstract_text:
         abstract_text = reconstruct_abstract(inverted_idx)
 
     return {
@@ -0,0 +1,139 @@
+import os
+import re
+import unicodedata
+from typing import Optional, List, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 本地规则预筛：明确的情况直接给出判定，只有模糊的情况才交给 Gemini (设为 0 关闭)
+PRESCREEN_ENABLED = os.getenv("PRESCREEN", "1") == "1"
+
+MIN_ABSTRACT_WORDS = 12
+MIN_CLAIM_TOKENS = 4
+REAL_COVERAGE = 0.8
+MISMATCH_COVERAGE = 0.05
+
+prescreen_stats = {"checked": 0, "short_circuited": 0, "polarity_deferred": 0, "number_deferred": 0,
+                   "REAL": 0, "SUSPICIOUS": 0, "MISMATCH": 0, "UNVERIFIED": 0}
+
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_WORD_RE = re.compile(r"[a-z][a-z\-]+")
+
+# 审计 Prompt 关心的三类指标：百分比、p 值、样本量
+_PERCENT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:%|percent\b)")
+_P_VALUE_RE = re.compile(r"\bp\s*(?:<|>|=|≤|≥)\s*(0?\.\d+)")
+_SAMPLE_RE = re.compile(
+    r"\b[nN]\s*=\s*(\d[\d,]*)"
+    r"|(\d[\d,]*)\s+(?:participants|subjects|patients|respondents|students|children|adults|samples|individuals|volunteers)\b"
+    r"|(\d[\d,]*)\s*(?:名|位|个)?(?:被试|受试者|参与者|患者|样本)"
+)
+
+# 否定 / 方向词：词汇重合无法区分 "X improves Y" 与 "X does not improve Y"，任一方出现就交给 LLM
+_POLARITY_RE = re.compile(
+    r"\b(?:not|no|never|none|nor|neither|cannot|without|fail(?:s|ed|ing|ure)?|lack(?:s|ed|ing)?"
+    r"|decreas(?:e|es|ed|ing)|increas(?:e|es|ed|ing))\b|n't\b"
+    r"|没有|并非|并未|未能|不能|无法|减少|增加"
+)
+
+_STOPWORDS = {
+    "the", "and", "for", "that", "this", "with", "from", "are", "was", "were", "been", "has", "have", "had",
+    "its", "their", "they", "them", "which", "who", "what", "when", "where", "how", "than", "then", "there",
+    "these", "those", "such", "into", "onto", "over", "under", "about", "between", "through", "also", "can",
+    "could", "would", "should", "may", "might", "will", "but", "all", "any", "each", "more", "most",
+    "other", "some", "only", "very", "our", "we", "you", "his", "her", "she", "him", "paper", "study",
+    "studies", "author", "authors", "research", "article", "work", "show", "shows", "showed", "shown",
+    "find", "finds", "found", "propose", "proposes", "proposed", "present", "presents", "discuss",
+    "discusses", "argue", "argues", "claim", "claims", "based", "using", "use", "used", "new", "approach",
+}
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ations", "ation", "ings", "ing", "ies", "es", "ed", "ly", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def content_tokens(text: str) -> Set[str]:
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return {_stem(w) for w in _WORD_RE.findall(text) if len(w) > 2 and w not in _STOPWORDS}
+
+
+def _numbers(text: str) -> Set[str]:
+    return {n.replace(",", "").lstrip("0") or "0" for n in re.findall(r"\d[\d,]*(?:\.\d+)?", text)}
+
+
+def has_polarity(text: str) -> bool:
+    return bool(_POLARITY_RE.search(unicodedata.normalize("NFKC", text or "").casefold()))
+
+
+def extract_metrics(text: str) -> List[str]:
+    """从 claim 中提取具体指标的数值 (百分比 / p 值 / 样本量)"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    values = []
+    for pattern in (_PERCENT_RE, _P_VALUE_RE, _SAMPLE_RE):
+        for match in pattern.finditer(text):
+            value = next(g for g in match.groups() if g)
+            values.append(value.replace(",", "").lstrip("0") or "0")
+    return values
+
+
+def _verdict(status: str, confidence: float, reason: str) -> dict:
+    prescreen_stats["short_circuited"] += 1
+    prescreen_stats[status] += 1
+    return {"status": status, "confidence": confidence, "reason": f"(Pre-screen) {reason}"}
+
+
+def prescreen_consistency(user_claim: str, real_abstract: str) -> Optional[dict]:
+    """
+    确定性预筛。能确定时返回与 LLM 相同结构的判定，否则返回 None。
+    - 摘要过短 → UNVERIFIED
+    - claim 中的具体指标在摘要里找不到，且主题明显相关 → SUSPICIOUS
+    - 与摘要几乎完全重合且 claim 中的数字都能在摘要里找到 → REAL；完全没有重合 → MISMATCH
+    - claim 含摘要里没有的其他数字 (BLEU、F1、年份等无法归类的数值) 时绝不判 REAL，交给 LLM
+    - 中英混合等跨语言情况一律交给 LLM；任一方含否定 / 增减等方向词时交给 LLM
+    """
+    if not PRESCREEN_ENABLED:
+        return None
+    prescreen_stats["checked"] += 1
+
+    if len((real_abstract or "").split()) < MIN_ABSTRACT_WORDS and not _CJK_RE.search(real_abstract or ""):
+        return _verdict("UNVERIFIED", 0.5, "Abstract is too short to judge the claim.")
+
+    # 跨语言 (例如中文 claim 对英文摘要) 无法做词汇比对
+    if bool(_CJK_RE.search(user_claim or "")) != bool(_CJK_RE.search(real_abstract or "")):
+        return None
+
+    # 词汇覆盖率看不出方向是否相反 ("does not improve" 与 "improves" 重合度相同)
+    if has_polarity(user_claim) or has_polarity(real_abstract):
+        prescreen_stats["polarity_deferred"] += 1
+        return None
+
+    claim_tokens = content_tokens(user_claim)
+    if len(claim_tokens) < MIN_CLAIM_TOKENS:
+        return None
+
+    abstract_tokens = content_tokens(real_abstract)
+    coverage = len(claim_tokens & abstract_tokens) / len(claim_tokens)
+
+    abstract_numbers = _numbers(unicodedata.normalize("NFKC", real_abstract))
+    missing_metrics = [m for m in extract_metrics(user_claim) if m not in abstract_numbers]
+    unmatched_numbers = _numbers(unicodedata.normalize("NFKC", user_claim)) - abstract_numbers
+
+    if missing_metrics and coverage >= 0.5:
+        return _verdict("SUSPICIOUS", 0.8,
+                        f"Specific figures in the claim ({', '.join(missing_metrics[:3])}) do not appear in the abstract.")
+
+    # 只认得三类指标，其余数字 (如 "41.8 BLEU") 是否属于编造无法本地判断：不能因为词汇重合就放行
+    if unmatched_numbers and coverage > MISMATCH_COVERAGE:
+        prescreen_stats["number_deferred"] += 1
+        return None
+
+    if not missing_metrics and coverage >= REAL_COVERAGE:
+        return _verdict("REAL", 0.8, f"Claim terms are fully covered by the abstract ({coverage:.0%} overlap).")
+
+    if coverage <= MISMATCH_COVERAGE and len(claim_tokens) >= 6:
+        return _verdict("MISMATCH", 0.75, "The claim shares no key terms with the abstract.")
+
+    return None
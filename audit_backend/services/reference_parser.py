@@ -0,0 +1,322 @@
+import os
+import re
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from services.matching import MatchQuery, author_tokens
+
+load_dotenv()
+
+# 本地结构化解析：纯参考文献列表 / BibTeX / RIS / CSL-JSON / 纯 DOI 行直接生成 CitationData，不调用 Gemini；
+# 正文 + 参考文献的混合文档仍整篇交给 Gemini，本地解析的条目只用于补全正文引用缺失的标题 / DOI / 年份
+# 设为 0 则所有输入都交给 LLM 提取
+LOCAL_PARSER_ENABLED = os.getenv("LOCAL_PARSER", "1") == "1"
+
+# 超过该长度的行视为正文段落，不尝试按参考文献条目解析
+MAX_REFERENCE_LINE = 600
+
+# 正文引用与参考文献条目的标题相似度达到该值视为同一论文
+REFERENCE_TITLE_SIMILARITY = 0.85
+
+parser_stats = {"documents": 0, "fully_local": 0, "mixed": 0, "local_citations": 0, "reference_hints": 0,
+                "llm_lines": 0}
+
+DOI_RE = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>]+)", re.IGNORECASE)
+_YEAR_RE = re.compile(r"\b(1[5-9]\d{2}|20\d{2})\b")
+# 条目编号 "[1]" "(1)" "1." —— 数字编号后必须有空白，避免吃掉裸 DOI 开头的 "10."
+_NUMBERING_RE = re.compile(r"^\s*(?:\[\d+\]\s*|\(\d+\)\s*|\d+[.)]\s+)")
+_HEADING_RE = re.compile(
+    r"^\s*(references?|bibliography|works cited|literature cited|sources|参考文献|引用文献|参考资料)\s*[:：]?\s*$",
+    re.IGNORECASE
+)
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+# APA: Author, A. A., & Author, B. (2020). Title of work. Source...
+_APA_RE = re.compile(r"^(?P<authors>.+?)\s*\((?P<year>\d{4})[a-z]?(?:,[^)]*)?\)\.\s*(?P<title>.+?[^A-Z.])[.?!]\s+(?P<rest>.+)$")
+# MLA / Chicago / IEEE: Author. "Title." Source, 2019.   /   A. Author, "Title," Source, 2019.
+_QUOTED_RE = re.compile(r"^(?P<authors>[^\"“”]{2,200}?)[.,]\s*[\"“](?P<title>[^\"“”]{5,}?)[.,]?[\"”]\s*(?P<rest>.*)$")
+# GB/T 7714: 作者. 题名[J]. 刊名, 2020, 12(3): 1-10.
+_GBT_RE = re.compile(r"^(?P<authors>[^.．]{1,200})[.．]\s*(?P<title>[^\[\]]{2,}?)\s*\[(?P<type>[A-Z]{1,2})(?:/OL)?\][.．]?\s*(?P<rest>.*)$")
+
+# 条目尾部 (来源 / 卷期 / 页码) 不应出现的叙述性词语：出现即视为带注释 / 评述的正文句子，交给 LLM 提取 claim
+# (区分大小写：期刊名中的 "IT" 等缩写不算)
+_PROSE_RE = re.compile(
+    r"%|\b(?:[Tt]hat|[Tt]hey|[Ww]e|[Ii]t|[Tt]his|[Tt]hese|[Tt]hose|is|are|was|were|has|have|had|can|could|does|did|not"
+    r"|claims|claimed|reports|reported|shows|showed|shown|finds|found|suggests|suggested|argues|argued"
+    r"|demonstrates?|demonstrated|proves?|proved|reach(?:es|ed)?|achieves?|achieved|outperforms?|improves?|reduces?)\b"
+    r"|指出|认为|表明|发现|证明|显示|提出|说明|。"
+)
+
+# 作者名中允许出现的小写词
+_NAME_PARTICLES = {"and", "et", "al", "al.", "&", "van", "von", "der", "den", "de", "da", "di", "du", "del", "la", "le", "y"}
+
+
+def normalize_doi_match(doi: str) -> str:
+    # 句末标点不属于 DOI
+    return doi.rstrip(".,;:)]}")
+
+
+def _looks_like_authors(text: str) -> bool:
+    text = text.strip()
+    if not text or len(text) > 300:
+        return False
+    if _CJK_RE.search(text):
+        return True
+    words = re.findall(r"[^\s,;]+", text)
+    if not words or not text[0].isupper():
+        return False
+    return all(w[0].isupper() or not w[0].isalpha() or w.lower() in _NAME_PARTICLES for w in words)
+
+
+def _clean_title(title: str) -> str:
+    title = re.sub(r"\s*\[[^\]]*\]\s*$", "", title.strip())
+    return title.strip(" .,;:*_\"“”'")
+
+
+def _looks_like_source(rest: str) -> bool:
+    """条目标题之后的部分只能是来源 / 卷期 / 页码 / 链接，不能夹带叙述性文字"""
+    rest = re.sub(r"https?://\S+", "", DOI_RE.sub("", rest or ""))
+    return not _PROSE_RE.search(rest)
+
+
+def _citation(raw_text: str, title: Optional[str], author: Optional[str], year: Optional[str],
+              doi: Optional[str]) -> dict:
+    # 参考文献条目本身不包含对论文内容的陈述，只核实存在性
+    return {
+        "raw_text": raw_text, "title": title or None, "author": (author or "").strip(" .,") or None,
+        "year": year, "doi": doi, "summary_intent": "", "specific_claims": [],
+    }
+
+
+def parse_reference_line(line: str) -> Optional[dict]:
+    """解析一条格式化的参考文献 (APA / MLA / Chicago / IEEE / GB/T 7714) 或纯 DOI 行"""
+    raw = line.strip()
+    if not raw or len(raw) > MAX_REFERENCE_LINE:
+        return None
+    body = _NUMBERING_RE.sub("", raw)
+    doi_match = DOI_RE.search(body)
+    doi = normalize_doi_match(doi_match.group(1)) if doi_match else None
+
+    # 只有一个 DOI (或 doi.org 链接)
+    if doi and len(DOI_RE.sub("", body).replace("https://doi.org/", "").replace("doi:", "").strip(" .,:")) <= 4:
+        return _citation(raw, None, None, None, doi)
+
+    match = _APA_RE.match(body)
+    if match and _looks_like_authors(match["authors"]) and _looks_like_source(match["rest"]):
+        return _citation(raw, _clean_title(match["title"]), match["authors"], match["year"], doi)
+
+    match = _GBT_RE.match(body)
+    if match and _CJK_RE.search(body) and _looks_like_source(match["rest"]):
+        year = _YEAR_RE.search(match["rest"])
+        return _citation(raw, _clean_title(match["title"]), match["authors"], year and year.group(1), doi)
+
+    match = _QUOTED_RE.match(body)
+    if match and _looks_like_authors(match["authors"]) and _looks_like_source(match["rest"]):
+        year = _YEAR_RE.search(match["rest"])
+        if year or doi:
+            return _citation(raw, _clean_title(match["title"]), match["authors"], year and year.group(1), doi)
+
+    return None
+
+
+# ---------- 整篇结构化格式 ----------
+
+def _read_braced(text: str, start: int) -> Tuple[str, int]:
+    """从 text[start] 处的 '{' 读到与之匹配的 '}'，返回 (内容, 结束位置)"""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:i], i + 1
+    return text[start + 1:], len(text)
+
+
+def _bibtex_fields(body: str) -> Dict[str, str]:
+    fields = {}
+    pos = 0
+    field_re = re.compile(r"\s*,?\s*(\w[\w-]*)\s*=\s*")
+    while True:
+        match = field_re.match(body, pos)
+        if not match:
+            break
+        name, pos = match.group(1).lower(), match.end()
+        if pos < len(body) and body[pos] == "{":
+            value, pos = _read_braced(body, pos)
+        elif pos < len(body) and body[pos] == '"':
+            end = body.find('"', pos + 1)
+            end = len(body) if end == -1 else end
+            value, pos = body[pos + 1:end], end + 1
+        else:
+            value_match = re.match(r"[^,}]*", body[pos:])
+            value, pos = value_match.group(0), pos + value_match.end()
+        fields[name] = " ".join(value.replace("{", "").replace("}", "").split())
+    return fields
+
+
+def parse_bibtex(text: str) -> List[dict]:
+    citations = []
+    for match in re.finditer(r"@(\w+)\s*\{", text):
+        if match.group(1).lower() in ("comment", "string", "preamble"):
+            continue
+        body, end = _read_braced(text, match.end() - 1)
+        fields = _bibtex_fields(body.split(",", 1)[1] if "," in body else "")
+        if not fields.get("title") and not fields.get("doi"):
+            continue
+        authors = fields.get("author", "").replace(" and ", "; ")
+        year = _YEAR_RE.search(fields.get("year", "") or fields.get("date", ""))
+        citations.append(_citation(
+            text[match.start():end].strip(), fields.get("title"), authors,
+            year and year.group(1), fields.get("doi")
+        ))
+    return citations
+
+
+def parse_ris(text: str) -> List[dict]:
+    citations, record, lines = [], {}, []
+    for line in text.splitlines():
+        match = re.match(r"^([A-Z][A-Z0-9])  -\s?(.*)$", line)
+        if not match:
+            continue
+        tag, value = match.group(1), match.group(2).strip()
+        lines.append(line)
+        if tag == "ER":
+            if record.get("title") or record.get("doi"):
+                year = _YEAR_RE.search(record.get("year", ""))
+                citations.append(_citation(
+                    "\n".join(lines), record.get("title"), "; ".join(record.get("authors", [])),
+                    year and year.group(1), record.get("doi")
+                ))
+            record, lines = {}, []
+        elif tag in ("TI", "T1") and "title" not in record:
+            record["title"] = value
+        elif tag in ("AU", "A1"):
+            record.setdefault("authors", []).append(value)
+        elif tag in ("PY", "Y1", "DA") and "year" not in record:
+            record["year"] = value
+        elif tag == "DO":
+            record["doi"] = value
+    return citations
+
+
+def parse_csl_json(text: str) -> List[dict]:
+    data = json.loads(text)
+    items = data if isinstance(data, list) else [data]
+    citations = []
+    for item in items:
+        if not isinstance(item, dict) or not (item.get("title") or item.get("DOI")):
+            continue
+        authors = "; ".join(
+            ", ".join(filter(None, [a.get("family"), a.get("given")])) or a.get("literal", "")
+            for a in item.get("author", []) if isinstance(a, dict)
+        )
+        date_parts = (item.get("issued") or {}).get("date-parts") or [[None]]
+        year = date_parts[0][0] if date_parts and date_parts[0] else None
+        citations.append(_citation(
+            json.dumps(item, ensure_ascii=False), item.get("title"), authors,
+            str(year) if year else None, item.get("DOI")
+        ))
+    return citations
+
+
+def _detect_format(text: str) -> Optional[Callable[[str], List[dict]]]:
+    stripped = text.lstrip()
+    if re.match(r"@\w+\s*\{", stripped):
+        return parse_bibtex
+    if re.match(r"TY  -", stripped):
+        return parse_ris
+    if stripped[:1] in "[{":
+        try:
+            json.loads(stripped)
+            return parse_csl_json
+        except ValueError:
+            return None
+    return None
+
+
+def parse_references(text: str) -> Tuple[List[dict], str]:
+    """
+    在 LLM 之前运行的本地解析。返回 (已解析的引用字段列表, 仍需交给 LLM 的文本)。
+    - BibTeX / RIS / CSL-JSON，或每一行都是参考文献条目 / 纯 DOI：整篇本地解析，返回的文本为空
+    - 混合文档 (正文 + 参考文献列表)：返回完整原文交给 LLM，正文中的 "Smith (2020) shows X"
+      需要结合上下文提取 claim；解析出的条目只作为补全字段的参考 (见 match_reference)，不单独审计
+    """
+    if not LOCAL_PARSER_ENABLED:
+        return [], text
+    parser_stats["documents"] += 1
+
+    parse_document = _detect_format(text)
+    if parse_document is not None:
+        try:
+            citations = parse_document(text)
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            print(f"[Reference Parser] 结构化解析失败，交给 LLM: {e}")
+            citations = []
+        if citations:
+            parser_stats["fully_local"] += 1
+            parser_stats["local_citations"] += len(citations)
+            return citations, ""
+
+    citations, remaining = [], []
+    for line in text.splitlines():
+        if not line.strip() or _HEADING_RE.match(line):
+            continue
+        parsed = parse_reference_line(line)
+        if parsed is not None:
+            citations.append(parsed)
+        else:
+            remaining.append(line)
+
+    if not remaining:
+        parser_stats["fully_local"] += 1
+        parser_stats["local_citations"] += len(citations)
+        return citations, ""
+
+    parser_stats["llm_lines"] += len(remaining)
+    if citations:
+        parser_stats["mixed"] += 1
+        parser_stats["reference_hints"] += len(citations)
+    return citations, text
+
+
+def match_reference(title: Optional[str], author: Optional[str], year: Optional[str], doi: Optional[str],
+                    references: List[dict]) -> Optional[dict]:
+    """
+    在本地解析的参考文献条目中找正文引用对应的一条：DOI 相同 > 标题相似 > 作者姓氏 + 年份唯一匹配。
+    有多个条目同样匹配时不猜测，返回 None
+    """
+    if not references:
+        return None
+
+    if doi:
+        clean_doi = normalize_doi_match(doi).lower()
+        for ref in references:
+            if ref["doi"] and ref["doi"].lower() == clean_doi:
+                return ref
+
+    if title:
+        query = MatchQuery(title)
+        titled = [ref for ref in references if ref["title"]]
+        sims = query.title_similarities([ref["title"] for ref in titled])
+        best = max(zip(sims, range(len(titled))), default=(0.0, -1))
+        if best[0] >= REFERENCE_TITLE_SIMILARITY:
+            return titled[best[1]]
+        return None
+
+    clean_year = "".join(filter(str.isdigit, str(year or "")))
+    # 单字母 token 多为名字缩写，只按姓氏匹配
+    latin, cjk = author_tokens(author)
+    surnames = {token for token in latin if len(token) > 1} | set(cjk)
+    if not clean_year or not surnames:
+        return None
+    candidates = []
+    for ref in references:
+        if ref["year"] != clean_year:
+            continue
+        ref_latin, ref_cjk = author_tokens(ref["author"])
+        if surnames & (ref_latin | ref_cjk):
+            candidates.append(ref)
+    return candidates[0] if len(candidates) == 1 else None
@@ -0,0 +1,280 @@
+import os
+import time
+import random
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from dotenv import load_dotenv
+import httpx
+import google.api_core.exceptions
+
+from services.scheduler import get_scheduler, is_throttled_response
+from services.metrics import UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# 单次上游调用最多尝试次数、指数退避参数
+MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+
+# 每个 /api/audit 请求可用的重试总数 (所有引用、所有上游共享)
+REQUEST_RETRY_BUDGET = int(os.getenv("REQUEST_RETRY_BUDGET", "20"))
+
+# 每个 /api/audit 请求的端到端截止时间 (秒)：提取、检索、一致性审计与兜底共用剩余时间，0 为不限
+AUDIT_DEADLINE = float(os.getenv("AUDIT_DEADLINE", "45"))
+
+# 熔断：连续失败 N 次后打开，冷却期内直接失败，之后放行一个探测请求
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# 可重试的异常：网络错误、超时、Gemini 的 5xx。
+# 限流 (429 / ResourceExhausted / Retry-After) 由调度器排队处理，这里不再重试，也不计入熔断
+RETRYABLE_EXCEPTIONS = (
+    httpx.TransportError,
+    google.api_core.exceptions.ServiceUnavailable,
+    google.api_core.exceptions.InternalServerError,
+    google.api_core.exceptions.DeadlineExceeded,
+)
+
+
+class CircuitOpenError(Exception):
+    """上游熔断中，调用被直接拒绝"""
+
+
+class DeadlineExceededError(Exception):
+    """请求的截止时间已到，不再等待或发起上游调用"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.probing):
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"{self.name} circuit open, failing fast")
+        if state == "half_open":
+            # 冷却结束，只放行一个探测请求
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.stats["opened"] += 1
+                print(f"[Resilience] {self.name} circuit OPEN after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release_probe(self):
+        # 探测请求既未成功也未失败 (例如被取消)，允许下一次探测
+        self.probing = False
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "state": self.state, "consecutive_failures": self.failures}
+
+
+breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+    for name in ("openalex", "semantic_scholar", "gemini")
+}
+
+retry_stats = {"retries": 0, "budget_exhausted": 0, "deadline_exceeded": 0}
+# 调用方被取消 (客户端断开、任务取消) 时放弃的上游调用，按上游计数
+cancelled_calls: Dict[str, int] = {}
+
+_retry_budget: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("retry_budget", default=None)
+
+
+def start_retry_budget(retries: int = REQUEST_RETRY_BUDGET):
+    """在每个请求开始时调用；同一请求派生的所有任务共享这份预算"""
+    _retry_budget.set({"remaining": retries})
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def start_deadline(seconds: Optional[float] = AUDIT_DEADLINE):
+    """在请求开始时调用；之后派生的任务共享同一个截止时间 (seconds 为空或 0 表示不限)"""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def current_deadline() -> Optional[float]:
+    """当前 context 的截止时间 (time.monotonic() 时刻)；没有截止时间时返回 None"""
+    return _deadline.get()
+
+
+def detached_context(deadline: Optional[float]) -> contextvars.Context:
+    """不属于任何请求的 context：没有重试预算和耗时汇总，只带给定的截止时间 (None 为不限)"""
+    context = contextvars.Context()
+    context.run(_deadline.set, deadline)
+    return context
+
+
+def remaining_budget() -> Optional[float]:
+    """距截止时间的剩余秒数 (可能为负)；没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_expired() -> bool:
+    remaining = remaining_budget()
+    return remaining is not None and remaining <= 0
+
+
+async def with_deadline(awaitable: Awaitable[T]) -> T:
+    """最多等待到请求的截止时间，超时取消并抛出 DeadlineExceededError"""
+    remaining = remaining_budget()
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceededError("request deadline reached")
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceededError("request deadline reached") from None
+
+
+def _take_retry() -> bool:
+    budget = _retry_budget.get()
+    if budget is None:
+        return True
+    if budget["remaining"] <= 0:
+        retry_stats["budget_exhausted"] += 1
+        return False
+    budget["remaining"] -= 1
+    return True
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _time_for_retry(delay: float) -> bool:
+    # 退避之后已经来不及再试一次 (截止时间内)，直接交还当前结果
+    remaining = remaining_budget()
+    return remaining is None or remaining > delay
+
+
+def _is_failure_status(status: int) -> bool:
+    return status >= 500
+
+
+async def call_upstream(name: str, call: Callable[[], Awaitable[T]], max_attempts: int = MAX_ATTEMPTS,
+                        hold_slot: bool = False) -> T:
+    """
+    所有上游调用的统一入口：熔断检查 → 调度器排队 (限速 / 并发窗口 / Retry-After) →
+    失败时指数退避 + 随机抖动重试，受请求级重试预算约束。
+    - 返回 HTTP 响应的调用：重试用尽后返回最后一次响应，由调用方按状态码处理
+    - 抛异常的调用：重试用尽后抛出最后一次异常
+    - 限流只在调度器内重新排队 (消耗同一份重试预算)，排队用尽后的限流结果原样交还，不重试、不计入熔断
+    - 熔断打开时抛出 CircuitOpenError
+    - 每次尝试 (含排队) 最多等到请求的截止时间，超时抛出 DeadlineExceededError；剩余时间不够退避时不再重试
+    - hold_slot=True (流式响应)：正常返回时仍占着调度器并发窗口中的位置，调用方读完整个流后
+      必须调用 release_upstream_slot(name)；抛出异常时位置已经释放
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await _call_with_retries(name, call, max_attempts, hold_slot)
+        outcome = str(getattr(result, "status_code", "ok"))
+        return result
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        cancelled_calls[name] = cancelled_calls.get(name, 0) + 1
+        raise
+    except CircuitOpenError:
+        outcome = "circuit_open"
+        raise
+    except DeadlineExceededError:
+        outcome = "deadline"
+        retry_stats["deadline_exceeded"] += 1
+        raise
+    except Exception as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream=name)
+        UPSTREAM_REQUESTS.inc(upstream=name, status=outcome)
+
+
+async def _call_with_retries(name: str, call: Callable[[], Awaitable[T]], max_attempts: int, hold_slot: bool) -> T:
+    breaker = breakers[name]
+    scheduler = get_scheduler(name)
+
+    for attempt in range(max_attempts):
+        breaker.check()
+        delay = _backoff(attempt)
+        try:
+            result = await with_deadline(scheduler.run(call, can_requeue=_take_retry, hold_slot=hold_slot))
+        except RETRYABLE_EXCEPTIONS as e:
+            breaker.record_failure()
+            if attempt == max_attempts - 1 or not _time_for_retry(delay) or not _take_retry():
+                raise
+            print(f"[Resilience] {name} error ({type(e).__name__}), retry {attempt + 1}/{max_attempts - 1}")
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        except Exception:
+            # 非网络类错误 (参数错误、解析错误等) 与调度器排队用尽的限流不重试，也不计入熔断
+            breaker.release_probe()
+            raise
+        else:
+            if is_throttled_response(result):
+                # 上游在运行，只是限流：既不算成功也不算失败
+                breaker.release_probe()
+                return result
+            status = getattr(result, "status_code", 200)
+            if not _is_failure_status(status):
+                breaker.record_success()
+                return result
+            breaker.record_failure()
+            if attempt == max_attempts - 1 or not _time_for_retry(delay) or not _take_retry():
+                return result
+            if hold_slot:
+                await scheduler.release()
+            print(f"[Resilience] {name} HTTP {status}, retry {attempt + 1}/{max_attempts - 1}")
+
+        retry_stats["retries"] += 1
+        await asyncio.sleep(delay)
+
+    raise RuntimeError("unreachable")
+
+
+async def release_upstream_slot(name: str):
+    """归还 call_upstream(..., hold_slot=True) 保留的并发位置"""
+    await get_scheduler(name).release()
+
+
+def get_resilience_stats() -> dict:
+    return {
+        "breakers": {name: b.get_stats() for name, b in breakers.items()},
+        **retry_stats,
+        "cancelled_calls": dict(cancelled_calls),
+    }
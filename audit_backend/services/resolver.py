@@ -0,0 +1,100 @@
+import os
+import asyncio
+from typing import Tuple, Optional
+from dotenv import load_dotenv
+
+from services.openalex import search_paper_on_openalex
+from services.semantic_scholar import search_paper_on_semantic_scholar
+from services.cache import paper_cache_key
+from services.singleflight import SingleFlight
+from services.resilience import deadline_expired
+
+load_dotenv()
+
+# 数据库查询策略:
+# - sequential: OpenAlex 未命中 (或年份不符) 后才查 Semantic Scholar
+# - parallel:   两者同时查询
+# - hedged:     先查 OpenAlex，超过 RESOLVE_HEDGE_MS 仍未返回再并发查询 Semantic Scholar
+RESOLVE_MODE = os.getenv("RESOLVE_MODE", "sequential")
+RESOLVE_HEDGE_MS = int(os.getenv("RESOLVE_HEDGE_MS", "800"))
+
+# 同一篇论文的并发查询 (同一文档重复引用、多个用户同时审计) 只执行一次
+resolve_flight = SingleFlight("resolve", expired=deadline_expired)
+
+
+def get_clean_year(year_val):
+    """Helper to extract 4-digit year string"""
+    return "".join(filter(str.isdigit, str(year_val or "")))
+
+
+def is_year_match(cit_year: str, result: dict) -> bool:
+    db_year = get_clean_year(result.get("year"))
+    return (cit_year == db_year) if (cit_year and db_year) else True
+
+
+def oa_is_decisive(cit_year: str, oa_result: dict) -> bool:
+    """OpenAlex 命中且年份一致时无需 Semantic Scholar 参与"""
+    return oa_result["found"] and is_year_match(cit_year, oa_result)
+
+
+def choose_best(cit_year: str, oa_result: dict, s2_result: Optional[dict]) -> Tuple[dict, str]:
+    """竞优逻辑：OpenAlex 优先；OpenAlex 未命中或年份不符且 S2 年份一致时改用 S2"""
+    if s2_result and s2_result["found"] and not oa_is_decisive(cit_year, oa_result):
+        if not oa_result["found"] or is_year_match(cit_year, s2_result):
+            return s2_result, "Semantic Scholar"
+    return oa_result, "OpenAlex"
+
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task and not task.done():
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+
+async def resolve_paper(cit, mode: Optional[str] = None) -> Tuple[dict, str]:
+    """按配置的策略查询学术数据库，返回 (best_result, source_name)；相同论文的并发查询共享结果"""
+    mode = mode or RESOLVE_MODE
+    key = (paper_cache_key(cit.title, cit.author, cit.year, cit.doi), mode)
+    return await resolve_flight.do(key, lambda: _resolve_paper(cit, mode))
+
+
+async def _resolve_paper(cit, mode: str) -> Tuple[dict, str]:
+    cit_year = get_clean_year(cit.year)
+
+    def query_oa():
+        return search_paper_on_openalex(title=cit.title, author=cit.author, year=cit.year, doi=cit.doi)
+
+    def query_s2():
+        return search_paper_on_semantic_scholar(cit.title, cit.author, doi=cit.doi)
+
+    if mode not in ("parallel", "hedged"):
+        oa_result = await query_oa()
+        if oa_is_decisive(cit_year, oa_result):
+            return oa_result, "OpenAlex"
+        return choose_best(cit_year, oa_result, await query_s2())
+
+    oa_task = asyncio.create_task(query_oa())
+    s2_task = None
+    try:
+        if mode == "parallel":
+            s2_task = asyncio.create_task(query_s2())
+        else:
+            # 对冲：给 OpenAlex 一个时间窗口，超时才追加 S2 请求
+            done, _ = await asyncio.wait({oa_task}, timeout=RESOLVE_HEDGE_MS / 1000)
+            if not done:
+                s2_task = asyncio.create_task(query_s2())
+
+        oa_result = await oa_task
+        if oa_is_decisive(cit_year, oa_result):
+            # 证据已足够，取消不再需要的 S2 请求
+            await _cancel(s2_task)
+            return oa_result, "OpenAlex"
+
+        s2_result = await (s2_task or query_s2())
+        return choose_best(cit_year, oa_result, s2_result)
+    finally:
+        await _cancel(oa_task)
+        await _cancel(s2_task)
@@ -0,0 +1,236 @@
+import os
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from dotenv import load_dotenv
+import google.api_core.exceptions
+
+from services.metrics import UPSTREAM_QUEUE_SECONDS
+from services.shared_state import SHARED_ENABLED, take_shared_token, publish_pause
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# 被限流后重新排队的最大次数；超过后把最后一次结果交还给调用方。
+# 限流 (429 / 带 Retry-After 的 503 / Gemini ResourceExhausted) 只在调度器这一层处理，
+# 弹性层 (services/resilience.py) 不再重试限流结果，也不计入熔断
+MAX_REQUEUES = int(os.getenv("UPSTREAM_MAX_REQUEUES", "3"))
+DEFAULT_THROTTLE_PAUSE = 2.0
+
+
+def is_throttled_response(result) -> bool:
+    """429，或带 Retry-After 的 503 (上游明确要求稍后再来)"""
+    status = getattr(result, "status_code", 200)
+    return status == 429 or (status == 503 and "Retry-After" in result.headers)
+
+
+class UpstreamScheduler:
+    """
+    单个上游的全局调度器 (进程内共享)：
+    - 令牌桶控制请求速率 (rate 次/秒，允许 burst 次突发)
+    - AIMD 并发窗口：成功时窗口缓慢增大，被限流时减半
+    - 被限流时按 Retry-After 暂停整个上游，请求排队等待而不是直接失败
+    - 配置 REDIS_URL 后令牌桶与暂停状态由所有进程共享 (services/shared_state.py)，并发窗口仍按进程计算
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_window: int, min_window: int = 1):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_window = max_window
+        self.min_window = min_window
+
+        self.window = float(max_window)
+        self.tokens = burst
+        self.inflight = 0
+        self.waiting = 0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+        self._pause_tasks = set()
+
+        self.stats = {"requests": 0, "throttled": 0, "requeued": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    @property
+    def cond(self) -> asyncio.Condition:
+        # 延迟创建，绑定到实际运行的事件循环
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        start = time.monotonic()
+        async with self.cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    if self._paused_until > now:
+                        timeout = self._paused_until - now
+                    elif self.inflight >= int(self.window):
+                        timeout = None
+                    elif not SHARED_ENABLED and self.tokens < 1:
+                        timeout = (1 - self.tokens) / self.rate
+                    else:
+                        if not SHARED_ENABLED:
+                            self.tokens -= 1
+                        self.inflight += 1
+                        break
+
+                    try:
+                        await asyncio.wait_for(self.cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+
+        if SHARED_ENABLED:
+            # 已占住并发窗口中的一个位置，再去集群共享的令牌桶取令牌
+            try:
+                await self._take_shared_token()
+            except BaseException:
+                await self.release()
+                raise
+
+        waited = time.monotonic() - start
+        UPSTREAM_QUEUE_SECONDS.observe(waited, upstream=self.name)
+        self.stats["requests"] += 1
+        self.stats["wait_seconds_total"] += waited
+        self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+
+    async def _take_shared_token(self):
+        while True:
+            taken = await take_shared_token(self.name, self.rate, self.burst)
+            if taken is None:
+                # Redis 不可用：退回本地令牌桶 (欠账模式，先扣再等)
+                self._refill(time.monotonic())
+                self.tokens -= 1
+                reserved, wait = True, max(0.0, -self.tokens / self.rate)
+            else:
+                reserved, wait = taken
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # 上游被暂停时没有扣令牌，暂停结束后重新取
+            if reserved:
+                return
+
+    async def release(self):
+        async with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def on_success(self):
+        # 加性增：每个窗口的请求成功后窗口 +1
+        self.window = min(self.max_window, self.window + 1 / max(self.window, 1))
+
+    def on_throttled(self, retry_after: Optional[float]):
+        # 乘性减：窗口减半，并暂停整个上游直到 Retry-After 到期
+        self.stats["throttled"] += 1
+        self.window = max(self.min_window, self.window / 2)
+        pause = retry_after if retry_after is not None else DEFAULT_THROTTLE_PAUSE
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        self.tokens = min(self.tokens, 0)
+        if SHARED_ENABLED:
+            task = asyncio.ensure_future(publish_pause(self.name, pause))
+            self._pause_tasks.add(task)
+            task.add_done_callback(self._pause_tasks.discard)
+        print(f"[Scheduler] {self.name} throttled, window → {self.window:.1f}, pausing {pause:.1f}s")
+
+    async def run(self, call: Callable[[], Awaitable[T]], can_requeue: Optional[Callable[[], bool]] = None,
+                  hold_slot: bool = False) -> T:
+        """
+        排队执行一次上游调用。call 返回 httpx.Response 或直接返回结果 (Gemini SDK)。
+        被限流时按 Retry-After 暂停后重新排队，最多 MAX_REQUEUES 次；
+        can_requeue 返回 False (例如请求的重试预算已用完) 时不再排队，直接交还限流结果。
+        hold_slot=True (流式响应)：正常返回后仍占着并发窗口中的位置，调用方读完整个流后必须调用 release()
+        """
+        for attempt in range(MAX_REQUEUES + 1):
+            last = attempt == MAX_REQUEUES
+            await self.acquire()
+            held = False
+            try:
+                result = await call()
+                held = hold_slot and not is_throttled_response(result)
+            except google.api_core.exceptions.ResourceExhausted:
+                # Gemini SDK 以异常形式返回 429
+                self.on_throttled(None)
+                if last or (can_requeue is not None and not can_requeue()):
+                    raise
+                self.stats["requeued"] += 1
+                continue
+            finally:
+                if not held:
+                    await self.release()
+
+            if not is_throttled_response(result):
+                self.on_success()
+                return result
+            self.on_throttled(parse_retry_after(result.headers.get("Retry-After")))
+            if last or (can_requeue is not None and not can_requeue()):
+                return result
+            self.stats["requeued"] += 1
+        raise RuntimeError("unreachable")
+
+    def get_stats(self) -> dict:
+        requests = self.stats["requests"]
+        return {
+            **self.stats,
+            "queue_depth": self.waiting,
+            "inflight": self.inflight,
+            "window": round(self.window, 2),
+            "wait_seconds_avg": round(self.stats["wait_seconds_total"] / requests, 4) if requests else 0.0,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After 可以是秒数，也可以是 HTTP 日期"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# 各上游的默认配额 (可用环境变量覆盖)
+# - OpenAlex polite pool: 10 次/秒
+# - Semantic Scholar 匿名: 共享配额很紧，默认 1 次/秒
+# - Gemini: 按所用套餐的 RPM 调整
+schedulers: Dict[str, UpstreamScheduler] = {
+    "openalex": UpstreamScheduler(
+        "openalex",
+        rate=float(os.getenv("OPENALEX_RATE", "10")), burst=float(os.getenv("OPENALEX_BURST", "10")),
+        max_window=int(os.getenv("OPENALEX_MAX_CONCURRENCY", "20")),
+    ),
+    "semantic_scholar": UpstreamScheduler(
+        "semantic_scholar",
+        rate=float(os.getenv("S2_RATE", "1")), burst=float(os.getenv("S2_BURST", "3")),
+        max_window=int(os.getenv("S2_MAX_CONCURRENCY", "3")),
+    ),
+    "gemini": UpstreamScheduler(
+        "gemini",
+        rate=float(os.getenv("GEMINI_RATE", "10")), burst=float(os.getenv("GEMINI_BURST", "10")),
+        max_window=int(os.getenv("GEMINI_MAX_CONCURRENCY", "20")),
+    ),
+}
+
+
+def get_scheduler(name: str) -> UpstreamScheduler:
+    return schedulers[name]
+
+
+def get_scheduler_stats() -> Dict[str, dict]:
+    return {name: s.get_stats() for name, s in schedulers.items()}
@@ -1,25 +1,102 @@
+import os
 import httpx
-import difflib
-from typing import Optional, Dict, Any
-
-
-async def search_paper_on_semantic_scholar(title: str, author: Optional[str] = None) -> Dict[str, Any]:
+from typing import Optional, Dict, Any, List
+
+from services.http_client import get_http_client
+from services.cache import paper_cache, paper_cache_key, is_cacheable_result, normalize_doi, doi_miss_key
+from services.batching import MicroBatcher, chunked
+from services.matching import MatchQuery
+from services.resilience import call_upstream
+from services.metrics import span
+
+S2_FIELDS = "title,authors,year,abstract,openAccessPdf,citationCount,url,externalIds"
+
+# /paper/batch 单次最多 500 个 ID
+S2_BATCH_SIZE = 500
+S2_BATCH_WINDOW_MS = float(os.getenv("S2_BATCH_WINDOW_MS", "25"))
+
+
+async def fetch_papers_by_ids(paper_ids: List[str], client: Optional[httpx.AsyncClient] = None) -> Dict[str, dict]:
+    """调用 /paper/batch 一次查询多个 ID (如 "DOI:10.xxx")，返回 {id: paper}"""
+    client = client or get_http_client("semantic_scholar")
+    found = {}
+    for group in chunked(paper_ids, S2_BATCH_SIZE):
+        response = await call_upstream(
+            "semantic_scholar", lambda: client.post("/graph/v1/paper/batch", params={"fields": S2_FIELDS}, json={"ids": group})
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"S2 batch API Error {response.status_code}")
+        # 返回列表与请求的 ids 一一对应，查不到的位置为 null
+        for paper_id, paper in zip(group, response.json()):
+            if paper:
+                found[paper_id] = paper
+    print(f"[Semantic Scholar] Batch lookup: {len(found)}/{len(paper_ids)} found")
+    return found
+
+
+s2_batcher = MicroBatcher("s2_ids", fetch_papers_by_ids, max_batch=S2_BATCH_SIZE, window_ms=S2_BATCH_WINDOW_MS)
+
+
+async def search_paper_on_semantic_scholar(title: str, author: Optional[str] = None,
+                                           client: Optional[httpx.AsyncClient] = None,
+                                           doi: Optional[str] = None) -> Dict[str, Any]:
+    # 先查缓存 (内存 LRU → SQLite)，S2 匿名配额很紧，命中即省下一次请求
+    cache_key = "s2:" + paper_cache_key(title, author, doi=doi)
+    cached = await paper_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
+    result = await _search_paper_on_semantic_scholar(title, author, client, doi)
+    if is_cacheable_result(result):
+        await paper_cache.set(cache_key, result, negative=not result["found"])
+    return result
+
+
+async def _search_paper_on_semantic_scholar(title: str, author: Optional[str],
+                                            client: Optional[httpx.AsyncClient],
+                                            doi: Optional[str] = None) -> Dict[str, Any]:
+    # DOI 精确查找：同一时间窗口内的 DOI 会被合并到一次 /paper/batch 请求
+    clean_doi = normalize_doi(doi)
+    doi_error = False
+    # 文档级批量解析已确认 S2 未收录的 DOI 直接走标题检索
+    if clean_doi and await paper_cache.get(doi_miss_key("s2", clean_doi)) is not None:
+        clean_doi = ""
+    if clean_doi:
+        try:
+            with span("s2.doi"):
+                paper = await s2_batcher.submit(f"DOI:{clean_doi}")
+            if paper:
+                return _format_result(paper)
+        except Exception as e:
+            print(f"[Semantic Scholar Error] {e}")
+            doi_error = True
+
+    with span("s2.title"):
+        result = await _search_by_title(title, author, client)
+    # DOI 查询失败时，标题未命中的结果不可写入负缓存
+    if doi_error and not result["found"]:
+        result["upstream_error"] = True
+    return result
+
+
+async def _search_by_title(title: str, author: Optional[str], client: Optional[httpx.AsyncClient]) -> Dict[str, Any]:
     if not title or len(title) < 3:
         return {"found": False, "reason": "Title too short"}
 
-    url = "https://api.semanticscholar.org/graph/v1/paper/search"
+    client = client or get_http_client("semantic_scholar")
+    url = "/graph/v1/paper/search"
     params = {
         "query": title,
         "limit": 5,
-        "fields": "title,authors,year,abstract,openAccessPdf,citationCount,url,externalIds"
+        "fields": S2_FIELDS
     }
 
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            response = await client.get(url, params=params)
+        # S2 匿名配额很紧：经调度器排队并按 Retry-After 等待，网络错误退避重试，熔断时快速失败
+        response = await call_upstream("semantic_scholar", lambda: client.get(url, params=params))
 
         if response.status_code != 200:
-            return {"found": False, "reason": f"S2 API Error {response.status_code}"}
+            return {"found": False, "reason": f"S2 API Error {response.status_code}", "upstream_error": True}
 
         data = response.json()
         results = data.get("data", [])
@@ -28,30 +105,16 @@ async def search_paper_on_semantic_scholar(title: str, author: Optional[str] = N
             return {"found": False, "reason": "Not found in Semantic Scholar"}
 
         # --- 筛选逻辑 ---
-        # 复用 OpenAlex 的筛选思路：优先匹配作者
+        # 与 OpenAlex 共用同一套打分规则：优先匹配作者
         best_match = None
 
-        clean_title = title.lower().replace('"', '').replace("'", "").strip()
-
-        for paper in results:
-            paper_authors = [a["name"] for a in paper.get("authors", [])]
-            paper_title = paper.get("title", "") or ""
-
-            # 作者匹配
-            author_match = False
-            if author:
-                q_parts = set(author.lower().replace(",", "").split())
-                for db_author in paper_authors:
-                    db_parts = set(db_author.lower().replace(",", "").split())
-                    if q_parts.intersection(db_parts):
-                        author_match = True
-                        break
-            else:
-                author_match = True  # 没提供作者就当匹配
-
-            # 标题相似度
-            title_sim = difflib.SequenceMatcher(None, clean_title, paper_title.lower()).ratio()
+        query = MatchQuery(title, author)
+        scores = query.score_candidates([
+            (paper.get("title", "") or "", [a["name"] for a in paper.get("authors", [])])
+            for paper in results
+        ])
 
+        for paper, (title_sim, author_match) in zip(results, scores):
             # 判定：作者匹配且标题相似度 > 0.6，或者标题极度相似 > 0.9
             if (author_match and title_sim > 0.6) or (title_sim > 0.9):
                 best_match = paper
@@ -60,19 +123,23 @@ async def search_paper_on_semantic_scholar(title: str, author: Optional[str] = N
         if not best_match:
             return {"found": False, "reason": "Found candidates but details mismatch"}
 
-        # 提取数据
-        return {
-            "found": True,
-            "title": best_match.get("title"),
-            "year": str(best_match.get("year", "")),
-            "authors": [a["name"] for a in best_match.get("authors", [])[:3]],
-            "abstract": best_match.get("abstract", ""),
-            "oa_url": best_match.get("openAccessPdf", {}).get("url") if best_match.get(
-                "openAccessPdf") else best_match.get("url"),
-            "cited_by_count": best_match.get("citationCount", 0),
-            "source": "Semantic Scholar"
-        }
+        return _format_result(best_match)
 
     except Exception as e:
         print(f"[Semantic Scholar Error] {e}")
-        return {"found": False, "reason": str(e)}
\ No newline at end of file
+        return {"found": False, "reason": str(e), "upstream_error": True}
+
+
+def _format_result(best_match: dict) -> dict:
+    """辅助函数：格式化 Semantic Scholar 返回的数据"""
+    return {
+        "found": True,
+        "title": best_match.get("title"),
+        "year": str(best_match.get("year", "")),
+        "authors": [a["name"] for a in best_match.get("authors", [])[:3]],
+        "abstract": best_match.get("abstract", ""),
+        "oa_url": best_match.get("openAccessPdf", {}).get("url") if best_match.get(
+            "openAccessPdf") else best_match.get("url"),
+        "cited_by_count": best_match.get("citationCount", 0),
+        "source": "Semantic Scholar"
+    }
\ No newline at end of file
@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 可续传的审计会话：每条审计结果一产生就写入 SQLite。
+# 客户端断线后带同一会话 ID 重新提交同一段文本，已完成的结果立即重放，只计算尚未完成的引用；
+# 提取结果也一并保存，提取已完成时续传不再调用 Gemini。
+# 增量模式：同一会话提交修改后的文本时开启新一轮 (revision)，内容未变的引用直接复用上一轮的结果，
+# 只审计新增或改动过的引用。
+# AUDIT_SESSION_DB 为空则关闭该功能
+AUDIT_SESSION_DB = os.getenv(
+    "AUDIT_SESSION_DB", os.path.join(os.path.dirname(__file__), "..", "cache", "audit_sessions.db")
+)
+AUDIT_SESSION_TTL = float(os.getenv("AUDIT_SESSION_TTL", str(24 * 3600)))
+
+# 客户端自带的会话 ID 只接受这种格式，否则由服务端生成
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+PURGE_INTERVAL = 300
+
+session_stats = {"created": 0, "resumed": 0, "revisions": 0, "replayed_results": 0, "reused_results": 0,
+                 "stored_results": 0, "text_mismatch": 0}
+
+
+def text_fingerprint(text: str) -> str:
+    normalized = " ".join(unicodedata.normalize("NFKC", text or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def citation_key(raw_text: str) -> str:
+    """会话内标识一条引用：按原文归一化后哈希 (续传时重新提取的同一引用得到相同的 key)"""
+    normalized = " ".join(unicodedata.normalize("NFKC", raw_text or "").casefold().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def citation_fingerprint(citation: dict) -> str:
+    """
+    引用内容指纹：只覆盖从原文提取的字段 (不含序号 id)，任一字段改动都会重新审计。
+    summary_intent 是 Gemini 的转述，文本其他部分改动后同一引用也可能得到不同措辞，不计入指纹
+    """
+    def norm(value) -> str:
+        return " ".join(unicodedata.normalize("NFKC", str(value or "")).casefold().split())
+
+    payload = json.dumps(
+        [norm(citation.get(field)) for field in ("raw_text", "title", "author", "year", "doi")]
+        + [norm(claim) for claim in citation.get("specific_claims") or []],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_final_result(result: dict) -> bool:
+    """出错或因截止时间未完成的结果不保存，续传时重新计算"""
+    if result.get("status") == "ERROR":
+        return False
+    return (result.get("metadata") or {}).get("reason") != "deadline"
+
+
+class AuditSession:
+    def __init__(self, store: "SessionStore", session_id: str, results: List[dict],
+                 citations: Optional[List[dict]], resumed: bool, previous: Optional[Dict[str, dict]] = None):
+        self.store = store
+        self.id = session_id
+        self.resumed = resumed
+        # 已完成的结果 (按完成顺序)，续传时先重放
+        self.results = [entry["result"] for entry in results]
+        self.done = {entry["key"] for entry in results}
+        # 完整的提取结果；提取未完成时为 None
+        self.citations = citations
+        # 本会话历史上审计过的结果 (内容指纹 → 结果)，内容未变的引用直接复用
+        self.previous = previous or {}
+
+    def is_done(self, raw_text: str) -> bool:
+        return citation_key(raw_text) in self.done
+
+    def reusable_result(self, citation: dict) -> Optional[dict]:
+        result = self.previous.get(citation_fingerprint(citation))
+        if result is not None:
+            session_stats["reused_results"] += 1
+        return result
+
+    def save_result(self, citation: dict, result: dict):
+        if not is_final_result(result):
+            return
+        key = citation_key(citation["raw_text"])
+        if key in self.done:
+            return
+        self.done.add(key)
+        self.store.save_result(self.id, key, citation_fingerprint(citation), result)
+
+    def save_citations(self, citations: List[dict]):
+        self.citations = citations
+        self.store.save_citations(self.id, citations)
+
+
+class SessionStore:
+    """SQLite 存储 (WAL)，同一主机上的多个 worker 可共享"""
+
+    def __init__(self, db_path: str, ttl: float = AUDIT_SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS audit_sessions "
+            "(id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, citations TEXT, expires_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS audit_session_results "
+            "(session_id TEXT NOT NULL, seq INTEGER NOT NULL, key TEXT NOT NULL, result TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, key))"
+        )
+        # 按内容指纹保存会话内所有轮次的结果，跨轮次复用 (改回旧版本的引用同样命中)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS audit_session_history "
+            "(session_id TEXT NOT NULL, fingerprint TEXT NOT NULL, result TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, fingerprint))"
+        )
+
+    def open(self, session_id: Optional[str], text: str, incremental: bool = False) -> AuditSession:
+        """
+        打开会话：ID 存在且文本一致时续传；文本不一致且 incremental=True 时开启新一轮；否则新建会话
+        (ID 不存在时沿用客户端给的 ID，文本不一致时换一个新 ID，避免覆盖或泄露旧结果)
+        """
+        self._maybe_purge()
+        fingerprint = text_fingerprint(text)
+        now = time.time()
+
+        if session_id and _SESSION_ID_RE.match(session_id):
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT fingerprint, citations, expires_at FROM audit_sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+            if row and row[2] > now and row[0] == fingerprint:
+                return self._resume(session_id, row[1])
+            if row and row[2] > now and incremental:
+                return self._revise(session_id, fingerprint)
+            if row and row[2] > now:
+                session_stats["text_mismatch"] += 1
+                session_id = None
+        else:
+            session_id = None
+
+        session_id = session_id or uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("DELETE FROM audit_session_results WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM audit_session_history WHERE session_id = ?", (session_id,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO audit_sessions (id, fingerprint, citations, expires_at) VALUES (?, ?, NULL, ?)",
+                (session_id, fingerprint, now + self.ttl)
+            )
+        session_stats["created"] += 1
+        return AuditSession(self, session_id, [], None, resumed=False)
+
+    def _resume(self, session_id: str, citations: Optional[str]) -> AuditSession:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, result FROM audit_session_results WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            # 续传即视为仍在使用，顺延过期时间
+            self._db.execute("UPDATE audit_sessions SET expires_at = ? WHERE id = ?",
+                             (time.time() + self.ttl, session_id))
+        results = [{"key": key, "result": json.loads(result)} for key, result in rows]
+        session_stats["resumed"] += 1
+        session_stats["replayed_results"] += len(results)
+        print(f"[Session] Resuming {session_id}: {len(results)} results replayed, "
+              f"extraction {'cached' if citations is not None else 'pending'}")
+        return AuditSession(self, session_id, results, json.loads(citations) if citations else None, resumed=True,
+                            previous=self._load_history(session_id))
+
+    def _revise(self, session_id: str, fingerprint: str) -> AuditSession:
+        """文本已修改：清空本轮结果与提取缓存，历史结果保留供复用"""
+        with self._lock:
+            self._db.execute("DELETE FROM audit_session_results WHERE session_id = ?", (session_id,))
+            self._db.execute(
+                "UPDATE audit_sessions SET fingerprint = ?, citations = NULL, expires_at = ? WHERE id = ?",
+                (fingerprint, time.time() + self.ttl, session_id)
+            )
+        previous = self._load_history(session_id)
+        session_stats["revisions"] += 1
+        print(f"[Session] New revision of {session_id}: {len(previous)} earlier results available for reuse")
+        return AuditSession(self, session_id, [], None, resumed=False, previous=previous)
+
+    def _load_history(self, session_id: str) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT fingerprint, result FROM audit_session_history WHERE session_id = ?", (session_id,)
+            ).fetchall()
+        return {fingerprint: json.loads(result) for fingerprint, result in rows}
+
+    def save_result(self, session_id: str, key: str, fingerprint: str, result: dict):
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO audit_session_results (session_id, seq, key, result) "
+                "VALUES (?, (SELECT COUNT(*) FROM audit_session_results WHERE session_id = ?), ?, ?)",
+                (session_id, session_id, key, payload)
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO audit_session_history (session_id, fingerprint, result) VALUES (?, ?, ?)",
+                (session_id, fingerprint, payload)
+            )
+        session_stats["stored_results"] += 1
+
+    def save_citations(self, session_id: str, citations: List[dict]):
+        with self._lock:
+            self._db.execute("UPDATE audit_sessions SET citations = ? WHERE id = ?",
+                             (json.dumps(citations, ensure_ascii=False), session_id))
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        with self._lock:
+            for table in ("audit_session_results", "audit_session_history"):
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE session_id IN "
+                    "(SELECT id FROM audit_sessions WHERE expires_at <= ?)", (now,)
+                )
+            self._db.execute("DELETE FROM audit_sessions WHERE expires_at <= ?", (now,))
+
+
+session_store: Optional[SessionStore] = SessionStore(AUDIT_SESSION_DB) if AUDIT_SESSION_DB else None
+
+
+def get_session_stats() -> Dict[str, int]:
+    return {"enabled": session_store is not None, **session_stats}
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+from typing import Any, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Redis 为可选依赖 (pip install redis)，没有时全部退回进程内实现
+try:
+    import redis.asyncio as redis_asyncio
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis_asyncio = None
+    REDIS_AVAILABLE = False
+
+# 多 worker / 多副本共享状态：设置 REDIS_URL (任何兼容 Redis 协议的服务) 后
+# - slowapi 的按 IP 限流计数存入 Redis，所有进程共用同一个配额
+# - 论文 / 判定缓存在内存 LRU 与 SQLite 之间多一个共享层
+# - 上游令牌桶在 Redis 中原子扣减，*_RATE / *_BURST 变为整个集群的总配额；429 暂停同步到所有进程
+# 并发窗口 (AIMD) 仍按进程计算
+REDIS_URL = os.getenv("REDIS_URL", "")
+SHARED_KEY_PREFIX = os.getenv("SHARED_KEY_PREFIX", "veru:")
+# Redis 出错后在这段时间内直接走本地实现，避免每次请求都等待超时
+SHARED_RETRY_SECONDS = float(os.getenv("SHARED_RETRY_SECONDS", "5"))
+SHARED_TIMEOUT = float(os.getenv("SHARED_TIMEOUT", "0.5"))
+
+SHARED_ENABLED = bool(REDIS_URL) and REDIS_AVAILABLE
+if REDIS_URL and not REDIS_AVAILABLE:
+    print("[Shared State] REDIS_URL is set but the redis package is not installed; using per-process state")
+
+shared_stats = {"commands": 0, "errors": 0, "fallbacks": 0, "bucket_waits": 0, "pauses_published": 0}
+
+_client = None
+_unhealthy_until = 0.0
+
+# 令牌桶：按服务器时间补充令牌，返回 {是否已取得令牌, 需要等待的秒数}。
+# - 欠账模式：桶空时也先扣令牌 (预留未来的令牌)，调用方等待后直接发请求
+# - 上游被暂停 (429) 时不扣令牌，返回剩余暂停时间，调用方等待后重新取
+_TOKEN_BUCKET_LUA = """
+local pause_ms = redis.call('PTTL', KEYS[2])
+if pause_ms > 0 then
+    return {0, tostring(pause_ms / 1000)}
+end
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return {1, tostring(math.max(0, -tokens / rate))}
+"""
+
+
+def shared_key(*parts: str) -> str:
+    return SHARED_KEY_PREFIX + ":".join(parts)
+
+
+def limiter_storage_uri() -> str:
+    """slowapi / limits 的存储地址 (limits 的 Redis 存储同样依赖 redis 包)"""
+    return REDIS_URL if SHARED_ENABLED else "memory://"
+
+
+def get_shared_client():
+    """返回共享的 Redis 客户端；未启用或最近出错 (冷却期内) 时返回 None"""
+    global _client
+    if not SHARED_ENABLED or time.monotonic() < _unhealthy_until:
+        return None
+    if _client is None:
+        _client = redis_asyncio.from_url(
+            REDIS_URL, decode_responses=True,
+            socket_timeout=SHARED_TIMEOUT, socket_connect_timeout=SHARED_TIMEOUT,
+        )
+    return _client
+
+
+def _mark_unhealthy(action: str, error: Exception):
+    global _unhealthy_until
+    shared_stats["errors"] += 1
+    _unhealthy_until = time.monotonic() + SHARED_RETRY_SECONDS
+    print(f"[Shared State Error] {action}: {error}; using per-process state for {SHARED_RETRY_SECONDS:.0f}s")
+
+
+async def shared_get(key: str) -> Optional[Any]:
+    """读取 JSON 值；未命中、未启用或出错时返回 None"""
+    client = get_shared_client()
+    if client is None:
+        return None
+    try:
+        shared_stats["commands"] += 1
+        raw = await client.get(key)
+    except Exception as e:
+        _mark_unhealthy("GET", e)
+        return None
+    return json.loads(raw) if raw is not None else None
+
+
+async def shared_set(key: str, value: Any, ttl: float):
+    client = get_shared_client()
+    if client is None or ttl <= 0:
+        return
+    try:
+        shared_stats["commands"] += 1
+        await client.set(key, json.dumps(value, ensure_ascii=False), px=int(ttl * 1000))
+    except Exception as e:
+        _mark_unhealthy("SET", e)
+
+
+async def take_shared_token(name: str, rate: float, burst: float) -> Optional[Tuple[bool, float]]:
+    """
+    从集群共享的令牌桶取一个令牌，返回 (是否已预留令牌, 需要等待的秒数)；
+    返回 None 表示共享状态不可用，调用方改用本地令牌桶。
+    """
+    client = get_shared_client()
+    if client is None:
+        shared_stats["fallbacks"] += 1
+        return None
+    try:
+        shared_stats["commands"] += 1
+        reserved, wait = await client.eval(
+            _TOKEN_BUCKET_LUA, 2, shared_key("bucket", name), shared_key("pause", name), rate, burst
+        )
+    except Exception as e:
+        _mark_unhealthy("token bucket", e)
+        shared_stats["fallbacks"] += 1
+        return None
+    wait = float(wait)
+    if wait > 0:
+        shared_stats["bucket_waits"] += 1
+    return bool(int(reserved)), wait
+
+
+async def publish_pause(name: str, seconds: float):
+    """上游返回 429 时让所有进程一起暂停 (只会延长，不会缩短已有的暂停)"""
+    client = get_shared_client()
+    if client is None or seconds <= 0:
+        return
+    key = shared_key("pause", name)
+    try:
+        shared_stats["commands"] += 1
+        remaining = await client.pttl(key)
+        if remaining < seconds * 1000:
+            await client.set(key, "1", px=int(seconds * 1000))
+            shared_stats["pauses_published"] += 1
+    except Exception as e:
+        _mark_unhealthy("pause", e)
+
+
+async def close_shared_state():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_shared_state_stats() -> dict:
+    return {
+        "enabled": SHARED_ENABLED,
+        "healthy": SHARED_ENABLED and time.monotonic() >= _unhealthy_until,
+        **shared_stats,
+    }
@@ -0,0 +1,103 @@
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 进行中请求合并：相同 key 的并发调用只执行一次，结果共享 (设为 0 关闭)
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT", "1") == "1"
+
+_registry: List["SingleFlight"] = []
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # 执行结束时发起者的截止时间已过：结果可能是被截断的部分结果
+        self.cut_short = False
+
+
+class SingleFlight:
+    """
+    进行中请求合并 (singleflight)：
+    - 同一 key 正在执行时，后来的调用直接等待同一个任务的结果 (或异常)
+    - 任务完成后立即移除，之后的调用重新执行 (结果复用交给缓存层)
+    - 引用计数：单个等待者被取消不影响其他等待者；最后一个等待者离开时才取消任务
+    - 任务复制发起者的 context (截止时间、重试预算、耗时汇总)，上游调用计入发起者。
+      传入 expired (当前 context 的截止时间是否已过) 时，执行因发起者的截止时间被截断、
+      而等待者自己仍有时间的，等待者重新执行，不接受别人的部分结果
+    """
+
+    def __init__(self, name: str, expired: Optional[Callable[[], bool]] = None):
+        self.name = name
+        self.expired = expired
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.stats = {"calls": 0, "executions": 0, "shared": 0, "waiters_cancelled": 0, "executions_cancelled": 0,
+                      "deadline_retries": 0}
+        _registry.append(self)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not SINGLEFLIGHT_ENABLED:
+            return await fn()
+
+        while True:
+            result, flight = await self._wait(key, fn)
+            if not (flight.cut_short and not self.expired()):
+                return result
+            self.stats["deadline_retries"] += 1
+
+    async def _wait(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> tuple:
+        """返回 (结果, 所等待的执行)"""
+        self.stats["calls"] += 1
+        flight = self._inflight.get(key)
+        # 已结束但完成回调尚未移除的执行不再加入
+        if flight is None or flight.task.done():
+            flight = _Flight()
+
+            async def run():
+                try:
+                    return await fn()
+                finally:
+                    # 在执行任务自己的 context 中判断：是否在发起者的截止时间之后才结束
+                    flight.cut_short = bool(self.expired and self.expired())
+
+            # 独立任务执行，不随发起者一起被取消
+            flight.task = asyncio.create_task(run())
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _task, key=key, flight=flight: self._forget(key, flight))
+            self.stats["executions"] += 1
+        else:
+            self.stats["shared"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), flight
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                self.stats["waiters_cancelled"] += 1
+            raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 没有人再需要这个结果：取消任务，并立即让出 key，避免新调用加入一个正在取消的任务
+                self._forget(key, flight)
+                flight.task.cancel()
+                self.stats["executions_cancelled"] += 1
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def get_stats(self) -> dict:
+        calls = self.stats["calls"]
+        return {
+            **self.stats,
+            "inflight": len(self._inflight),
+            "dedup_ratio": round(self.stats["shared"] / calls, 4) if calls else 0.0,
+        }
+
+
+def get_singleflight_stats() -> Dict[str, dict]:
+    return {flight.name: flight.get_stats() for flight in _registry}
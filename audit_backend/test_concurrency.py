@@ -0,0 +1,103 @@
+import asyncio
+import time
+import httpx
+
+# 并发测试：同时发出 N 个 /api/audit 请求，检查它们在时间上是否重叠。
+# 如果提取阶段阻塞了事件循环，各请求会被串行处理，时间窗口首尾相接、互不重叠。
+# 使用前先启动后端: python main.py
+# 注意: 接口限流为 10/minute，N 不要超过 10
+
+base_url = "http://127.0.0.1:8000"
+url = f"{base_url}/api/audit"
+N = 5
+
+payload = {
+    "text": "Vaswani et al. (2017) “Attention Is All You Need” 提出了 Transformer 架构，完全基于注意力机制，在 WMT 2014 英德翻译任务上取得了 28.4 BLEU。"
+}
+
+
+async def timed_audit(client: httpx.AsyncClient, idx: int, t0: float) -> dict:
+    start = time.perf_counter() - t0
+    first_byte = None
+    lines = 0
+
+    async with client.stream("POST", url, json=payload) as response:
+        status = response.status_code
+        async for line in response.aiter_lines():
+            if first_byte is None:
+                first_byte = time.perf_counter() - t0
+            if line.strip():
+                lines += 1
+
+    end = time.perf_counter() - t0
+    return {"idx": idx, "status": status, "start": start, "first_byte": first_byte, "end": end, "lines": lines}
+
+
+async def run():
+    t0 = time.perf_counter()
+    async with httpx.AsyncClient(timeout=120) as client:
+        results = await asyncio.gather(*[timed_audit(client, i, t0) for i in range(N)])
+
+    print(f"{'#':>3} {'status':>6} {'start':>8} {'first':>8} {'end':>8} {'lines':>6}")
+    for r in results:
+        first = f"{r['first_byte']:.2f}" if r["first_byte"] is not None else "-"
+        print(f"{r['idx']:>3} {r['status']:>6} {r['start']:>8.2f} {first:>8} {r['end']:>8.2f} {r['lines']:>6}")
+
+    ok = [r for r in results if r["status"] == 200]
+    if len(ok) < 2:
+        print("成功的请求不足 2 个，无法判断是否重叠")
+        return
+
+    # 首字节时间 ≈ 该请求第一条引用被提取并审计完的时间。
+    # 如果请求是串行处理的，第 k 个请求要等前面 k-1 个处理完，首字节会依次错开 (≥ 2 倍最快值)；
+    # 并发时所有请求的首字节应几乎同时到达。
+    first_bytes = [r["first_byte"] for r in ok if r["first_byte"] is not None]
+    fastest = min(first_bytes)
+    slowest = max(first_bytes)
+    total = max(r["end"] for r in ok)
+    serial_sum = sum(r["end"] - r["start"] for r in ok)
+
+    print(f"\n首字节: 最快 {fastest:.2f}s, 最慢 {slowest:.2f}s")
+    print(f"总耗时: {total:.2f}s, 各请求耗时之和: {serial_sum:.2f}s")
+
+    if slowest < 2 * fastest:
+        print(f"✅ {len(ok)} 个请求的处理在时间上重叠，服务端是并发处理的")
+    else:
+        print("❌ 请求被依次处理，事件循环可能被阻塞")
+
+
+async def check_job_stream():
+    """批量任务的 NDJSON 推送：提交任务后订阅 /api/jobs/{id}/stream，应返回 200 并推送每条结果直到任务结束"""
+    async with httpx.AsyncClient(timeout=120) as client:
+        response = await client.post(f"{base_url}/api/jobs", json=payload)
+        if response.status_code != 202:
+            print(f"❌ 提交任务失败: {response.status_code} {response.text[:200]}")
+            return
+        job = response.json()
+
+        lines = 0
+        async with client.stream("GET", f"{base_url}/api/jobs/{job['job_id']}/stream") as stream:
+            status = stream.status_code
+            async for line in stream.aiter_lines():
+                if line.strip():
+                    lines += 1
+
+        summary = (await client.get(f"{base_url}/api/jobs/{job['job_id']}")).json()
+
+    if status == 200 and lines == summary["completed"]:
+        print(f"✅ 任务流式接口正常: 推送 {lines} 条结果，任务状态 {summary['status']}")
+    else:
+        print(f"❌ 任务流式接口异常: HTTP {status}, 推送 {lines} 条, 任务已完成 {summary.get('completed')} 条")
+
+
+async def main():
+    await run()
+    print()
+    await check_job_stream()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        print(f"连接失败: {e}")